@@ -4,6 +4,10 @@ Created on 24 May 2015
 @author: Univer
 '''
 
+import time
+import random
+import threading
+import unittest
 from common.logging import Logger
 from cassandra.cluster import Cluster
 
@@ -29,3 +33,165 @@ class CassandraSession(object):
         
     def execute(self, query, parameters = None, trace = False):
         return self.session.execute(query, parameters = parameters, trace = trace)
+
+
+class CassandraAsyncWriter(object):
+    '''
+    Executes writes asynchronously with up to max_in_flight requests outstanding, so that rows are not written one round trip at a time.
+    write() blocks while the window is full. A failed write is sent again up to max_retries times before it is counted as failed,
+    after a jittered exponential backoff so that an overloaded node is not hit again at once. A write keeps its place in the window while it waits.
+
+    Usage:
+        writer = CassandraAsyncWriter(session)
+        for parameters in rows:
+            writer.write(statement, parameters)
+        writer.flush()
+    '''
+    logger = Logger.get_logger(__name__)
+
+    def __init__(self, session, max_in_flight = 128, max_retries = 3, max_failures_kept = 100, base_delay = 0.1, max_delay = 5.0):
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_failures_kept = max_failures_kept
+        self.failures = []
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._started = None
+        self._counters = { "requests": 0, "written": 0, "retries": 0, "failed": 0 }
+
+    def write(self, statement, parameters = None, rows = 1):
+        '''
+        Sends a write once the window allows it. rows is the number of rows the statement writes, e.g. for a batch, and is used for the stats.
+        '''
+        self._window.acquire()
+        with self._condition:
+            if self._started == None:
+                self._started = time.time()
+            self._in_flight = self._in_flight + 1
+        self._send(statement, parameters, rows, 0)
+
+    def _send(self, statement, parameters, rows, attempt):
+        with self._condition:
+            self._counters["requests"] = self._counters["requests"] + 1
+        try:
+            future = self.session.execute_async(statement, parameters)
+        except Exception as e:
+            self._on_error(e, statement, parameters, rows, attempt)
+            return
+        future.add_callbacks(self._on_success, self._on_error, callback_args = (rows,), errback_args = (statement, parameters, rows, attempt))
+
+    def get_backoff_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _on_success(self, _, rows):
+        self._done("written", rows)
+
+    def _on_error(self, error, statement, parameters, rows, attempt):
+        if attempt < self.max_retries:
+            with self._condition:
+                self._counters["retries"] = self._counters["retries"] + 1
+            # the errback runs on the driver's event loop, which must not sleep
+            timer = threading.Timer(self.get_backoff_delay(attempt), self._send, (statement, parameters, rows, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._condition:
+            if len(self.failures) < self.max_failures_kept:
+                self.failures.append((statement if parameters == None else parameters, error))
+        CassandraAsyncWriter.logger.debug("Write failed after %d attempt(s): %s" % (attempt + 1, error))
+        self._done("failed", rows)
+
+    def _done(self, counter, rows):
+        with self._condition:
+            self._counters[counter] = self._counters[counter] + rows
+            self._in_flight = self._in_flight - 1
+            if self._in_flight == 0:
+                self._condition.notify_all()
+        self._window.release()
+
+    def flush(self):
+        '''
+        Waits until all writes are acknowledged or have failed, and returns the stats
+        '''
+        with self._condition:
+            while self._in_flight > 0:
+                self._condition.wait()
+        return self.get_stats()
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self._counters)
+            stats["in_flight"] = self._in_flight
+            elapsed = time.time() - self._started if self._started != None else 0
+        stats["rows_per_second"] = stats["written"] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        CassandraAsyncWriter.logger.info("%d row(s) written in %d request(s), %d retries, %d row(s) failed, %.1f row(s) per second" \
+                                         % (stats["written"], stats["requests"], stats["retries"], stats["failed"], stats["rows_per_second"]))
+
+
+class CassandraAsyncWriterTests(unittest.TestCase):
+
+    class FakeFuture(object):
+
+        def __init__(self, error):
+            self.error = error
+
+        def add_callbacks(self, callback, errback, callback_args = (), errback_args = ()):
+            threading.Timer(0.001, lambda: errback(self.error, *errback_args) if self.error != None else callback(None, *callback_args)).start()
+
+    class FakeSession(object):
+
+        def __init__(self, failures):
+            self.failures = dict(failures)
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self._lock = threading.Lock()
+
+        def execute_async(self, statement, parameters):
+            with self._lock:
+                self.in_flight = self.in_flight + 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                remaining = self.failures.get(parameters, 0)
+                if remaining > 0:
+                    self.failures[parameters] = remaining - 1
+            future = CassandraAsyncWriterTests.FakeFuture(Exception("timeout") if remaining > 0 else None)
+            original = future.add_callbacks
+            def add_callbacks(callback, errback, callback_args = (), errback_args = ()):
+                def done(function):
+                    def wrapper(*args):
+                        with self._lock:
+                            self.in_flight = self.in_flight - 1
+                        function(*args)
+                    return wrapper
+                original(done(callback), done(errback), callback_args, errback_args)
+            future.add_callbacks = add_callbacks
+            return future
+
+    def test_window_and_retries(self):
+        session = CassandraAsyncWriterTests.FakeSession({ 3: 2, 5: 10 })
+        writer = CassandraAsyncWriter(session, max_in_flight = 4, max_retries = 3, base_delay = 0.01)
+        for x in range(50):
+            writer.write("insert", x)
+        stats = writer.flush()
+        assert session.max_in_flight <= 4
+        assert stats["written"] == 49
+        assert stats["failed"] == 1
+        assert stats["retries"] == 5
+        assert stats["requests"] == 55
+        assert stats["in_flight"] == 0
+        assert [parameters for parameters, _ in writer.failures] == [5]
+
+    def test_backoff_delay(self):
+        writer = CassandraAsyncWriter(None, base_delay = 1, max_delay = 8)
+        for attempt in range(6):
+            delay = writer.get_backoff_delay(attempt)
+            cap = min(8, 2 ** attempt)
+            assert cap / 2 <= delay <= cap
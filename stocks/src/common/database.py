@@ -1,9 +1,15 @@
 from sqlalchemy.engine import create_engine
+from sqlalchemy import event
+import os
 import unittest
+import tempfile
+import sqlite3
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import datetime
+import itertools
 import abc
-from _pyio import __metaclass__
 from common.override import override
 
 class DatabaseInterface(object):
@@ -51,22 +57,122 @@ class DatabaseInterface(object):
         """
         trans = DatabaseTransactionHolder(self.__engine)
         return trans
-    
-    def select_dataframe(self, sql):
+
+    def get_table_metadata(self, table_name):
         """
-        Executes a SQL query and dumps the result into a pandas DataFrame
-        
+        Returns the cached metadata of a table
+
+        Raises
+        ------
+        DatabaseTableMetadataError : Error occured when retrieving database metadata
+        """
+        return TableMetadata.get(self.__engine, table_name)
+
+    def select_dataframe(self, sql, chunk_size = None, dtypes = None, expected_rows = None):
+        """
+        Executes a SQL query and dumps the result into a pandas DataFrame.
+        If chunk_size or dtypes is given, the result is streamed in chunks (see iter_select_dataframe) and concatenated.
+
         Parameters
         ----------
         sql : str
             The SQL to execute
-        
+
+        chunk_size : int, default None
+            The number of rows fetched at a time, 100000 if only dtypes is given
+
+        dtypes : dict of str : dtype, default None
+            The dtype of columns, applied to each chunk as it is fetched
+
+        expected_rows : int, default None
+            The expected number of rows. If given, the columns of numpy dtypes are copied into arrays of this size as chunks are fetched
+            (grown if the result is larger), rather than concatenated once all chunks are fetched, so that the chunks do not pile up in memory
+
         Returns
         -------
         df : DataFrame
         """
-        df = pd.read_sql_query(sql, self.__engine)
-        return df
+        if chunk_size is None and dtypes is None:
+            df = pd.read_sql_query(sql, self.__engine)
+            return df
+        chunks = self.iter_select_dataframe(sql, chunk_size if chunk_size is not None else 100000, dtypes)
+        return DatabaseInterface._concatenate_dataframes(chunks, expected_rows)
+
+    def iter_select_dataframe(self, sql, chunk_size = 100000, dtypes = None):
+        """
+        Executes a SQL query with a server-side cursor and yields the result as pandas DataFrames of up to chunk_size rows,
+        so that only one chunk of the result is in memory at a time
+
+        Usage:
+            # replace 'database' with concrete DatabaseInterface sub-class instance
+            for df in database.iter_select_dataframe("<sql>", dtypes = { 'symbol': 'category', 'close': 'float32', 'date': 'datetime64[ns]' }):
+                ...
+
+        Parameters
+        ----------
+        sql : str
+            The SQL to execute
+
+        chunk_size : int, default 100000
+            The number of rows fetched at a time
+
+        dtypes : dict of str : dtype, default None
+            The dtype of columns, applied to each chunk as it is fetched. Categories differ between chunks unless given as a CategoricalDtype
+        """
+        conn = self.__engine.connect().execution_options(stream_results = True)
+        try:
+            for df in pd.read_sql_query(sql, conn, chunksize = chunk_size):
+                if dtypes:
+                    df = df.astype(dict((column, dtype) for column, dtype in dtypes.items() if column in df.columns))
+                yield df
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _concatenate_dataframes(chunks, expected_rows = None):
+        """
+        Concatenates data frames with the same columns. Categorical columns are concatenated with the union of their categories.
+        If expected_rows is given, columns of numpy dtypes are copied into pre-sized arrays as the chunks come.
+        """
+        columns = None
+        arrays = {}
+        parts = {}
+        rows = 0
+        for df in chunks:
+            if columns is None:
+                columns = list(df.columns)
+                for column in columns:
+                    if expected_rows is not None and isinstance(df[column].dtype, np.dtype):
+                        arrays[column] = np.empty(expected_rows, dtype = df[column].dtype)
+                    else:
+                        parts[column] = []
+            end = rows + len(df)
+            for column in list(arrays.keys()):
+                array = arrays[column]
+                if df[column].dtype != array.dtype:
+                    parts[column] = [pd.Series(array[:rows], name = column)]
+                    del arrays[column]
+                    continue
+                if end > len(array):
+                    grown = np.empty(max(end, 2 * len(array)), dtype = array.dtype)
+                    grown[:rows] = array[:rows]
+                    array = arrays[column] = grown
+                array[rows:end] = df[column].to_numpy()
+            for column in parts:
+                parts[column].append(df[column])
+            rows = end
+
+        if columns is None:
+            return pd.DataFrame()
+        result = {}
+        for column in columns:
+            if column in arrays:
+                result[column] = arrays[column][:rows]
+            elif len(parts[column]) > 0 and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts[column]):
+                result[column] = union_categoricals([part.array for part in parts[column]])
+            else:
+                result[column] = pd.concat(parts[column], ignore_index = True)
+        return pd.DataFrame(result, columns = columns)
     
     def insert_dataframe(self, dataframe, table_name, exclude_columns = [], create_table_if_not_exist=False):
         """
@@ -87,7 +193,7 @@ class DatabaseInterface(object):
             Whether or not to create the database table if it does not exist
         """
         try:
-            metadata = TableMetadata.get(self.__engine, table_name)
+            metadata = self.get_table_metadata(table_name)
         except DatabaseTableMetadataError as e:
             if not create_table_if_not_exist:
                 raise e
@@ -147,6 +253,32 @@ class DatabaseInterface(object):
             result = conn.execute(sql)
             return result
         
+    @staticmethod
+    def _iter_parameters(dataframe, columns, datetime_format = None):
+        """
+        Returns an iterator of the values of each row in the given columns as tuples, with NaN / NaT as None and numpy scalars as Python values.
+        Datetimes are formatted with datetime_format if given.
+        """
+        values = []
+        for column in columns:
+            series = dataframe[column]
+            if datetime_format is not None and pd.api.types.is_datetime64_any_dtype(series):
+                series = series.dt.strftime(datetime_format)
+            values.append(series.astype(object).where(series.notnull(), None).tolist())
+        return zip(*values)
+
+    @staticmethod
+    def _iter_chunks(rows, chunk_size):
+        """
+        Yields lists of up to chunk_size rows
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
     @staticmethod
     def _create_staging_table_name(table_name, persist_between_connections=False):
         if persist_between_connections:
@@ -158,16 +290,73 @@ class DatabaseInterface(object):
 
 class MSSQLDatabaseInterface(DatabaseInterface):
     
-    def __init__(self, connector):
+    def __init__(self, connector, bulk_load = True, chunk_size = 10000):
+        """
+        Initializes this MSSQLDatabaseInterface instance
+        
+        Parameters
+        ----------
+        connector : DatabaseConnector
+            The connector creating the SQLAlchemy engine
+        
+        bulk_load : bool, default True
+            Whether merge_dataframe loads the staging table with chunked fast_executemany inserts on the connection running the MERGE,
+            rather than with DataFrame.to_sql
+        
+        chunk_size : int, default 10000
+            The number of rows sent per executemany when bulk loading
+        """
         self.__engine = connector.create_engine()
+        self.bulk_load = bulk_load
+        self.chunk_size = chunk_size
         super(MSSQLDatabaseInterface, self).__init__(self.__engine)
     
+    @staticmethod
+    def _create_merge_sql(metadata, staging_table_name, match_columns, exclude_columns, additional_columns, src_alias, dest_alias):
+        merge_sql = '''
+        MERGE INTO {dest_name} {dest_alias}
+        USING {src_name} {src_alias}
+        ON {match_clause}
+        WHEN MATCHED THEN
+        UPDATE SET {update_clause}
+        WHEN NOT MATCHED THEN
+        INSERT ({insert_columns}) VALUES ({insert_values})
+        ;'''
+        return merge_sql.format(
+            dest_name = metadata.table_name,
+            dest_alias = dest_alias,
+            src_name = staging_table_name,
+            src_alias = src_alias,
+            match_clause = ' AND '.join("%s.%s = %s.%s" % (src_alias, x, dest_alias, x) for x in match_columns),
+            update_clause = ', '.join('%s = %s.%s' % (x, src_alias, x) for x in metadata.non_identity_columns if x not in match_columns and x not in exclude_columns) \
+                + ''.join(", %s = %s" % (k, v) for k, v in additional_columns.items()),
+            insert_columns = ', '.join(x for x in metadata.non_identity_columns if x not in exclude_columns) \
+                + ''.join(", %s" % k for k in additional_columns.keys()),
+            insert_values = ', '.join('%s.%s' % (src_alias, x) for x in metadata.non_identity_columns if x not in exclude_columns) \
+                + ''.join(", %s" % v for v in additional_columns.values())
+            )
+    
     @override
-    def merge_dataframe(self, dataframe, table_name, match_columns=[], exclude_columns = [], additional_columns = {}, src_alias='src', dest_alias='dest'):
+    def merge_dataframe(self, dataframe, table_name, match_columns=[], exclude_columns = [], additional_columns = {}, src_alias='src', dest_alias='dest', chunk_size = None):
+        """
+        Merges a pandas DataFrame into a database table through a staging table.
+        In bulk load mode the staging table is a local temporary table created like the target table, and loaded with chunk_size rows
+        (the chunk_size of the interface by default) per fast_executemany, on the connection running the MERGE.
+        
+        Returns
+        -------
+        rowcount : int
+            The number of rows merged
+        """
         if match_columns == None or len(match_columns) == 0:
             raise DatabaseInterfaceError("Match columns must be provided if data frame does not have index")
-                
-        metadata = TableMetadata.get(self.__engine, table_name)
+        
+        metadata = self.get_table_metadata(table_name)
+        if self.bulk_load:
+            return self._bulk_merge_dataframe(metadata, dataframe, match_columns, exclude_columns, additional_columns, src_alias, dest_alias,
+                                              chunk_size if chunk_size != None else self.chunk_size)
+        
+        conn = None
         try:
             conn = self.__engine.connect()
             staging_table_name = DatabaseInterface._create_staging_table_name(table_name, persist_between_connections=True)
@@ -181,35 +370,110 @@ class MSSQLDatabaseInterface(DatabaseInterface):
             rowcount = conn.execute("select count(*) from %s" % staging_table_name).fetchone()[0]
             print("Inserted %d row(s) into %s" % (rowcount, staging_table_name))
             
-            merge_sql = '''
-            MERGE INTO {dest_name} {dest_alias}
-            USING {src_name} {src_alias}
-            ON {match_clause}
-            WHEN MATCHED THEN
-            UPDATE SET {update_clause}
-            WHEN NOT MATCHED THEN
-            INSERT ({insert_columns}) VALUES ({insert_values})
-            ;'''
-            sql = merge_sql.format(
-                dest_name = metadata.table_name,
-                dest_alias = dest_alias,
-                src_name = staging_table_name,
-                src_alias = src_alias,
-                match_clause = ' AND '.join("%s.%s = %s.%s" % (src_alias, x, dest_alias, x) for x in match_columns),
-                update_clause = ', '.join('%s = %s.%s' % (x, src_alias, x) for x in metadata.non_identity_columns if x not in match_columns and x not in exclude_columns) \
-                    + ''.join(", %s = %s" % (k, v) for k, v in additional_columns.iteritems()),
-                insert_columns = ', '.join(x for x in metadata.non_identity_columns if x not in exclude_columns) \
-                    + ''.join(", %s" % k for k in additional_columns.keys()),
-                insert_values = ', '.join('%s.%s' % (src_alias, x) for x in metadata.non_identity_columns if x not in exclude_columns) \
-                    + ''.join(", %s" % v for v in additional_columns.values())
-                )
+            sql = MSSQLDatabaseInterface._create_merge_sql(metadata, staging_table_name, match_columns, exclude_columns, additional_columns, src_alias, dest_alias)
             merge_result = conn.execute(sql)
             print("Merged %d row(s) from %s into %s" % (merge_result.rowcount, table_name, staging_table_name))
+            return merge_result.rowcount
             
         finally:
             if conn is not None:
                 conn.execute("drop table " + staging_table_name)
                 conn.close()
+    
+    def _bulk_merge_dataframe(self, metadata, dataframe, match_columns, exclude_columns, additional_columns, src_alias, dest_alias, chunk_size):
+        columns = [x for x in metadata.non_identity_columns if x not in exclude_columns]
+        staging_table_name = DatabaseInterface._create_staging_table_name(metadata.table_name)
+        dataframe = dataframe.drop_duplicates(subset=match_columns)
+        
+        conn = self.__engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("select top 0 %s into %s from %s" % (', '.join(columns), staging_table_name, metadata.table_name))
+            cursor.fast_executemany = True
+            insert_sql = "insert into %s (%s) values (%s)" % (staging_table_name, ', '.join(columns), ', '.join(['?'] * len(columns)))
+            rowcount = 0
+            for chunk in DatabaseInterface._iter_chunks(DatabaseInterface._iter_parameters(dataframe, columns), chunk_size):
+                cursor.executemany(insert_sql, chunk)
+                rowcount = rowcount + (cursor.rowcount if cursor.rowcount >= 0 else len(chunk))
+            print("Inserted %d row(s) into %s" % (rowcount, staging_table_name))
+            
+            cursor.execute(MSSQLDatabaseInterface._create_merge_sql(metadata, staging_table_name, match_columns, exclude_columns, additional_columns, src_alias, dest_alias))
+            merged = cursor.rowcount
+            print("Merged %d row(s) from %s into %s" % (merged, staging_table_name, metadata.table_name))
+            cursor.execute("drop table " + staging_table_name)
+            conn.commit()
+            return merged
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+class SQLiteDatabaseInterface(DatabaseInterface):
+    """
+    Database interface for an embedded SQLite database, e.g. for quote snapshots on machines without SQL Server.
+    Merges are done with an upsert (INSERT ... ON CONFLICT DO UPDATE) through executemany on the DBAPI connection in one transaction,
+    so no staging table is needed. The match columns must be the primary key or a unique index of the table.
+    """
+
+    def __init__(self, connector):
+        self.__engine = connector.create_engine()
+        super(SQLiteDatabaseInterface, self).__init__(self.__engine)
+
+    @override
+    def get_table_metadata(self, table_name):
+        return SQLiteTableMetadata.get(self.__engine, table_name)
+
+    @override
+    def merge_dataframe(self, dataframe, table_name, match_columns=[], exclude_columns = [], additional_columns = {}, src_alias='src', dest_alias='dest'):
+        """
+        Merges a pandas DataFrame into a database table with an upsert. Of the rows with the same values in the match columns, the first one is merged.
+        The values of additional_columns are SQL expressions, in which the merged row is "excluded" and the existing row is the table name,
+        so src_alias and dest_alias are not used.
+
+        Returns
+        -------
+        rowcount : int
+            The number of rows inserted or updated
+        """
+        if match_columns == None or len(match_columns) == 0:
+            raise DatabaseInterfaceError("Match columns must be provided if data frame does not have index")
+
+        metadata = self.get_table_metadata(table_name)
+        columns = [x for x in metadata.non_identity_columns if x in dataframe.columns and x not in exclude_columns and x not in additional_columns]
+        missing_columns = [x for x in match_columns if x not in columns]
+        if len(missing_columns) > 0:
+            raise DatabaseInterfaceError("Match columns %s are not columns of table %s in the data frame" % (', '.join(missing_columns), metadata.table_name))
+
+        upsert_sql = '''
+        INSERT INTO "{dest_name}" ({insert_columns}) VALUES ({insert_values})
+        ON CONFLICT ({match_columns}) DO {conflict_action}
+        '''
+        update_clause = ', '.join(['"%s" = excluded."%s"' % (x, x) for x in columns if x not in match_columns] \
+                                  + ['"%s" = %s' % (k, v) for k, v in additional_columns.items()])
+        sql = upsert_sql.format(
+            dest_name = metadata.table_name,
+            insert_columns = ', '.join('"%s"' % x for x in columns + list(additional_columns.keys())),
+            insert_values = ', '.join(['?'] * len(columns) + list(additional_columns.values())),
+            match_columns = ', '.join('"%s"' % x for x in match_columns),
+            conflict_action = "UPDATE SET " + update_clause if len(update_clause) > 0 else "NOTHING"
+            )
+
+        dataframe = dataframe.drop_duplicates(subset=match_columns)
+        conn = self.__engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(sql, DatabaseInterface._iter_parameters(dataframe, columns, datetime_format = "%Y-%m-%d %H:%M:%S"))
+            rowcount = cursor.rowcount
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        print("Merged %d row(s) into %s" % (rowcount, metadata.table_name))
+        return rowcount
 
 
 class DatabaseConnector(object):
@@ -227,6 +491,35 @@ class MSSQLDatabaseConnector(DatabaseConnector):
     connection_string = "mssql+pyodbc://localhost\\SQLEXPRESS/shipping?driver=ODBC+Driver+11+for+SQL+Server"
 
 
+class SQLiteDatabaseConnector(DatabaseConnector):
+    """
+    Connects to a SQLite database file in WAL mode with synchronous=NORMAL,
+    so that readers do not block the writer and commits do not wait for a full sync
+    """
+
+    default_database_file = os.path.join(os.path.expanduser("~"), ".stocks", "stocks.db")
+
+    def __init__(self, database_file = None):
+        self.database_file = database_file if database_file != None else SQLiteDatabaseConnector.default_database_file
+        self.connection_string = "sqlite:///" + self.database_file if self.database_file != ":memory:" else "sqlite://"
+
+    def create_engine(self):
+        if self.database_file != ":memory:":
+            folder = os.path.dirname(os.path.abspath(self.database_file))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+        engine = create_engine(self.connection_string)
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        return engine
+
+
 class DatabaseConnectionHolder(object):
     
     def __init__(self, engine):
@@ -409,7 +702,80 @@ class TableMetadata(object):
             self.identity_column = str(df_identity_columns.column_name[0])
         else:
             self.identity_column = None
-    
+
+
+class SQLiteTableMetadata(TableMetadata):
+
+    _cached = {}
+
+    def __init__(self, engine, table_name, database = 'main'):
+        """
+        Initializes this SQLiteTableMetadata instance from PRAGMA table_info.
+        The identity column is the INTEGER PRIMARY KEY column, which is an alias of the rowid.
+
+        Parameters
+        ----------
+        engine :
+            The SQLAlchemy engine
+
+        table_name : str
+            The name of the table
+
+        database : str, default 'main'
+            The name of the attached database
+        """
+        self.__engine = engine
+        self.database = database
+        self.owner = None
+        self.table_name = table_name
+
+        self._load_columns()
+
+        SQLiteTableMetadata._cached[(str(engine.url), self.full_table_name)] = self
+
+    @staticmethod
+    def get(engine, table_name):
+        """
+        Caches and returns the metadata of a table, per database file
+
+        Parameters
+        ----------
+        table_name : str
+            The database table name, in one of the following formats:
+                <database>.<table name>
+                <table name>
+
+        Returns
+        -------
+        metadata : SQLiteTableMetadata
+            The metadata of the table
+
+        Raises
+        ------
+        DatabaseTableMetadataError : The table does not exist
+        """
+        elements = table_name.split('.')
+        if len(elements) == 1:
+            elements = ['main'] + elements
+        metadata = SQLiteTableMetadata._cached.get((str(engine.url), '.'.join(elements)))
+        if metadata is not None:
+            return metadata
+        return SQLiteTableMetadata(engine, elements[1], database = elements[0])
+
+    def _load_columns(self):
+        df = pd.read_sql_query('PRAGMA "%s".table_info("%s")' % (self.database, self.table_name), self.__engine, index_col=None)
+        if len(df.index) == 0:
+            raise DatabaseTableMetadataError("Failed to load metadata as table [%s] does not exist" % self.table_name)
+
+        self.full_table_name = "%s.%s" % (self.database, self.table_name)
+        df_primary_key = df[df.pk > 0].sort_values('pk')
+        self.primary_key_columns = df_primary_key.name.tolist()
+        if len(df_primary_key) == 1 and df_primary_key.type.iloc[0].upper() == 'INTEGER':
+            self.identity_column = str(df_primary_key.name.iloc[0])
+        else:
+            self.identity_column = None
+        self.non_identity_columns = [x for x in df.name.tolist() if x != self.identity_column]
+
 
 class DatabaseInterfaceError(Exception):
     pass    
@@ -487,4 +853,152 @@ class DataTransactionHolderTests(unittest.TestCase):
 
     def tearDown(self):
         self.__conn.execute("drop table %s" % DataTransactionHolderTests.unittest_table_name)
-        self.__conn.close()
\ No newline at end of file
+        self.__conn.close()
+
+class MSSQLBulkMergeTests(unittest.TestCase):
+
+    class RecordingCursor(object):
+
+        def __init__(self, calls):
+            self.calls = calls
+            self.rowcount = -1
+            self.fast_executemany = False
+
+        def execute(self, sql):
+            self.calls.append(('execute', ' '.join(sql.split())))
+            self.rowcount = 3 if sql.strip().startswith('MERGE') else -1
+
+        def executemany(self, sql, rows):
+            assert(self.fast_executemany)
+            self.calls.append(('executemany', sql, rows))
+            self.rowcount = len(rows)
+
+    class RecordingConnection(object):
+
+        def __init__(self):
+            self.calls = []
+
+        def cursor(self):
+            return MSSQLBulkMergeTests.RecordingCursor(self.calls)
+
+        def commit(self):
+            self.calls.append(('commit',))
+
+        def rollback(self):
+            self.calls.append(('rollback',))
+
+        def close(self):
+            self.calls.append(('close',))
+
+    class RecordingConnector(object):
+
+        def __init__(self, conn):
+            self.conn = conn
+
+        def create_engine(self):
+            return self
+
+        def raw_connection(self):
+            return self.conn
+
+    class Metadata(object):
+        table_name = 'quotes'
+        identity_column = 'quote_id'
+        non_identity_columns = ['symbol', 'date', 'close', 'merge_timestamp']
+
+    class RecordingInterface(MSSQLDatabaseInterface):
+
+        def get_table_metadata(self, table_name):
+            return MSSQLBulkMergeTests.Metadata()
+
+    def test_bulk_merge_dataframe(self):
+        conn = MSSQLBulkMergeTests.RecordingConnection()
+        di = MSSQLBulkMergeTests.RecordingInterface(MSSQLBulkMergeTests.RecordingConnector(conn), chunk_size = 2)
+        df = pd.DataFrame({ 'symbol': ['sh600399', 'sh600399', 'sh600399', 'sz000807', 'sz000807', 'sh600000'],
+                            'date': pd.to_datetime(['2015-05-21', '2015-05-22', '2015-05-22', '2015-05-21', '2015-05-22', '2015-05-22']),
+                            'close': [8.3, 8.4, 8.5, float('nan'), 5.1, 10.1] })
+        assert(di.merge_dataframe(df, 'quotes', ['symbol', 'date'], exclude_columns=['merge_timestamp'], additional_columns={'merge_timestamp': 'GETDATE()'}) == 3)
+        assert(len(df) == 6)
+
+        calls = conn.calls
+        assert(calls[0][0] == 'execute')
+        staging_table_name = calls[0][1].split(' into ')[1].split(' ')[0]
+        assert(staging_table_name.startswith('#quotes_'))
+        assert(calls[0][1] == 'select top 0 symbol, date, close into %s from quotes' % staging_table_name)
+        inserts = [call for call in calls if call[0] == 'executemany']
+        assert([len(call[2]) for call in inserts] == [2, 2, 1])
+        assert(all(call[1] == 'insert into %s (symbol, date, close) values (?, ?, ?)' % staging_table_name for call in inserts))
+        assert(inserts[1][2][0] == ('sz000807', pd.Timestamp('2015-05-21'), None))
+        assert(calls[4] == ('execute', 'MERGE INTO quotes dest USING %s src ON src.symbol = dest.symbol AND src.date = dest.date WHEN MATCHED THEN '
+                            'UPDATE SET close = src.close, merge_timestamp = GETDATE() WHEN NOT MATCHED THEN '
+                            'INSERT (symbol, date, close, merge_timestamp) VALUES (src.symbol, src.date, src.close, GETDATE()) ;' % staging_table_name))
+        assert(calls[5:] == [('execute', 'drop table ' + staging_table_name), ('commit',), ('close',)])
+
+
+class SQLiteDatabaseInterfaceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.database_file = os.path.join(tempfile.mkdtemp(), "stocks.db")
+        conn = sqlite3.connect(self.database_file)
+        conn.execute("create table quotes ( quote_id INTEGER PRIMARY KEY, symbol TEXT, date TEXT, close REAL, volume INTEGER, merge_timestamp TEXT, UNIQUE (symbol, date) )")
+        conn.commit()
+        conn.close()
+        self.di = SQLiteDatabaseInterface(SQLiteDatabaseConnector(self.database_file))
+
+    def tearDown(self):
+        folder = os.path.dirname(self.database_file)
+        for file_name in os.listdir(folder):
+            os.remove(os.path.join(folder, file_name))
+        os.rmdir(folder)
+
+    def test_table_metadata(self):
+        metadata = self.di.get_table_metadata("quotes")
+        assert(metadata.full_table_name == 'main.quotes')
+        assert(metadata.identity_column == 'quote_id')
+        assert(metadata.non_identity_columns == ['symbol', 'date', 'close', 'volume', 'merge_timestamp'])
+        assert(self.di.get_table_metadata("main.quotes") is metadata)
+        with self.assertRaises(DatabaseTableMetadataError):
+            self.di.get_table_metadata("missing")
+
+    def test_merge_dataframe(self):
+        df = pd.DataFrame({ 'symbol': ['sh600399', 'sh600399', 'sz000807'], 'date': pd.to_datetime(['2015-05-21', '2015-05-22', '2015-05-22']),
+                            'close': [8.3, 8.4, float('nan')], 'volume': [1000, 2000, 3000] })
+        assert(self.di.merge_dataframe(df, "quotes", ['symbol', 'date'], additional_columns={'merge_timestamp': "datetime('now')"}) == 3)
+
+        df = pd.DataFrame({ 'symbol': ['sh600399', 'sh600399', 'sh600000'], 'date': pd.to_datetime(['2015-05-22', '2015-05-22', '2015-05-22']),
+                            'close': [8.45, 9.0, 10.1], 'volume': [2500, 2600, 4000] })
+        assert(self.di.merge_dataframe(df, "quotes", ['symbol', 'date']) == 2)
+
+        result = self.di.select_dataframe("select * from quotes order by quote_id")
+        assert(result.quote_id.tolist() == [1, 2, 3, 4])
+        assert(result.date.tolist() == ['2015-05-21 00:00:00', '2015-05-22 00:00:00', '2015-05-22 00:00:00', '2015-05-22 00:00:00'])
+        assert(result.close.tolist()[:2] == [8.3, 8.45])
+        assert(pd.isnull(result.close[2]))
+        assert(result.volume.tolist() == [1000, 2500, 3000, 4000])
+        assert(result.merge_timestamp.notnull().tolist() == [True, True, True, False])
+
+    def test_select_dataframe_in_chunks(self):
+        symbols = ['sh600399', 'sz000807', 'sh600000']
+        df = pd.DataFrame({ 'symbol': [symbols[i % 3] for i in range(10)], 'date': ['2015-05-%02d' % (i + 1) for i in range(10)],
+                            'close': [8.0 + i / 10.0 for i in range(10)], 'volume': [1000 * i for i in range(10)] })
+        self.di.merge_dataframe(df, "quotes", ['symbol', 'date'])
+        sql = "select symbol, date, close, volume from quotes order by quote_id"
+        dtypes = { 'symbol': 'category', 'date': 'datetime64[ns]', 'close': 'float32' }
+
+        chunks = list(self.di.iter_select_dataframe(sql, chunk_size = 3, dtypes = dtypes))
+        assert([len(chunk) for chunk in chunks] == [3, 3, 3, 1])
+        assert(chunks[-1].symbol.cat.categories.tolist() == ['sh600399'])
+        assert(chunks[0].close.dtype == np.float32)
+
+        expected = self.di.select_dataframe(sql)
+        for expected_rows in [None, 4, 10, 20]:
+            result = self.di.select_dataframe(sql, chunk_size = 3, dtypes = dtypes, expected_rows = expected_rows)
+            assert(len(result) == 10)
+            assert(result.columns.tolist() == ['symbol', 'date', 'close', 'volume'])
+            assert(isinstance(result.symbol.dtype, pd.CategoricalDtype))
+            assert(result.symbol.astype(str).tolist() == expected.symbol.tolist())
+            assert(result.date.dtype == np.dtype('datetime64[ns]'))
+            assert(result.date.dt.strftime('%Y-%m-%d').tolist() == expected.date.tolist())
+            assert(result.close.dtype == np.float32)
+            assert(np.allclose(result.close, expected.close))
+            assert(result.volume.tolist() == expected.volume.tolist())
@@ -0,0 +1,216 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import io
+import gzip
+import zlib
+import tempfile
+import unittest
+
+gzip_magic = b"\x1f\x8b"
+
+def is_gzip_file(file_name):
+    with open(file_name, "rb") as binary_file:
+        return binary_file.read(2) == gzip_magic
+
+def open_text(file_name, encoding = "utf-8"):
+    '''
+    Opens a file for reading text, decompressing it on the fly if it is gzip compressed
+    '''
+    if is_gzip_file(file_name):
+        return io.TextIOWrapper(gzip.open(file_name, "rb"), encoding = encoding)
+    return open(file_name, "r", encoding = encoding)
+
+
+class AtomicFileWriter(object):
+    '''
+    Writes a file under a temporary name in the same folder and renames it into place on close,
+    so that readers never see a partially written file. The temporary file is removed if writing fails.
+
+    Usage:
+        with AtomicFileWriter(file_name, compress = True) as binary_file:
+            binary_file.write(b"...")
+    '''
+
+    def __init__(self, file_name, compress = False):
+        self.file_name = file_name
+        self.compress = compress
+        self.temp_file_name = None
+        self._file = None
+        self._compressed_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type_, value, traceback):
+        if type_ == None:
+            self.commit()
+        else:
+            self.abort()
+
+    def open(self):
+        folder, base_name = os.path.split(os.path.abspath(self.file_name))
+        descriptor, self.temp_file_name = tempfile.mkstemp(prefix = "." + base_name + ".", suffix = ".tmp", dir = folder)
+        self._file = os.fdopen(descriptor, "wb")
+        if self.compress:
+            self._compressed_file = gzip.GzipFile(fileobj = self._file, mode = "wb")
+            return self._compressed_file
+        return self._file
+
+    def commit(self):
+        if self._compressed_file != None:
+            self._compressed_file.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.chmod(self.temp_file_name, 0o644)
+        os.replace(self.temp_file_name, self.file_name)
+
+    def abort(self):
+        try:
+            if self._compressed_file != None:
+                self._compressed_file.close()
+            self._file.close()
+        finally:
+            if os.path.exists(self.temp_file_name):
+                os.remove(self.temp_file_name)
+
+
+def iter_response_chunks(response, chunk_size = 64 * 1024):
+    '''
+    Yields the body of an HTTP response in chunks, decompressing it if it was sent with Content-Encoding: gzip
+    '''
+    decompressor = None
+    if response.getheader("Content-Encoding", "").lower() == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor != None:
+            chunk = decompressor.decompress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    if decompressor != None:
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+
+def save_response(response, file_name, compress = False, validate = None, chunk_size = 64 * 1024):
+    '''
+    Streams the body of an HTTP response into a file, which is replaced atomically once the whole body is written
+
+    Parameters
+    ----------
+    response : http.client.HTTPResponse
+        The response, which may be gzip encoded
+
+    file_name : str
+        The file to write
+
+    compress : bool, default False
+        Whether to keep the file gzip compressed on disk
+
+    validate : function of bytes to bool, default None
+        Called with the first chunk of the decoded body. The file is not written if it returns False
+
+    Returns
+    -------
+    saved : bool
+        Whether the file was written
+    '''
+    writer = AtomicFileWriter(file_name, compress)
+    binary_file = writer.open()
+    try:
+        first = True
+        for chunk in iter_response_chunks(response, chunk_size):
+            if first and validate != None and not validate(chunk):
+                writer.abort()
+                return False
+            first = False
+            binary_file.write(chunk)
+        if first and validate != None and not validate(b""):
+            writer.abort()
+            return False
+    except:
+        writer.abort()
+        raise
+    writer.commit()
+    return True
+
+
+def append_text(file_name, text, encoding = "utf-8"):
+    '''
+    Appends text to a file, as another gzip member if the file is gzip compressed
+    '''
+    if is_gzip_file(file_name):
+        with gzip.open(file_name, "ab") as binary_file:
+            binary_file.write(text.encode(encoding))
+    else:
+        with open(file_name, "a", encoding = encoding) as text_file:
+            text_file.write(text)
+
+
+class FilesTests(unittest.TestCase):
+
+    class FakeResponse(object):
+
+        def __init__(self, body, encoding = None):
+            self.stream = io.BytesIO(gzip.compress(body) if encoding == "gzip" else body)
+            self.encoding = encoding
+
+        def getheader(self, name, default = None):
+            return self.encoding if name == "Content-Encoding" and self.encoding != None else default
+
+        def read(self, size = -1):
+            return self.stream.read(size)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, "600399.SS")
+
+    def tearDown(self):
+        for file_name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file_name))
+        os.rmdir(self.folder)
+
+    def test_save_response(self):
+        body = b"Date,Open\n" + b"2015-05-22,88.80\n" * 10000
+        for encoding in [None, "gzip"]:
+            for compress in [False, True]:
+                assert save_response(FilesTests.FakeResponse(body, encoding), self.file_name, compress, chunk_size = 1000)
+                assert is_gzip_file(self.file_name) == compress
+                with open_text(self.file_name) as text_file:
+                    assert text_file.read() == body.decode("utf-8")
+        assert os.listdir(self.folder) == ["600399.SS"]
+
+    def test_save_invalid_response(self):
+        assert not save_response(FilesTests.FakeResponse(b"<html>"), self.file_name, validate = lambda chunk: chunk.startswith(b"Date"))
+        assert os.listdir(self.folder) == []
+
+    def test_failed_write_keeps_existing_file(self):
+        with open(self.file_name, "w") as text_file:
+            text_file.write("old")
+        try:
+            with AtomicFileWriter(self.file_name) as binary_file:
+                binary_file.write(b"new")
+                raise IOError("connection reset")
+        except IOError:
+            pass
+        with open_text(self.file_name) as text_file:
+            assert text_file.read() == "old"
+        assert os.listdir(self.folder) == ["600399.SS"]
+
+    def test_append_text(self):
+        for compress in [False, True]:
+            with AtomicFileWriter(self.file_name, compress) as binary_file:
+                binary_file.write(b"first")
+            append_text(self.file_name, "\nsecond")
+            with open_text(self.file_name) as text_file:
+                assert text_file.read() == "first\nsecond"
@@ -0,0 +1,123 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import http.client
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from common.logging import Logger
+
+class HttpConnectionPool(object):
+    '''
+    Keeps one keep-alive HTTP connection per host for each thread, so that a worker
+    downloading many symbols from the same provider pays the TCP handshake only once.
+    Callers must read each response fully before issuing the next request.
+    '''
+    logger = Logger.get_logger(__name__)
+
+    def __init__(self, timeout = None):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all_connections = []
+
+    def _connections(self):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = {}
+            self._local.connections = connections
+        return connections
+
+    def get_connection(self, host):
+        connections = self._connections()
+        conn = connections.get(host)
+        if conn is None:
+            conn = http.client.HTTPConnection(host, timeout = self.timeout)
+            connections[host] = conn
+            with self._lock:
+                self._all_connections.append(conn)
+        return conn
+
+    def discard_connection(self, host):
+        conn = self._connections().pop(host, None)
+        if conn is not None:
+            conn.close()
+            with self._lock:
+                if conn in self._all_connections:
+                    self._all_connections.remove(conn)
+
+    def request(self, host, url, headers = {}, method = "GET"):
+        '''
+        Sends a request over the pooled connection of the current thread and returns the response.
+        A connection dropped by the server while idle is reopened once before giving up.
+        '''
+        for attempt in range(2):
+            conn = self.get_connection(host)
+            try:
+                conn.request(method, url, headers = headers)
+                return conn.getresponse()
+            except (http.client.HTTPException, ConnectionError) as e:
+                self.discard_connection(host)
+                if attempt > 0:
+                    raise e
+                HttpConnectionPool.logger.debug("Reconnecting to %s after %s" % (host, e))
+
+    def close(self):
+        with self._lock:
+            connections = self._all_connections
+            self._all_connections = []
+        for conn in connections:
+            conn.close()
+
+
+class HttpConnectionPoolTests(unittest.TestCase):
+
+    class EchoHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = self.path.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), HttpConnectionPoolTests.EchoHandler)
+        self.host = "127.0.0.1:%d" % self.server.server_port
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_reuse_connection(self):
+        pool = HttpConnectionPool(timeout = 5)
+        try:
+            first = pool.request(self.host, "/a").read().decode("utf-8")
+            conn = pool.get_connection(self.host)
+            second = pool.request(self.host, "/b").read().decode("utf-8")
+            assert first == "/a"
+            assert second == "/b"
+            assert pool.get_connection(self.host) is conn
+        finally:
+            pool.close()
+
+    def test_connection_per_thread(self):
+        pool = HttpConnectionPool(timeout = 5)
+        connections = []
+        try:
+            thread = threading.Thread(target = lambda: connections.append(pool.get_connection(self.host)))
+            thread.start()
+            thread.join()
+            assert pool.get_connection(self.host) is not connections[0]
+        finally:
+            pool.close()
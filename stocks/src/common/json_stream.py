@@ -0,0 +1,164 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import re
+import json
+import codecs
+import unittest
+
+class JsonMemberStream(object):
+    '''
+    Incrementally decodes text holding one or more concatenated JSON objects, e.g. ctxalgo /api/ohlc/ responses
+    appended to one file, and returns each (key, value) member of the top level objects as soon as it is complete.
+    Only the text of the member being read is kept, so memory depends on the largest member rather than on the whole text.
+
+    Usage:
+        stream = JsonMemberStream()
+        for chunk in chunks:
+            for key, value in stream.feed(chunk):
+                ...
+        stream.close()
+    '''
+    string_pattern = re.compile(r'["\\]')
+    member_pattern = re.compile(r'["{}\[\],]')
+    nested_pattern = re.compile(r'["{}\[\]]')
+    token_pattern = re.compile(r'\S')
+
+    def __init__(self):
+        self._depth = 0
+        self._in_member = False
+        self._in_string = False
+        self._escape = False
+        self._pieces = []
+
+    def feed(self, text):
+        '''
+        Scans the next chunk of text and returns the list of members completed by it
+
+        Raises
+        ------
+        ValueError : The text is not a sequence of JSON objects
+        '''
+        members = []
+        start = 0
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if self._escape:
+                self._escape = False
+                pos = pos + 1
+            elif self._in_string:
+                match = JsonMemberStream.string_pattern.search(text, pos)
+                if match == None:
+                    pos = length
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+            elif not self._in_member:
+                match = JsonMemberStream.token_pattern.search(text, pos)
+                if match == None:
+                    break
+                pos = match.end()
+                char = match.group()
+                if self._depth == 0:
+                    if char != "{":
+                        raise ValueError("Expected a JSON object but found %r" % char)
+                    self._depth = 1
+                elif char == "}":
+                    self._depth = 0
+                elif char == '"':
+                    self._in_member = True
+                    self._in_string = True
+                    start = pos - 1
+                elif char != ",":
+                    raise ValueError("Expected a member name but found %r" % char)
+            else:
+                pattern = JsonMemberStream.member_pattern if self._depth == 1 else JsonMemberStream.nested_pattern
+                match = pattern.search(text, pos)
+                if match == None:
+                    pos = length
+                    break
+                pos = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char == "{" or char == "[":
+                    self._depth = self._depth + 1
+                elif self._depth > 1:
+                    self._depth = self._depth - 1
+                elif char == "]":
+                    raise ValueError("Unexpected ] in a JSON object")
+                else:
+                    self._pieces.append(text[start:pos - 1])
+                    members.extend(json.loads("{" + "".join(self._pieces) + "}").items())
+                    self._pieces = []
+                    self._in_member = False
+                    if char == "}":
+                        self._depth = 0
+        if self._in_member:
+            self._pieces.append(text[start:])
+        return members
+
+    def close(self):
+        '''
+        Raises
+        ------
+        ValueError : The text ended inside an object
+        '''
+        if self._depth != 0 or self._in_member:
+            raise ValueError("Truncated JSON text")
+
+
+def iter_json_members(chunks, encoding = "utf-8"):
+    '''
+    Yields the (key, value) members of the JSON objects in a sequence of text or bytes chunks, e.g. iter_response_chunks(response)
+    '''
+    stream = JsonMemberStream()
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        for member in stream.feed(chunk):
+            yield member
+    for member in stream.feed(decoder.decode(b"", final = True)):
+        yield member
+    stream.close()
+
+
+def iter_file_members(text_file, chunk_size = 64 * 1024):
+    '''
+    Yields the (key, value) members of the JSON objects in an open file, reading it in chunks
+    '''
+    return iter_json_members(iter(lambda: text_file.read(chunk_size), ""))
+
+
+class JsonMemberStreamTests(unittest.TestCase):
+
+    documents = '{"sh600399": {"dates": ["2015-05-21T00:00:00"], "closes": [8.3]}, "sz000807": {"name": "a \\"b\\" {c}", "closes": []}}\n' \
+        + '{"sh600399": {"dates": ["2015-05-22T00:00:00"], "closes": [8.4]}}\n'
+
+    def test_members_of_appended_documents(self):
+        expected = [(key, value) for document in JsonMemberStreamTests.documents.splitlines() for key, value in json.loads(document).items()]
+        for chunk_size in [1, 2, 7, 1000]:
+            chunks = [JsonMemberStreamTests.documents[x:x + chunk_size] for x in range(0, len(JsonMemberStreamTests.documents), chunk_size)]
+            assert list(iter_json_members(chunks)) == expected
+
+    def test_bytes_chunks(self):
+        text = '{"sh600399": {"name": "中文"}}'
+        encoded = text.encode("utf-8")
+        assert list(iter_json_members([encoded[x:x + 1] for x in range(len(encoded))])) == [("sh600399", { "name": "中文" })]
+
+    def test_empty_and_truncated(self):
+        assert list(iter_json_members(["", " {} "])) == []
+        for text in ['{"sh600399": {"closes": [8.3]', '{"sh600399"', "[1, 2]"]:
+            try:
+                list(iter_json_members([text]))
+                assert False
+            except ValueError:
+                pass
@@ -14,28 +14,17 @@ def _get_base_classes(frame, namespace):
 
 def _get_base_class_names(frame):
     co, lasti = frame.f_code, frame.f_lasti
-    code = co.co_code
-    i = 0
-    extended_arg = 0
     extends = []
-    while i <= lasti:
-        c = code[i]
-        op = ord(c)
-        i += 1
-        if op >= dis.HAVE_ARGUMENT:
-            oparg = ord(code[i]) + ord(code[i+1])*256 + extended_arg
-            extended_arg = 0
-            i += 2
-            if op == dis.EXTENDED_ARG:
-                extended_arg = oparg*long(65536)
-            if op in dis.hasconst:
-                if type(co.co_consts[oparg]) == str:
-                    extends = []
-            elif op in dis.hasname:
-                if dis.opname[op] == 'LOAD_NAME':
-                    extends.append(('name', co.co_names[oparg]))
-                if dis.opname[op] == 'LOAD_ATTR':
-                    extends.append(('attr', co.co_names[oparg]))
+    for instruction in dis.get_instructions(co):
+        if instruction.offset > lasti:
+            break
+        if instruction.opcode in dis.hasconst:
+            if type(instruction.argval) == str:
+                extends = []
+        elif instruction.opname in ('LOAD_NAME', 'LOAD_GLOBAL'):
+            extends.append(('name', instruction.argval))
+        elif instruction.opname == 'LOAD_ATTR':
+            extends.append(('attr', instruction.argval))
     items = []
     previous_item = []
     for t, s in extends:
@@ -0,0 +1,167 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import time
+import queue
+import threading
+import unittest
+from common.logging import Logger
+
+class PipelineStage(object):
+    '''
+    One stage of a Pipeline: workers threads take items from the input queue, and put everything the function yields for an item on the next queue
+    '''
+
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.input = queue.Queue(maxsize = queue_size)
+        self.output = None
+        self.next_workers = 0
+        self._lock = threading.Lock()
+        self._running = workers
+        self._counters = { "items": 0, "outputs": 0, "errors": 0, "busy": 0.0, "waiting": 0.0, "blocked": 0.0 }
+
+    def _add(self, counter, value):
+        with self._lock:
+            self._counters[counter] = self._counters[counter] + value
+
+    def run(self):
+        while True:
+            started = time.time()
+            item = self.input.get()
+            self._add("waiting", time.time() - started)
+            if item is Pipeline.end:
+                break
+            self._add("items", 1)
+            started = time.time()
+            blocked = 0.0
+            try:
+                for output in self.function(item):
+                    if self.output != None:
+                        put_started = time.time()
+                        self.output.put(output)
+                        blocked = blocked + time.time() - put_started
+                    self._add("outputs", 1)
+            except Exception as e:
+                Pipeline.logger.error("Stage %s failed on an item: %s" % (self.name, e))
+                self._add("errors", 1)
+            self._add("blocked", blocked)
+            self._add("busy", time.time() - started - blocked)
+
+        with self._lock:
+            self._running = self._running - 1
+            last = self._running == 0
+        if last and self.output != None:
+            for _ in range(self.next_workers):
+                self.output.put(Pipeline.end)
+
+    def get_stats(self, elapsed):
+        with self._lock:
+            stats = dict(self._counters)
+        capacity = self.workers * elapsed
+        for counter in ["busy", "waiting", "blocked"]:
+            stats[counter] = stats[counter] / capacity if capacity > 0 else 0.0
+        return stats
+
+
+class Pipeline(object):
+    '''
+    Runs items through stages connected by bounded queues, each stage with its own worker threads,
+    so that e.g. downloading, decoding and writing overlap and the pipeline runs at the pace of its slowest stage.
+    A stage function takes an item and returns or yields the items for the next stage. An item whose function raises is logged and dropped.
+    The stats of a stage give the share of its workers' time spent busy, waiting for input and blocked on a full output queue.
+
+    Usage:
+        pipeline = Pipeline("update")
+        pipeline.add_stage("fetch", fetch, workers = 4)
+        pipeline.add_stage("write", write, workers = 2)
+        pipeline.run(items)
+    '''
+    logger = Logger.get_logger(__name__)
+    end = object()
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.elapsed = 0.0
+
+    def add_stage(self, name, function, workers = 1, queue_size = None):
+        '''
+        Parameters
+        ----------
+        queue_size : int, default None
+            The number of items waiting for the stage before the previous stage blocks, twice the number of workers by default
+        '''
+        stage = PipelineStage(name, function, workers, queue_size if queue_size != None else 2 * workers)
+        if len(self.stages) > 0:
+            self.stages[-1].output = stage.input
+            self.stages[-1].next_workers = workers
+        self.stages.append(stage)
+        return stage
+
+    def run(self, items):
+        '''
+        Feeds the items to the first stage and returns once all stages are done
+        '''
+        started = time.time()
+        threads = []
+        for stage in self.stages:
+            for index in range(stage.workers):
+                thread = threading.Thread(target = stage.run, name = "%s-%s-%d" % (self.name, stage.name, index))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        try:
+            for item in items:
+                self.stages[0].input.put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.stages[0].input.put(Pipeline.end)
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.time() - started
+
+    def get_stats(self):
+        return [(stage.name, stage.get_stats(self.elapsed)) for stage in self.stages]
+
+    def log_stats(self):
+        for name, stats in self.get_stats():
+            Pipeline.logger.info("%s/%s: %d item(s) in, %d out, %d error(s), busy %.0f%%, waiting for input %.0f%%, blocked on output %.0f%%" \
+                                 % (self.name, name, stats["items"], stats["outputs"], stats["errors"], stats["busy"] * 100, stats["waiting"] * 100, stats["blocked"] * 100))
+
+
+class PipelineTests(unittest.TestCase):
+
+    def test_run_stages(self):
+        results = []
+        lock = threading.Lock()
+
+        def split(item):
+            if item == 3:
+                raise ValueError("bad item")
+            time.sleep(0.01)
+            return [item * 10, item * 10 + 1]
+
+        def collect(item):
+            time.sleep(0.005)
+            with lock:
+                results.append(item)
+            return []
+
+        pipeline = Pipeline("test")
+        pipeline.add_stage("split", split, workers = 4)
+        pipeline.add_stage("collect", collect, workers = 2, queue_size = 1)
+        started = time.time()
+        pipeline.run(range(8))
+        assert sorted(results) == sorted([x for item in range(8) if item != 3 for x in [item * 10, item * 10 + 1]])
+        assert time.time() - started < 0.01 * 8 + 0.005 * 14
+        stats = dict(pipeline.get_stats())
+        assert stats["split"]["items"] == 8
+        assert stats["split"]["errors"] == 1
+        assert stats["collect"]["items"] == 14
+        assert 0 < stats["collect"]["busy"] <= 1
@@ -0,0 +1,244 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import time
+import random
+import socket
+import threading
+import http.client
+import unittest
+from common.logging import Logger
+from common.http_pool import HttpConnectionPool
+
+class TokenBucket(object):
+    '''
+    Allows on average rate acquisitions per second, with bursts of up to capacity
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class HostLimit(object):
+
+    def __init__(self, rate, burst, max_in_flight):
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+
+class RequestScheduler(object):
+    '''
+    Sends HTTP requests for all modules talking to ctxalgo.com, Yahoo or Sina.
+    Each host has a token bucket limiting the request rate and a limit on requests in flight.
+    Requests failing with a connection error or a retryable HTTP status are retried with jittered exponential backoff.
+
+    Usage:
+        scheduler = RequestScheduler.get_default()
+        body = scheduler.request("ctxalgo.com", "/api/stocks", lambda response: response.read())
+    '''
+    logger = Logger.get_logger(__name__)
+    retry_statuses = set([429, 500, 502, 503, 504])
+    retry_errors = (http.client.HTTPException, ConnectionError, socket.timeout)
+    default_scheduler = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, rate = 10.0, burst = 10, max_in_flight = 8, max_retries = 4, base_delay = 0.5, max_delay = 30.0, timeout = 60):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.connection_pool = HttpConnectionPool(timeout = timeout)
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters = { "requests": 0, "retries": 0, "failures": 0 }
+
+    @staticmethod
+    def get_default():
+        with RequestScheduler._default_lock:
+            if RequestScheduler.default_scheduler == None:
+                RequestScheduler.default_scheduler = RequestScheduler()
+            return RequestScheduler.default_scheduler
+
+    def set_host_limit(self, host, rate, burst = None, max_in_flight = None):
+        with self._lock:
+            self._host_limits[host] = HostLimit(rate, burst if burst != None else max(1, int(rate)), max_in_flight if max_in_flight != None else self.max_in_flight)
+
+    def get_host_limit(self, host):
+        with self._lock:
+            host_limit = self._host_limits.get(host)
+            if host_limit == None:
+                host_limit = HostLimit(self.rate, self.burst, self.max_in_flight)
+                self._host_limits[host] = host_limit
+            return host_limit
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] = self._counters[counter] + 1
+
+    def get_backoff_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _send(self, host, url, headers, method, keep_alive):
+        if keep_alive:
+            return self.connection_pool.request(host, url, headers, method), None
+        conn = http.client.HTTPConnection(host, timeout = self.timeout)
+        try:
+            conn.request(method, url, headers = headers)
+            return conn.getresponse(), conn
+        except:
+            conn.close()
+            raise
+
+    def request(self, host, url, handler, headers = {}, method = "GET", keep_alive = True):
+        '''
+        Sends a request once the host allows it, and returns what handler returns for the response.
+        The handler must consume the response, and is called again on each retry.
+
+        Parameters
+        ----------
+        handler : function of http.client.HTTPResponse
+            Reads the response. Connection errors raised while reading are retried as well
+
+        keep_alive : bool, default True
+            Whether to send the request over the pooled keep-alive connection of the current thread.
+            Use False when the handler does not read the whole response.
+
+        Raises
+        ------
+        RequestError : The request still failed after all retries
+        '''
+        host_limit = self.get_host_limit(host)
+        attempt = 0
+        while True:
+            host_limit.bucket.acquire()
+            host_limit.in_flight.acquire()
+            conn = None
+            try:
+                self._count("requests")
+                response, conn = self._send(host, url, headers, method, keep_alive)
+                if response.status in RequestScheduler.retry_statuses:
+                    response.read()
+                    error = RequestError("HTTP %d from %s%s" % (response.status, host, url))
+                else:
+                    return handler(response)
+            except RequestScheduler.retry_errors as e:
+                if keep_alive:
+                    self.connection_pool.discard_connection(host)
+                error = e
+            finally:
+                if conn != None:
+                    conn.close()
+                host_limit.in_flight.release()
+
+            if attempt >= self.max_retries:
+                self._count("failures")
+                raise RequestError("Request to %s%s failed after %d attempt(s): %s" % (host, url, attempt + 1, error))
+            delay = self.get_backoff_delay(attempt)
+            RequestScheduler.logger.debug("Retrying %s%s in %.1fs after %s" % (host, url, delay, error))
+            self._count("retries")
+            attempt = attempt + 1
+            time.sleep(delay)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        elapsed = time.time() - self._started
+        stats["requests_per_second"] = stats["requests"] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        RequestScheduler.logger.info("%d request(s), %d retries, %d failure(s), %.1f request(s) per second" % (stats["requests"], stats["retries"], stats["failures"], stats["requests_per_second"]))
+
+    def close(self):
+        self.connection_pool.close()
+
+
+class RequestError(Exception):
+    pass
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(50, 1)
+        started = time.time()
+        for _ in range(11):
+            bucket.acquire()
+        assert time.time() - started >= 0.18
+
+
+class RequestSchedulerTests(unittest.TestCase):
+
+    class FakeResponse(object):
+
+        def __init__(self, status):
+            self.status = status
+
+        def read(self):
+            return b""
+
+    class FakeScheduler(RequestScheduler):
+
+        def __init__(self, statuses, **kwargs):
+            super().__init__(**kwargs)
+            self.statuses = list(statuses)
+
+        def _send(self, host, url, headers, method, keep_alive):
+            status = self.statuses.pop(0)
+            if status == None:
+                raise ConnectionResetError("reset")
+            return RequestSchedulerTests.FakeResponse(status), None
+
+    def test_retry_with_backoff(self):
+        scheduler = RequestSchedulerTests.FakeScheduler([503, None, 200], base_delay = 0.01)
+        assert scheduler.request("ctxalgo.com", "/api/stocks", lambda response: response.status) == 200
+        stats = scheduler.get_stats()
+        assert stats["requests"] == 3
+        assert stats["retries"] == 2
+        assert stats["failures"] == 0
+
+    def test_give_up_after_max_retries(self):
+        scheduler = RequestSchedulerTests.FakeScheduler([503, 503, 503], base_delay = 0.01, max_retries = 2)
+        try:
+            scheduler.request("ctxalgo.com", "/api/stocks", lambda response: response.status)
+            assert False
+        except RequestError:
+            pass
+        assert scheduler.get_stats()["failures"] == 1
+
+    def test_no_retry_on_client_error(self):
+        scheduler = RequestSchedulerTests.FakeScheduler([404])
+        assert scheduler.request("ichart.finance.yahoo.com", "/table.csv?s=X", lambda response: response.status) == 404
+        assert scheduler.get_stats()["retries"] == 0
+
+    def test_backoff_delay(self):
+        scheduler = RequestScheduler(base_delay = 1, max_delay = 8)
+        for attempt in range(6):
+            delay = scheduler.get_backoff_delay(attempt)
+            cap = min(8, 2 ** attempt)
+            assert cap / 2 <= delay <= cap
@@ -0,0 +1,71 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import sys, os, inspect, time
+
+current_file = inspect.getfile(inspect.currentframe())
+parent_dir = os.path.join(os.path.split(current_file)[0], os.path.pardir)
+parent_folder = os.path.realpath(os.path.abspath(parent_dir))
+if parent_folder not in sys.path:
+    sys.path.insert(0, parent_folder)
+
+class CountingSession(object):
+    '''
+    Stands in for a Cassandra session, acknowledging each request immediately and counting requests and rows
+    '''
+
+    def __init__(self):
+        self.requests = 0
+        self.rows = 0
+
+    def prepare(self, cql):
+        return cql
+
+    def execute_async(self, statement, parameters = None):
+        self.requests = self.requests + 1
+        self.rows = self.rows + (len(statement) if isinstance(statement, list) else 1)
+        return self
+
+    def add_callbacks(self, callback, errback, callback_args = (), errback_args = ()):
+        callback(None, *callback_args)
+
+
+class ListBatch(list):
+
+    def add(self, statement, parameters):
+        self.append(parameters)
+
+
+def benchmark(name, batch_rows, batches):
+    from quotes.loader import QuoteLoader
+
+    class BenchmarkLoader(QuoteLoader):
+
+        @staticmethod
+        def create_batch():
+            return ListBatch()
+
+    loader = BenchmarkLoader(batch_rows = batch_rows)
+    loader.session = CountingSession()
+    started = time.time()
+    for batch in batches:
+        loader.insert_eod_quotes(batch)
+    elapsed = time.time() - started
+    print("%-14s %8d rows in %7d requests, %6.3f requests/row, %6.2fs" % (name, loader.session.rows, loader.session.requests, loader.session.requests / float(loader.session.rows), elapsed))
+
+if __name__ == '__main__':
+    import numpy as np
+    from quotes.eod_quote import EodQuoteBatch
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    dates = np.arange(10000, 10000 + days, dtype = "<i4")
+    prices = np.linspace(8, 12, days)
+    batches = [EodQuoteBatch("sh%06d" % index, dates, prices, prices, prices, prices, np.arange(days), amounts = prices * 100) for index in range(symbols)]
+
+    print("Writing %d symbol(s) x %d day(s)" % (symbols, days))
+    benchmark("one per row", None, batches)
+    for batch_rows in [20, 50, 100]:
+        benchmark("batches of %d" % batch_rows, batch_rows, batches)
@@ -0,0 +1,66 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import sys, os, inspect, time
+
+current_file = inspect.getfile(inspect.currentframe())
+parent_dir = os.path.join(os.path.split(current_file)[0], os.path.pardir)
+parent_folder = os.path.realpath(os.path.abspath(parent_dir))
+if parent_folder not in sys.path:
+    sys.path.insert(0, parent_folder)
+
+def generate_csv(days):
+    from datetime import date, timedelta
+    lines = ["Date,Open,High,Low,Close,Volume,Adj Close"]
+    day = date(2015, 5, 22)
+    for index in range(days):
+        price = 10 + (index % 500) / 100.0
+        lines.append("%s,%.2f,%.2f,%.2f,%.2f,%d,%.2f" % (day - timedelta(days = index), price, price + 0.5, price - 0.5, price + 0.1, 10000 + index, price + 0.1))
+    return "\n".join(lines) + "\n"
+
+def parse_by_line(symbol, text):
+    from quotes.eod_quote import YahooEodQuote
+    return [YahooEodQuote.from_line(symbol, line) for line in text.splitlines() if not line.startswith("Date")]
+
+def parse_vectorized(symbol, text):
+    from quotes.eod_quote import YahooEodQuote
+    return YahooEodQuote.parse_csv(symbol, text)
+
+def benchmark(name, parse, texts):
+    started = time.time()
+    rows = 0
+    for symbol, text in texts:
+        rows = rows + len(parse(symbol, text))
+    elapsed = time.time() - started
+    print("%-10s %10d rows in %6.2fs, %12.0f rows/s" % (name, rows, elapsed, rows / elapsed if elapsed > 0 else 0.0))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        from common.files import open_text
+        from quotes.manifest import QuoteManifest
+        from quotes.store import QuoteStore
+        folder = sys.argv[1]
+        texts = []
+        skipped = 0
+        for file_name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, file_name)
+            if not os.path.isfile(path) or not QuoteManifest.is_quote_file(path):
+                continue
+            if QuoteStore.is_store_file(path):
+                skipped = skipped + 1
+                continue
+            with open_text(path) as quote_file:
+                texts.append((file_name, quote_file.read()))
+        if skipped > 0:
+            print("Skipped %d binary quote store file(s)" % skipped)
+    else:
+        symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+        text = generate_csv(5000)
+        texts = [("%06d.SZ" % index, text) for index in range(symbols)]
+
+    print("Parsing %d file(s)" % len(texts))
+    benchmark("by line", parse_by_line, texts)
+    benchmark("vectorized", parse_vectorized, texts)
@@ -14,14 +14,20 @@ if parent_folder not in sys.path:
 
 if __name__ == '__main__':
     if len(sys.argv) < 3 or (sys.argv[2] != "yahoo" and sys.argv[2] != "ctx"):
-        print("Usage: python3 fetch_all_eod_quotes.py /projects/stocks/data/eod_quotes [ctx|yahoo]")
+        print("Usage: python3 fetch_all_eod_quotes.py /projects/stocks/data/eod_quotes [ctx|yahoo] [workers]")
         exit
     
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    
     from quotes import feeder
-    if sys.argv[2] == "yahoo":
-        yahoo_feeder = feeder.YahooQuoteFeeder(sys.argv[1])
-        yahoo_feeder.fetch_all()
-        
-    if sys.argv[2] == "ctx":
-        ctx_feeder = feeder.CtxQuoteFeeder(sys.argv[1])
-        ctx_feeder.fetch_all()
+    from common.scheduler import RequestScheduler
+    try:
+        if sys.argv[2] == "yahoo":
+            yahoo_feeder = feeder.YahooQuoteFeeder(sys.argv[1])
+            yahoo_feeder.fetch_all(workers)
+            
+        if sys.argv[2] == "ctx":
+            ctx_feeder = feeder.CtxQuoteFeeder(sys.argv[1])
+            ctx_feeder.fetch_all(workers)
+    finally:
+        RequestScheduler.get_default().close()
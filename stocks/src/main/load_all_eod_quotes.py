@@ -13,23 +13,41 @@ if parent_folder not in sys.path:
 
 
 if __name__ == '__main__':
+    import argparse
     from quotes.loader import CtxQuoteLoader
+    from quotes.bulk_loader import BulkQuoteLoader
+    from quotes.manifest import QuoteManifest
+    from quotes.journal import LoadJournal
+    from quotes.fingerprints import QuoteFingerprintIndex
+    from quotes.watermarks import QuoteWatermarks
     from common.logging import Logger
     
+    parser = argparse.ArgumentParser(description = "Loads the quote files saved by the ctxalgo feeder into Cassandra")
+    parser.add_argument("folder", help = "the folder of the quote files, e.g. /projects/stocks/data/eod_quotes/ctx")
+    parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "number of processes parsing files, 0 to parse in the writer threads (default: one per CPU)")
+    parser.add_argument("--writers", type = int, default = 4, help = "number of threads writing to Cassandra (default: 4)")
+    parser.add_argument("--journal", help = "the load journal recording the files already loaded (default: .load_journal in the folder)")
+    parser.add_argument("--force", action = "store_true", help = "load all files again, including the ones already loaded according to the journal")
+    parser.add_argument("--all-rows", action = "store_true", help = "write every quote, not only the ones new or changed since they were last written")
+    parser.add_argument("--rebuild-fingerprints", action = "store_true", help = "rebuild the fingerprints of the quotes already written from Cassandra before loading")
+    args = parser.parse_args()
+    
     logger = Logger.get_logger(__name__)
-    loader = CtxQuoteLoader()
+    fingerprints = QuoteFingerprintIndex() if not args.all_rows else None
+    loader = CtxQuoteLoader(batch_rows = 50, fingerprints = fingerprints, watermarks = QuoteWatermarks())
     
     try:
         loader.connect()
-        folder = sys.argv[1]
-        for file in os.listdir(folder):
-            symbol = file
-            file_name = os.path.realpath(os.path.abspath(os.path.join(folder, file)))
-            eod_quotes = CtxQuoteLoader.load_from_file(file_name)
-            count = 0
-            for eod_quote in eod_quotes:
-                loader.insert_eod_quote(eod_quote)
-                count = count + 1
-            logger.info("Loaded %d quotes for file %s for symbol %s" % (count, file_name, symbol))
+        folder = args.folder
+        manifest = QuoteManifest(folder)
+        truncated = set(manifest.find_truncated())
+        for symbol in sorted(truncated):
+            logger.warning("Skipping %s as its file changed since it was fetched" % symbol)
+        files = [entry.symbol for entry in manifest.get_entries() if entry.symbol not in truncated] + manifest.find_unrecorded()
+        file_names = [os.path.realpath(os.path.abspath(os.path.join(folder, file))) for file in files]
+        if fingerprints != None and args.rebuild_fingerprints:
+            fingerprints.rebuild(loader.session, files)
+        journal = LoadJournal(args.journal if args.journal != None else LoadJournal.get_default_file(folder))
+        BulkQuoteLoader(loader, workers = args.workers, writers = args.writers, journal = journal).load_files(file_names, force = args.force)
     finally:
         loader.disconnect()
\ No newline at end of file
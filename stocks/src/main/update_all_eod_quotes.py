@@ -13,17 +13,26 @@ if parent_folder not in sys.path:
 
 
 if __name__ == '__main__':
+    import argparse
     from quotes.updater import QuoteUpdater
+    from symbols.symbols import Symbols
     from common.logging import Logger
     from datetime import datetime
     
+    parser = argparse.ArgumentParser(description = "Fetches the quotes of all stocks and writes the new or changed ones to Cassandra")
+    parser.add_argument("start_date", nargs = "?", help = "fetch all stocks from this date (%%Y-%%m-%%d), otherwise each stock from the day after its watermark")
+    parser.add_argument("--rebuild-watermarks", action = "store_true", help = "rebuild the watermarks from the last date stored in Cassandra before updating")
+    args = parser.parse_args()
+    
     logger = Logger.get_logger(__name__)
     updater = QuoteUpdater()
     
-    start_date = datetime.strptime(sys.argv[1], "%Y-%m-%d").date().strftime("%Y-%m-%d")
+    start_date = datetime.strptime(args.start_date, "%Y-%m-%d").date().strftime("%Y-%m-%d") if args.start_date != None else None
     
     try:
         updater.connect()
+        if args.rebuild_watermarks:
+            updater.watermarks.rebuild(updater.quote_loader.session, [stock.symbol for stock in Symbols.fetch_all_ctx_stocks()])
         updater.update_all_quotes(start_date)
     finally:
-        updater.disconnect()
\ No newline at end of file
+        updater.disconnect()
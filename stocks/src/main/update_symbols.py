@@ -13,20 +13,25 @@ if parent_folder not in sys.path:
     sys.path.insert(0, parent_folder)
 
 if __name__ == '__main__':
+    import argparse
     from symbols.symbols import Symbols
+    from symbols.updater import SymbolUpdater
     from common.cassandra import CassandraSession
     from common.logging import Logger
     
+    parser = argparse.ArgumentParser(description = "Writes the stocks added or renamed since the last run to the symbols table")
+    parser.add_argument("--delete-removed", action = "store_true", help = "delete the symbols which are no longer in the stock list")
+    args = parser.parse_args()
+    
     logger = Logger.get_logger(__name__)
     
-    result = Symbols.fetch_all_ctx_stocks()
+    stocks = Symbols.fetch_all_ctx_stocks()
     cassandra_session = CassandraSession()
     try:
         cassandra_session.connect()
-        for ctx_stock in result:
-            yahoo_symbol = Symbols.get_yahoo_symbol_from_ctx_symbol(ctx_stock.symbol)
-            Symbols.insert_symbol_mapping(cassandra_session, ctx_stock.symbol, yahoo_symbol, ctx_stock.name, ctx_stock.short_symbol)
-            logger.info("%s -> %s %s" % (ctx_stock.symbol, yahoo_symbol, ctx_stock.name))
-        Symbols.logger.info("Updated %d symbols from CoreTX" % len(result))
+        if len(stocks) > 0:
+            SymbolUpdater().update(cassandra_session.session, stocks, delete_removed = args.delete_removed)
+        else:
+            logger.error("No stock to update the symbols from")
     finally:
         cassandra_session.disconnect()
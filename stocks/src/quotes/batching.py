@@ -0,0 +1,188 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import time
+import threading
+import collections
+import unittest
+from datetime import datetime
+from common.logging import Logger
+from common.scheduler import RequestScheduler
+from common.files import iter_response_chunks
+from quotes.eod_quote import EodQuoteBatch
+
+class OhlcBatcher(object):
+    '''
+    Requests /api/ohlc/ from ctxalgo.com for many symbols at a time.
+    The number of symbols per request is sized so that the expected response stays within
+    the byte budget, using the requested date span and the response sizes and latencies seen so far.
+    A failed request is split in halves which are retried, down to single symbols.
+    '''
+    logger = Logger.get_logger(__name__)
+    host = "ctxalgo.com"
+    earliest_date = "1990-12-19"
+    BatchResult = collections.namedtuple("BatchResult", ["symbols", "batches", "error"])
+
+    def __init__(self, scheduler = None, target_bytes = 4 * 1024 * 1024, target_seconds = 30.0, max_symbols = 50, bytes_per_symbol_day = 64.0):
+        self.scheduler = scheduler if scheduler != None else RequestScheduler.get_default()
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.max_symbols = max_symbols
+        self.bytes_per_symbol_day = bytes_per_symbol_day
+        self.bytes_per_second = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_span_days(start_date, end_date):
+        start_date = max(start_date, OhlcBatcher.earliest_date)
+        days = (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+        return max(days, 1)
+
+    def get_batch_size(self, start_date, end_date):
+        with self._lock:
+            budget = self.target_bytes
+            if self.bytes_per_second != None:
+                budget = min(budget, self.bytes_per_second * self.target_seconds)
+            bytes_per_symbol = self.bytes_per_symbol_day * OhlcBatcher.get_span_days(start_date, end_date)
+        return int(max(1, min(self.max_symbols, budget // bytes_per_symbol)))
+
+    def observe(self, symbol_count, start_date, end_date, response_bytes, elapsed_seconds, weight = 0.3):
+        '''
+        Updates the moving averages of response bytes per symbol per day and of download throughput
+        '''
+        bytes_per_symbol_day = float(response_bytes) / (symbol_count * OhlcBatcher.get_span_days(start_date, end_date))
+        with self._lock:
+            self.bytes_per_symbol_day = (1 - weight) * self.bytes_per_symbol_day + weight * max(bytes_per_symbol_day, 1.0)
+            if elapsed_seconds > 0:
+                bytes_per_second = response_bytes / elapsed_seconds
+                if self.bytes_per_second == None:
+                    self.bytes_per_second = bytes_per_second
+                else:
+                    self.bytes_per_second = (1 - weight) * self.bytes_per_second + weight * bytes_per_second
+
+    def request(self, symbols, start_date, end_date):
+        '''
+        Sends one /api/ohlc/ request, decoding the response one symbol at a time as it is read
+
+        Returns
+        -------
+        batches : OrderedDict of str : EodQuoteBatch
+            The quotes of each symbol in the response
+        '''
+        url = "/api/ohlc/%s?start-date=%s&end-date=%s" % (",".join(symbols), start_date, end_date)
+        started = time.time()
+
+        def read_batches(response):
+            if response.status != 200:
+                response.read()
+                return None, 0, response.status
+            response_bytes = [0]
+            def count_chunks():
+                for chunk in iter_response_chunks(response):
+                    response_bytes[0] = response_bytes[0] + len(chunk)
+                    yield chunk
+            batches = collections.OrderedDict()
+            for batch in EodQuoteBatch.iter_ctx_json(count_chunks()):
+                batches[batch.symbol] = EodQuoteBatch.concatenate([batches[batch.symbol], batch]) if batch.symbol in batches else batch
+            return batches, response_bytes[0], response.status
+
+        batches, response_bytes, status = self.scheduler.request(OhlcBatcher.host, url, read_batches, { "Accept-Encoding": "gzip" })
+        if status != 200:
+            raise BatchRequestError("HTTP %d from %s" % (status, url))
+        self.observe(len(symbols), start_date, end_date, response_bytes, time.time() - started)
+        return batches
+
+    def download(self, symbols, start_date, end_date):
+        '''
+        Sends one /api/ohlc/ request and returns the response body without decoding it, e.g. to decode it in another thread with decode()
+        '''
+        url = "/api/ohlc/%s?start-date=%s&end-date=%s" % (",".join(symbols), start_date, end_date)
+        started = time.time()
+        response_body, status = self.scheduler.request(OhlcBatcher.host, url, lambda response: (b"".join(iter_response_chunks(response)), response.status), { "Accept-Encoding": "gzip" })
+        if status != 200:
+            raise BatchRequestError("HTTP %d from %s" % (status, url))
+        self.observe(len(symbols), start_date, end_date, len(response_body), time.time() - started)
+        return response_body
+
+    @staticmethod
+    def decode(response_body):
+        '''
+        Yields one EodQuoteBatch per symbol of a response body returned by download()
+        '''
+        return EodQuoteBatch.iter_ctx_json([response_body])
+
+    def fetch(self, symbols, start_date, end_date, request = None):
+        '''
+        Yields a BatchResult for each successful request, and one for each symbol that still failed on its own
+
+        Parameters
+        ----------
+        request : function of (symbols, start_date, end_date), default None
+            Sends one request, self.request by default. With self.download, the batches of each result are the response body.
+        '''
+        request = request if request != None else self.request
+        remaining = collections.deque(symbols)
+        retries = collections.deque()
+        while len(remaining) > 0 or len(retries) > 0:
+            if len(retries) > 0:
+                batch = retries.popleft()
+            else:
+                batch = [remaining.popleft() for _ in range(min(len(remaining), self.get_batch_size(start_date, end_date)))]
+            try:
+                yield OhlcBatcher.BatchResult(batch, request(batch, start_date, end_date), None)
+            except Exception as e:
+                if len(batch) == 1:
+                    OhlcBatcher.logger.error("Failed to fetch quotes for %s: %s" % (batch[0], e))
+                    yield OhlcBatcher.BatchResult(batch, None, e)
+                else:
+                    OhlcBatcher.logger.warning("Splitting batch of %d symbol(s) after failure: %s" % (len(batch), e))
+                    half = len(batch) // 2
+                    retries.appendleft(batch[half:])
+                    retries.appendleft(batch[:half])
+
+
+class BatchRequestError(Exception):
+    pass
+
+
+class OhlcBatcherTests(unittest.TestCase):
+
+    class FakeBatcher(OhlcBatcher):
+
+        def __init__(self, failing_symbol, **kwargs):
+            super().__init__(**kwargs)
+            self.failing_symbol = failing_symbol
+            self.requests = []
+
+        def request(self, symbols, start_date, end_date):
+            self.requests.append(list(symbols))
+            if self.failing_symbol in symbols:
+                raise BatchRequestError("failed")
+            self.observe(len(symbols), start_date, end_date, len(symbols) * 1000, 0.1)
+            return dict((symbol, {}) for symbol in symbols)
+
+    def test_batch_size_from_date_span(self):
+        batcher = OhlcBatcher(target_bytes = 64 * 100, bytes_per_symbol_day = 64)
+        assert batcher.get_batch_size("2015-05-01", "2015-05-10") == 10
+        assert batcher.get_batch_size("1900-01-01", "2015-05-10") == 1
+        assert batcher.get_batch_size("2015-05-10", "2015-05-10") == 50
+
+    def test_batch_size_from_observed_responses(self):
+        batcher = OhlcBatcher(target_bytes = 1000 * 1000, bytes_per_symbol_day = 1000)
+        assert batcher.get_batch_size("2015-05-01", "2015-05-10") == 50
+        for _ in range(20):
+            batcher.observe(10, "2015-05-01", "2015-05-10", 10 * 10 * 10000, 1.0)
+        assert batcher.get_batch_size("2015-05-01", "2015-05-10") < 50
+
+    def test_split_failed_batch(self):
+        symbols = ["s%02d" % x for x in range(8)]
+        batcher = OhlcBatcherTests.FakeBatcher("s05")
+        results = list(batcher.fetch(symbols, "2015-05-20", "2015-05-22"))
+        fetched = sorted(symbol for result in results if result.error == None for symbol in result.symbols)
+        failed = [result.symbols for result in results if result.error != None]
+        assert fetched == [symbol for symbol in symbols if symbol != "s05"]
+        assert failed == [["s05"]]
+        assert batcher.requests[0] == symbols
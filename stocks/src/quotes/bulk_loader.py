@@ -0,0 +1,158 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import time
+import threading
+import collections
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from common.logging import Logger
+from quotes.loader import QuoteLoader, CtxQuoteLoader
+from quotes.store import QuoteStore
+from quotes.journal import LoadJournal
+
+class BulkQuoteLoader(object):
+    '''
+    Loads many quote files into Cassandra in parallel.
+    Files are parsed into EodQuoteBatch objects by a pool of worker processes, largest files first so that the last files to finish are small.
+    The batches are written by writer threads, each with its own asynchronous writer on the shared session of the quote loader.
+    At most twice as many files as workers are parsed or waiting to be written at a time, which bounds memory.
+
+    Usage:
+        quote_loader = CtxQuoteLoader(batch_rows = 50)
+        quote_loader.connect()
+        results = BulkQuoteLoader(quote_loader, workers = 8).load_files(file_names)
+    '''
+    logger = Logger.get_logger(__name__)
+    LoadResult = collections.namedtuple("LoadResult", ["file_name", "symbol", "rows", "error"])
+
+    def __init__(self, quote_loader, workers = None, writers = 4, journal = None):
+        '''
+        Files are parsed with quote_loader.load_batch in workers processes (one per CPU by default),
+        or in the writer threads if workers is 0 or 1.
+        If a LoadJournal is given, each file is recorded in it once all its quotes are written, and files already done are skipped.
+        '''
+        self.quote_loader = quote_loader
+        self.journal = journal
+        self.workers = workers if workers != None else os.cpu_count()
+        self.writers = writers
+
+    @staticmethod
+    def sort_by_size(file_names):
+        return sorted(file_names, key = os.path.getsize, reverse = True)
+
+    def write(self, file_name, record, parse_future, window):
+        symbol = QuoteLoader.get_symbol(file_name)
+        try:
+            batch = parse_future.result() if parse_future != None else self.quote_loader.load_batch(file_name)
+            rows = self.quote_loader.insert_eod_quotes(batch)
+            if self.journal != None and rows == len(batch):
+                self.journal.record(record._replace(rows = rows))
+            BulkQuoteLoader.logger.info("Loaded %d quotes for file %s for symbol %s" % (rows, file_name, symbol))
+            return BulkQuoteLoader.LoadResult(file_name, symbol, rows, None)
+        except Exception as e:
+            BulkQuoteLoader.logger.error("Failed to load quotes from %s: %s" % (file_name, e))
+            return BulkQuoteLoader.LoadResult(file_name, symbol, 0, e)
+        finally:
+            window.release()
+
+    def load_files(self, file_names, force = False):
+        '''
+        Returns a LoadResult for each file loaded, largest file first. Files done in the journal are skipped unless force is True.
+        '''
+        if self.journal != None and not force:
+            pending = [file_name for file_name in file_names if not self.journal.is_done(file_name)]
+            if len(pending) < len(file_names):
+                BulkQuoteLoader.logger.info("Skipping %d file(s) already loaded according to %s" % (len(file_names) - len(pending), self.journal.journal_file))
+            file_names = pending
+        file_names = BulkQuoteLoader.sort_by_size(file_names)
+        self.quote_loader.get_insert_statement()
+        window = threading.BoundedSemaphore(max(self.workers, self.writers) * 2)
+        started = time.time()
+        parsers = ProcessPoolExecutor(max_workers = self.workers) if self.workers > 1 else None
+        try:
+            with ThreadPoolExecutor(max_workers = self.writers) as writers:
+                futures = []
+                for file_name in file_names:
+                    window.acquire()
+                    record = LoadJournal.describe(file_name)
+                    parse_future = parsers.submit(self.quote_loader.load_batch, file_name) if parsers != None else None
+                    futures.append(writers.submit(self.write, file_name, record, parse_future, window))
+                results = [future.result() for future in futures]
+        finally:
+            if parsers != None:
+                parsers.shutdown()
+        self.log_stats(results, time.time() - started)
+        return results
+
+    def log_stats(self, results, elapsed):
+        rows = sum(result.rows for result in results)
+        stats = self.quote_loader.get_writer_stats()
+        BulkQuoteLoader.logger.info("Loaded %d quotes from %d file(s) (%d failed) in %.1fs, %.1f quote(s) per second, %d request(s), %d retries" \
+                                    % (rows, len(results), len([result for result in results if result.error != None]), elapsed,
+                                       rows / elapsed if elapsed > 0 else 0.0, stats["requests"], stats["retries"]))
+
+
+class BulkQuoteLoaderTests(unittest.TestCase):
+
+    class FakeSession(object):
+
+        def __init__(self):
+            self.rows = []
+            self._lock = threading.Lock()
+
+        def prepare(self, cql):
+            return cql
+
+        def execute_async(self, statement, parameters = None):
+            with self._lock:
+                self.rows.append(parameters)
+            return self
+
+        def add_callbacks(self, callback, errback, callback_args = (), errback_args = ()):
+            callback(None, *callback_args)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_names = []
+        for index, days in enumerate([3, 1, 2]):
+            arrays = { "dates": ["2015-05-%02dT00:00:00" % (day + 1) for day in range(days)], "opens": [8.1] * days, "highs": [8.5] * days, "lows": [8.0] * days,
+                       "closes": [8.3] * days, "volumes": [1000] * days, "amounts": [8300.0] * days }
+            file_name = os.path.join(self.folder, "sh60000%d" % index)
+            QuoteStore.write(file_name, QuoteStore.from_ctx_json(arrays))
+            self.file_names.append(file_name)
+        with open(os.path.join(self.folder, "sh600009"), "w") as text_file:
+            text_file.write('{"sh600009": {"dates": [')
+        self.file_names.append(os.path.join(self.folder, "sh600009"))
+
+    def tearDown(self):
+        for file_name in self.file_names:
+            os.remove(file_name)
+        os.rmdir(self.folder)
+
+    def test_load_files(self):
+        for workers in [0, 2]:
+            quote_loader = CtxQuoteLoader()
+            quote_loader.session = BulkQuoteLoaderTests.FakeSession()
+            results = BulkQuoteLoader(quote_loader, workers = workers, writers = 2).load_files(self.file_names)
+            assert [result.symbol for result in results] == ["sh600000", "sh600002", "sh600001", "sh600009"]
+            assert [result.rows for result in results] == [3, 2, 1, 0]
+            assert results[-1].error != None
+            assert len(quote_loader.session.rows) == 6
+
+    def test_resume_from_journal(self):
+        journal = LoadJournal(LoadJournal.get_default_file(self.folder))
+        self.file_names.append(journal.journal_file)
+        quote_loader = CtxQuoteLoader()
+        quote_loader.session = BulkQuoteLoaderTests.FakeSession()
+        BulkQuoteLoader(quote_loader, workers = 0, journal = journal).load_files(self.file_names[:2])
+        results = BulkQuoteLoader(quote_loader, workers = 0, journal = journal).load_files(self.file_names[:-1])
+        assert [result.symbol for result in results] == ["sh600002", "sh600009"]
+        assert len(quote_loader.session.rows) == 6
+        results = BulkQuoteLoader(quote_loader, workers = 0, journal = journal).load_files(self.file_names[:-1], force = True)
+        assert len(results) == 4
@@ -6,7 +6,11 @@ Created on 23 May 2015
 
 import unittest
 import json
-from datetime import datetime
+import collections
+import functools
+from datetime import datetime, date as date_type
+import numpy as np
+from common.json_stream import iter_json_members
 
 class EodQuote(object):
     '''
@@ -18,7 +22,7 @@ class EodQuote(object):
         Constructor
         '''
         self.symbol = symbol
-        self.date = datetime.strptime(date, "%Y-%m-%d").date()
+        self.date = date if isinstance(date, date_type) else datetime.strptime(date, "%Y-%m-%d").date()
         self.open = float(open_)
         self.high = float(high)
         self.low = float(low)
@@ -39,17 +43,42 @@ class YahooEodQuote(EodQuote):
         elements = line.split(",")
         return YahooEodQuote(symbol, elements[0], elements[1], elements[2], elements[3], elements[4], elements[5], elements[6])
 
+    @staticmethod
+    def parse_csv(symbol, text):
+        '''
+        Parses a whole Yahoo table.csv into an EodQuoteBatch, with the same values and order as from_line on each line.
+        The text is split into fields once and each column is converted by numpy, instead of one EodQuote per line.
+
+        Raises
+        ------
+        ValueError : A line does not have 7 fields, or a field is not a number
+        '''
+        lines = [line for line in text.splitlines() if len(line) > 0 and not line.startswith("Date")]
+        for number, line in enumerate(lines):
+            if line.count(",") != 6:
+                raise ValueError("Expected 7 fields on quote line %d of %s: %s" % (number + 1, symbol, line))
+        fields = ",".join(lines).split(",") if len(lines) > 0 else []
+        return EodQuoteBatch(symbol, EodQuoteBatch.to_day_numbers(fields[0::7]), np.array(fields[1::7], dtype = "f8"), np.array(fields[2::7], dtype = "f8"),
+                             np.array(fields[3::7], dtype = "f8"), np.array(fields[4::7], dtype = "f8"), np.array(fields[5::7], dtype = "i8"),
+                             adj_closes = np.array(fields[6::7], dtype = "f8"))
+
 
 class CtxEodQuote(EodQuote):
     
     def __init__(self, symbol, date, open_, high, low, close, volume, amount):
-        super().__init__(symbol, date[:10], open_, high, low, close, volume)
+        super().__init__(symbol, date if isinstance(date, date_type) else date[:10], open_, high, low, close, volume)
         self.amount = amount
 
     @staticmethod
     def from_json(json_string):
         eod_quotes = []
-        loaded_json = json.loads(json_string)
+        for symbol, arrays in iter_json_members([json_string]):
+            eod_quotes.extend(CtxEodQuote.from_loaded_json({ symbol: arrays }))
+        return eod_quotes
+
+    @staticmethod
+    def from_loaded_json(loaded_json):
+        eod_quotes = []
         for symbol in loaded_json:
             arrays = loaded_json[symbol]
             for index, value in enumerate(arrays["dates"]):
@@ -63,6 +92,151 @@ class CtxEodQuote(EodQuote):
                 eod_quotes.append(CtxEodQuote(symbol, date, open_, high, low, close, volume, amount))
         return eod_quotes
 
+class EodQuoteBatch(object):
+    '''
+    EOD quotes of one symbol held as one numpy array per field instead of one EodQuote object per bar.
+    Dates are int32 day numbers since 1970-01-01, as in QuoteStore files. Missing amounts and adjusted closes are NaN, e.g. the amounts of Yahoo quotes.
+    Slicing returns a batch of views on the same arrays, indexing and iterating return lightweight EodQuoteBatch.Row tuples.
+    '''
+    columns = [
+        ("dates", np.dtype("<i4")),
+        ("opens", np.dtype("<f8")),
+        ("highs", np.dtype("<f8")),
+        ("lows", np.dtype("<f8")),
+        ("closes", np.dtype("<f8")),
+        ("volumes", np.dtype("<i8")),
+        ("amounts", np.dtype("<f8")),
+        ("adj_closes", np.dtype("<f8"))
+        ]
+    Row = collections.namedtuple("EodQuoteRow", ["symbol", "date", "open", "high", "low", "close", "volume", "amount", "adj_close"])
+    epoch_ordinal = date_type(1970, 1, 1).toordinal()
+
+    def __init__(self, symbol, dates, opens, highs, lows, closes, volumes, amounts = None, adj_closes = None):
+        self.symbol = symbol
+        rows = len(dates)
+        values = {
+            "dates": dates, "opens": opens, "highs": highs, "lows": lows, "closes": closes, "volumes": volumes,
+            "amounts": amounts if amounts is not None else np.full(rows, np.nan),
+            "adj_closes": adj_closes if adj_closes is not None else np.full(rows, np.nan)
+            }
+        for name, dtype in EodQuoteBatch.columns:
+            column = np.asarray(values[name])
+            if column.dtype != dtype:
+                column = column.astype(dtype)
+            if len(column) != rows:
+                raise ValueError("Column %s has %d values instead of %d" % (name, len(column), rows))
+            setattr(self, name, column)
+
+    @staticmethod
+    @functools.lru_cache(maxsize = None)
+    def to_date(day_number):
+        return date_type.fromordinal(EodQuoteBatch.epoch_ordinal + day_number)
+
+    @staticmethod
+    @functools.lru_cache(maxsize = None)
+    def to_day_number(date):
+        '''
+        Converts a "%Y-%m-%d" string (anything after the first 10 characters is ignored) to a day number.
+        Memoized, as the same few thousand trading days repeat in the quotes of every symbol.
+        '''
+        return datetime.strptime(date[:10], "%Y-%m-%d").toordinal() - EodQuoteBatch.epoch_ordinal
+
+    @staticmethod
+    def to_day_numbers(dates):
+        to_day_number = EodQuoteBatch.to_day_number
+        return np.fromiter((to_day_number(date) for date in dates), dtype = "<i4", count = len(dates))
+
+    @staticmethod
+    def from_columns(symbol, columns):
+        '''
+        Creates a batch from a dict of column name to array, e.g. the memory-mapped columns of a QuoteStore file, without copying them
+        '''
+        return EodQuoteBatch(symbol, *[columns.get(name) for name, _ in EodQuoteBatch.columns])
+
+    @staticmethod
+    def from_ctx_json(symbol, arrays):
+        return EodQuoteBatch(symbol, EodQuoteBatch.to_day_numbers(arrays["dates"]), arrays["opens"], arrays["highs"], arrays["lows"], arrays["closes"],
+                             arrays["volumes"], amounts = arrays["amounts"])
+
+    @staticmethod
+    def from_loaded_json(loaded_json):
+        '''
+        Returns one batch per symbol of a decoded ctxalgo /api/ohlc/ response
+        '''
+        return [EodQuoteBatch.from_ctx_json(symbol, loaded_json[symbol]) for symbol in loaded_json]
+
+    @staticmethod
+    def iter_ctx_json(chunks):
+        '''
+        Yields one batch per symbol of ctxalgo /api/ohlc/ responses read in text or bytes chunks, e.g. from an HTTP response or a file,
+        decoding one symbol at a time. A symbol appears once for each appended response holding it.
+        '''
+        for symbol, arrays in iter_json_members(chunks):
+            yield EodQuoteBatch.from_ctx_json(symbol, arrays)
+
+    @staticmethod
+    def from_eod_quotes(symbol, eod_quotes):
+        eod_quotes = list(eod_quotes)
+        return EodQuoteBatch(symbol,
+                             np.array([eod_quote.date.toordinal() - EodQuoteBatch.epoch_ordinal for eod_quote in eod_quotes], dtype = "<i4"),
+                             [eod_quote.open for eod_quote in eod_quotes], [eod_quote.high for eod_quote in eod_quotes],
+                             [eod_quote.low for eod_quote in eod_quotes], [eod_quote.close for eod_quote in eod_quotes],
+                             [eod_quote.volume for eod_quote in eod_quotes],
+                             amounts = [getattr(eod_quote, "amount", None) for eod_quote in eod_quotes],
+                             adj_closes = [getattr(eod_quote, "adj_close", np.nan) for eod_quote in eod_quotes])
+
+    @staticmethod
+    def concatenate(batches):
+        batches = list(batches)
+        if len(batches) == 0:
+            raise ValueError("No batches to concatenate")
+        symbols = set(batch.symbol for batch in batches)
+        if len(symbols) > 1:
+            raise ValueError("Cannot concatenate batches of different symbols (%s)" % ", ".join(sorted(symbols)))
+        if len(batches) == 1:
+            return batches[0]
+        return EodQuoteBatch(batches[0].symbol, *[np.concatenate([getattr(batch, name) for batch in batches]) for name, _ in EodQuoteBatch.columns])
+
+    def to_ctx_json(self):
+        '''
+        Returns the arrays of the batch in the format of a ctxalgo /api/ohlc/ response, e.g. to save them in raw mode
+        '''
+        return {
+            "dates": [EodQuoteBatch.to_date(date).strftime("%Y-%m-%dT00:00:00") for date in self.dates.tolist()],
+            "opens": self.opens.tolist(), "highs": self.highs.tolist(), "lows": self.lows.tolist(), "closes": self.closes.tolist(),
+            "volumes": self.volumes.tolist(), "amounts": self.amounts.tolist()
+            }
+
+    def to_columns(self):
+        return collections.OrderedDict((name, getattr(self, name)) for name, _ in EodQuoteBatch.columns)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        '''
+        A slice returns a batch of views, a boolean mask or an array of positions a batch of copies, an integer a Row
+        '''
+        if isinstance(index, (slice, np.ndarray)):
+            return EodQuoteBatch(self.symbol, *[getattr(self, name)[index] for name, _ in EodQuoteBatch.columns])
+        adj_close = float(self.adj_closes[index])
+        return EodQuoteBatch.Row(self.symbol, EodQuoteBatch.to_date(int(self.dates[index])), float(self.opens[index]), float(self.highs[index]),
+                                 float(self.lows[index]), float(self.closes[index]), int(self.volumes[index]), float(self.amounts[index]),
+                                 None if adj_close != adj_close else adj_close)
+
+    def __iter__(self):
+        to_date = EodQuoteBatch.to_date
+        symbol = self.symbol
+        for date, open_, high, low, close, volume, amount, adj_close in zip(self.dates.tolist(), self.opens.tolist(), self.highs.tolist(), self.lows.tolist(),
+                                                                            self.closes.tolist(), self.volumes.tolist(), self.amounts.tolist(), self.adj_closes.tolist()):
+            yield EodQuoteBatch.Row(symbol, to_date(date), open_, high, low, close, volume, amount, None if adj_close != adj_close else adj_close)
+
+    def __str__(self, *args, **kwargs):
+        if len(self) == 0:
+            return "[%s] no quotes" % self.symbol
+        return "[%s] %d quote(s) from %s to %s" % (self.symbol, len(self), EodQuoteBatch.to_date(int(self.dates.min())), EodQuoteBatch.to_date(int(self.dates.max())))
+
+
 class EodQuoteTests(unittest.TestCase):
     
     def test_from_line(self):
@@ -73,4 +247,79 @@ class EodQuoteTests(unittest.TestCase):
         assert quote.low == "86.10"
         assert quote.close == "96.57"
         assert quote.volume == "22140100"
-        
\ No newline at end of file
+
+
+class YahooEodQuoteTests(unittest.TestCase):
+
+    csv = "Date,Open,High,Low,Close,Volume,Adj Close\r\n2015-05-22,88.80,96.57,86.10,96.57,22140100,96.57\r\n2015-05-21,80.00,88.00,79.00,87.79,1000,87.79\r\n"
+
+    def test_parse_csv_matches_from_line(self):
+        batch = YahooEodQuote.parse_csv("300460.SZ", YahooEodQuoteTests.csv)
+        quotes = [YahooEodQuote.from_line("300460.SZ", line) for line in YahooEodQuoteTests.csv.splitlines()[1:]]
+        assert len(batch) == 2
+        for row, quote in zip(batch, quotes):
+            assert (row.date, row.open, row.high, row.low, row.close, row.volume, row.adj_close) == \
+                (quote.date, quote.open, quote.high, quote.low, quote.close, quote.volume, quote.adj_close)
+        assert len(YahooEodQuote.parse_csv("300460.SZ", "Date,Open,High,Low,Close,Volume,Adj Close\n")) == 0
+
+    def test_parse_csv_with_missing_field(self):
+        try:
+            YahooEodQuote.parse_csv("300460.SZ", "2015-05-22,88.80,96.57,86.10,96.57,22140100\n")
+            assert False
+        except ValueError:
+            pass
+        try:
+            YahooEodQuote.parse_csv("300460.SZ", "2015-05-22,88.80,96.57,86.10,96.57,22140100,96.57,1\n2015-05-21,80.00,88.00,79.00,87.79,1000\n")
+            assert False
+        except ValueError:
+            pass
+
+
+class CtxEodQuoteTests(unittest.TestCase):
+
+    full = '{"sh600399": {"dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00"], "opens": [8.1, 8.2], "highs": [8.5, 8.6], "lows": [8.0, 8.1],\n "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0]}}'
+    delta = '{"sh600399": {"dates": ["2015-05-25T00:00:00"], "opens": [8.4], "highs": [8.9], "lows": [8.3], "closes": [8.8], "volumes": [3000], "amounts": [26400.0]}}'
+
+    def test_from_json_with_appended_documents(self):
+        quotes = CtxEodQuote.from_json(CtxEodQuoteTests.full + "\n" + CtxEodQuoteTests.delta + "\n")
+        assert len(quotes) == 3
+        assert quotes[2].date.strftime("%Y-%m-%d") == "2015-05-25"
+        assert quotes[2].close == 8.8
+
+    def setUp(self):
+        self.batch = EodQuoteBatch.from_loaded_json(json.loads(CtxEodQuoteTests.full))[0]
+
+    def test_from_ctx_json(self):
+        assert self.batch.symbol == "sh600399"
+        assert len(self.batch) == 2
+        assert self.batch.dates.dtype == np.dtype("<i4")
+        assert list(self.batch.closes) == [8.3, 8.4]
+
+    def test_rows(self):
+        rows = list(self.batch)
+        assert rows[1].date == date_type(2015, 5, 22)
+        assert rows[1].volume == 2000
+        assert rows[1].amount == 16800.0
+        assert rows[1].adj_close == None
+        assert self.batch[-1] == rows[1]
+
+    def test_iter_ctx_json(self):
+        text = CtxEodQuoteTests.full + "\n" + CtxEodQuoteTests.delta
+        batches = list(EodQuoteBatch.iter_ctx_json([text[x:x + 16] for x in range(0, len(text), 16)]))
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert list(batches[0]) == list(self.batch)
+        assert batches[0].to_ctx_json() == json.loads(CtxEodQuoteTests.full)["sh600399"]
+
+    def test_slice_and_concatenate(self):
+        first = self.batch[:1]
+        second = self.batch[1:]
+        assert len(first) == 1
+        assert np.shares_memory(second.opens, self.batch.opens)
+        assert list(self.batch[np.array([False, True])]) == [self.batch[1]]
+        joined = EodQuoteBatch.concatenate([first, second])
+        assert list(joined.dates) == list(self.batch.dates)
+        assert list(joined) == list(self.batch)
+
+    def test_from_eod_quotes(self):
+        quotes = CtxEodQuote.from_json(CtxEodQuoteTests.full)
+        assert list(EodQuoteBatch.from_eod_quotes("sh600399", quotes)) == list(self.batch)
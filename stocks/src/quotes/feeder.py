@@ -5,13 +5,23 @@ Created on 23 May 2015
 '''
 
 import os
-import http.client
 import unittest
 import time
 import tempfile
 import abc
+import collections
+import json
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from common.logging import Logger
+from common.scheduler import RequestScheduler
+from common.files import AtomicFileWriter, save_response, append_text, open_text, iter_response_chunks
 from symbols.symbols import Symbols
+from common.json_stream import iter_file_members
+from quotes.eod_quote import EodQuoteBatch
+from quotes.batching import OhlcBatcher
+from quotes.store import QuoteStore, QuoteStoreError
+from quotes.manifest import QuoteManifest
 from common.cassandra import CassandraSession
 
 class QuoteFeeder(object):
@@ -19,24 +29,58 @@ class QuoteFeeder(object):
     classdocs
     '''
     logger = Logger.get_logger(__name__)
+    FetchResult = collections.namedtuple("FetchResult", ["symbol", "file_name", "error"])
+    source = None
 
-    def __init__(self, folder):
+    def __init__(self, folder, scheduler = None, compress = False, raw = False):
+        '''
+        Quotes are saved in the binary columnar format of QuoteStore, unless raw is True,
+        in which case the provider responses are saved as they are (gzip compressed if compress is True)
+        '''
         if not os.path.exists(folder):
             os.makedirs(folder)
         self.folder = folder
+        self.scheduler = scheduler if scheduler != None else RequestScheduler.get_default()
+        self.compress = compress
+        self.raw = raw
+        self.manifest = QuoteManifest(folder)
 
     def get_file_name_by_symbol(self, symbol):
         return self.folder + os.path.sep + symbol
 
+    def get_source(self):
+        '''
+        The source recorded in the manifest, which also tells whether the file is raw
+        '''
+        return self.source + "/raw" if self.raw else self.source
+
+    def is_fetched(self, symbol):
+        '''
+        Whether the file of a symbol is unchanged since the manifest recorded it.
+        Files saved before the manifest existed are trusted if they exist.
+        '''
+        if self.manifest.get(symbol) != None:
+            return self.manifest.get_valid(symbol) != None
+        return os.path.exists(self.get_file_name_by_symbol(symbol))
+
+    def record(self, symbol, file_name, first_date = None, last_date = None, rows = None):
+        return self.manifest.update(symbol, file_name, self.get_source(), first_date, last_date, rows)
+
     @abc.abstractmethod
     def download_quotes(self, symbol, skip_existing):
         return None
 
     def fetch(self, symbol, skip_existing = True):
+        try:
+            return self._fetch(symbol, skip_existing)
+        finally:
+            self.manifest.save()
+
+    def _fetch(self, symbol, skip_existing):
         QuoteFeeder.logger.debug("Fetching quotes for symbol %s ..." % symbol)
         file_name = self.get_file_name_by_symbol(symbol)
         
-        if skip_existing and os.path.exists(file_name):
+        if skip_existing and self.is_fetched(symbol):
             QuoteFeeder.logger.info("Quotes for %s already exists in %s" % (symbol, file_name))
         else:
             file_name = self.download_quotes(symbol, skip_existing)
@@ -47,89 +91,253 @@ class QuoteFeeder(object):
 
         return file_name
 
+    def fetch_symbols(self, symbols, workers = 1, skip_existing = True):
+        return self._run_all(symbols, lambda symbol: self._fetch(symbol, skip_existing), workers)
+
+    def _run_all(self, items, fetch_item, workers):
+        '''
+        Runs fetch_item on each item with at most the given number of worker threads.
+        fetch_item returns the saved file name (None when nothing was saved), a FetchResult or a list of FetchResult.
+        Returns the FetchResults in the order of the items.
+        The scheduler is left open, as it may be shared with other feeders or the resolver; its owner closes it.
+        '''
+        def run(item):
+            try:
+                result = fetch_item(item)
+                if isinstance(result, list):
+                    return result
+                if isinstance(result, QuoteFeeder.FetchResult):
+                    return [result]
+                return [QuoteFeeder.FetchResult(item, result, None)]
+            except Exception as e:
+                QuoteFeeder.logger.error("Failed to fetch quotes for %s: %s" % (item, e))
+                return [QuoteFeeder.FetchResult(item, None, e)]
+
+        try:
+            if workers <= 1:
+                item_results = [run(item) for item in items]
+            else:
+                with ThreadPoolExecutor(max_workers = workers) as executor:
+                    item_results = list(executor.map(run, items))
+        finally:
+            self.manifest.save()
+            self.scheduler.log_stats()
+
+        results = [result for results in item_results for result in results]
+
+        failed = [result for result in results if result.file_name == None]
+        QuoteFeeder.logger.info("Fetched %d of %d item(s) with %d worker(s), %d failed" % (len(results) - len(failed), len(results), workers, len(failed)))
+        return results
+
 
 class YahooQuoteFeeder(QuoteFeeder):
     
-    def __init__(self, folder):
-        super().__init__(os.path.join(folder, "yahoo"))
+    source = "yahoo"
+
+    def __init__(self, folder, scheduler = None, compress = False, resolver = None, raw = False):
+        super().__init__(os.path.join(folder, "yahoo"), scheduler, compress, raw)
+        self.resolver = resolver if resolver != None else Symbols.get_yahoo_symbol_resolver()
     
-    def download_quotes(self, symbol, skip_existing):
-        conn = http.client.HTTPConnection("ichart.finance.yahoo.com")
-        conn.request("GET", "/table.csv?s=%s" % symbol)
-        response_body = conn.getresponse().read().decode("utf-8")
+    def save_quotes(self, response, file_name):
+        if self.raw:
+            return save_response(response, file_name, self.compress, validate = lambda chunk: chunk.startswith(b"Date"))
         
+        response_body = b"".join(iter_response_chunks(response)).decode("utf-8")
+        if not response_body.startswith("Date"):
+            return False
+        QuoteStore.write(file_name, QuoteStore.from_yahoo_csv(response_body))
+        return True
+
+    def download_quotes(self, symbol, skip_existing):
         file_name = self.get_file_name_by_symbol(symbol)
         
         'Save response to file if valid (starts with "Date")'
-        if response_body.startswith("Date"):
-            try:
-                text_file = open(file_name, "w")
-                text_file.write(response_body)
-                return file_name
-            finally:
-                if text_file != None:
-                    text_file.close()
+        save = lambda response: self.save_quotes(response, file_name)
+        if self.scheduler.request("ichart.finance.yahoo.com", "/table.csv?s=%s" % symbol, save, { "Accept-Encoding": "gzip" }):
+            self.record(symbol, file_name)
+            return file_name
         else:
             QuoteFeeder.logger.warning("Ignoring invalid quote response on symbol %s" % symbol)
             return None
 
+    def fetch_ctx_stock(self, cassandra_session, ctx_stock):
+        was_cached = self.resolver.is_cached(ctx_stock.symbol)
+        matched_yahoo_symbol = self.resolver.resolve(ctx_stock.symbol, save = False)
+        
+        file_name = None
+        if matched_yahoo_symbol != None:
+            file_name = self._fetch(matched_yahoo_symbol, True)
+            QuoteFeeder.logger.info("[%s] -> [%s]" % (ctx_stock.symbol, matched_yahoo_symbol))
+        else:
+            QuoteFeeder.logger.info("[%s] not found in Yahoo" % ctx_stock.symbol)
+        
+        if not was_cached:
+            Symbols.insert_symbol_mapping(cassandra_session, ctx_stock.symbol, matched_yahoo_symbol, ctx_stock.name, ctx_stock.symbol[2:])
+        return QuoteFeeder.FetchResult(ctx_stock.symbol, file_name, None)
 
-    def fetch_all(self):        
+    def fetch_all(self, workers = 1):
         cassandra_session = CassandraSession()        
         try:
             cassandra_session.connect()
-            
-            for ctx_stock in Symbols.fetch_all_ctx_stocks():
-                test_yahoo_symbols = []
-                if ctx_stock.symbol.startswith("sh"):
-                    test_yahoo_symbols.append(ctx_stock.symbol[2:] + ".SH")
-                elif ctx_stock.symbol.startswith("sz"):
-                    test_yahoo_symbols.append(ctx_stock.symbol[2:] + ".SZ")
-    
-                test_yahoo_symbols.append(ctx_stock.symbol[2:] + ".SS")
-                
-                for test_yahoo_symbol in test_yahoo_symbols:
-                    if self.fetch(test_yahoo_symbol) != None:
-                        matched_yahoo_symbol = test_yahoo_symbol
-                        break
-    
-                if matched_yahoo_symbol != None:
-                    QuoteFeeder.logger.info("[%s] -> [%s]" % (ctx_stock.symbol, matched_yahoo_symbol))
-                else:
-                    QuoteFeeder.logger.info("[%s] not found in Yahoo" % ctx_stock.symbol)
-                
-                Symbols.insert_symbol_mapping(cassandra_session, ctx_stock.symbol, matched_yahoo_symbol, ctx_stock.name, ctx_stock.symbol[2:])
+            self.resolver.seed_from_cassandra(cassandra_session)
+            return self._run_all(Symbols.fetch_all_ctx_stocks(), lambda ctx_stock: self.fetch_ctx_stock(cassandra_session, ctx_stock), workers)
         finally:
+            self.resolver.save()
             cassandra_session.disconnect()
 
 
 class CtxQuoteFeeder(QuoteFeeder):
     
-    def __init__(self, folder):
-        super().__init__(os.path.join(folder, "ctx"))
+    source = "ctx"
+    full_history_start_date = "1900-01-01"
 
-    def download_quotes(self, symbol, skip_existing):
-        conn = http.client.HTTPConnection("ctxalgo.com")
-        conn.request("GET", "/api/ohlc/%s?start-date=%s&end-date=%s" % (symbol, "1900-01-01", time.strftime("%Y-%m-%d")))
-        response_body = conn.getresponse().read().decode("utf-8")
+    def __init__(self, folder, scheduler = None, batcher = None, compress = False, raw = False):
+        super().__init__(os.path.join(folder, "ctx"), scheduler, compress, raw)
+        self.batcher = batcher if batcher != None else OhlcBatcher(self.scheduler)
+
+    def get_last_date(self, file_name):
+        '''
+        Returns the last quote date saved in the file as "%Y-%m-%d", or None if the file does not exist,
+        holds no quotes, cannot be parsed or is not in the format this feeder saves, so that it is downloaded again in full
+        '''
+        if not os.path.exists(file_name):
+            return None
+        try:
+            if QuoteStore.is_store_file(file_name):
+                return QuoteStore.get_last_date(file_name) if not self.raw else None
+            if not self.raw:
+                return None
+            last_date = None
+            with open_text(file_name) as quote_file:
+                for _, arrays in iter_file_members(quote_file):
+                    for date in arrays["dates"]:
+                        if last_date == None or date[:10] > last_date:
+                            last_date = date[:10]
+            return last_date
+        except (ValueError, KeyError, TypeError, EOFError, OSError, QuoteStoreError) as e:
+            QuoteFeeder.logger.warning("Ignoring corrupt quote file %s: %s" % (file_name, e))
+            return None
+
+    def get_saved_last_date(self, symbol):
+        '''
+        Returns the last quote date saved for a symbol, from the manifest if it has a valid entry in the format of this feeder,
+        otherwise from the file
+        '''
+        entry = self.manifest.get_valid(symbol)
+        if entry != None and entry.source == self.get_source() and entry.last_date != None:
+            return entry.last_date
+        return self.get_last_date(self.get_file_name_by_symbol(symbol))
+
+    def get_start_date(self, last_date):
+        if last_date == None:
+            return CtxQuoteFeeder.full_history_start_date
+        return (datetime.strptime(last_date, "%Y-%m-%d") + timedelta(days = 1)).strftime("%Y-%m-%d")
+
+    def save_quotes(self, symbol, batch, last_date):
+        '''
+        Saves quotes of a symbol to a new file if none were saved before (last_date is None),
+        otherwise appends them to the existing file as another QuoteStore segment (or JSON document in raw mode),
+        leaving the existing ones untouched.
+        New files are replaced atomically. An interrupted append leaves a file that get_last_date cannot parse,
+        which is then downloaded again in full.
+        '''
+        file_name = self.get_file_name_by_symbol(symbol)
+        first_date = EodQuoteBatch.to_date(int(batch.dates.min())).strftime("%Y-%m-%d") if len(batch) > 0 else None
+        last_batch_date = EodQuoteBatch.to_date(int(batch.dates.max())).strftime("%Y-%m-%d") if len(batch) > 0 else None
+        if last_date == None:
+            if self.raw:
+                with AtomicFileWriter(file_name, self.compress) as binary_file:
+                    binary_file.write(json.dumps({ symbol: batch.to_ctx_json() }).encode("utf-8"))
+            else:
+                QuoteStore.write(file_name, QuoteStore.from_batch(batch))
+            self.record(symbol, file_name, first_date, last_batch_date, len(batch))
+            return file_name
         
+        if len(batch) == 0:
+            QuoteFeeder.logger.info("No new quotes for %s after %s" % (symbol, last_date))
+            return file_name
+        if self.raw:
+            append_text(file_name, "\n" + json.dumps({ symbol: batch.to_ctx_json() }))
+        else:
+            QuoteStore.append(file_name, QuoteStore.from_batch(batch))
+        entry = self.manifest.get(symbol)
+        if entry != None and entry.rows != None:
+            self.record(symbol, file_name, entry.first_date, last_batch_date, entry.rows + len(batch))
+        else:
+            self.record(symbol, file_name, None, last_batch_date, None)
+        QuoteFeeder.logger.info("Appended %d quote(s) for %s after %s" % (len(batch), symbol, last_date))
+        return file_name
+
+    def download_quotes(self, symbol, skip_existing):
         file_name = self.get_file_name_by_symbol(symbol)
         
-        if skip_existing and os.path.exists(file_name):
+        if skip_existing and self.is_fetched(symbol):
             QuoteFeeder.logger.info("Quotes for %s already exists in %s" % (symbol, file_name))
             return file_name
         
-        try:
-            text_file = open(file_name, "w")
-            text_file.write(response_body)
+        end_date = time.strftime("%Y-%m-%d")
+        last_date = self.get_saved_last_date(symbol)
+        start_date = self.get_start_date(last_date)
+        if start_date > end_date:
+            QuoteFeeder.logger.info("Quotes for %s are up to date as of %s" % (symbol, last_date))
             return file_name
-        finally:
-            if text_file != None:
-                text_file.close()
+        
+        return self._fetch_batches([symbol], start_date, end_date, { symbol: last_date })[0].file_name
+
+    def _fetch_batches(self, symbols, start_date, end_date, last_dates):
+        results = []
+        for batch_result in self.batcher.fetch(symbols, start_date, end_date):
+            for symbol in batch_result.symbols:
+                if batch_result.error != None:
+                    results.append(QuoteFeeder.FetchResult(symbol, None, batch_result.error))
+                elif symbol not in batch_result.batches:
+                    if last_dates[symbol] == None:
+                        QuoteFeeder.logger.warning("No quotes returned for %s" % symbol)
+                        results.append(QuoteFeeder.FetchResult(symbol, None, None))
+                    else:
+                        results.append(QuoteFeeder.FetchResult(symbol, self.get_file_name_by_symbol(symbol), None))
+                else:
+                    try:
+                        file_name = self.save_quotes(symbol, batch_result.batches[symbol], last_dates[symbol])
+                        results.append(QuoteFeeder.FetchResult(symbol, file_name, None))
+                    except Exception as e:
+                        QuoteFeeder.logger.error("Failed to save quotes for %s: %s" % (symbol, e))
+                        results.append(QuoteFeeder.FetchResult(symbol, None, e))
+        return results
 
-    def fetch_all(self):        
-        for ctx_stock in Symbols.fetch_all_ctx_stocks():
-            self.fetch(ctx_stock.symbol, skip_existing = True)
+    def fetch_symbols(self, symbols, workers = 1, skip_existing = True):
+        '''
+        Groups the symbols by the date their download starts from, and fetches each group in multi-symbol batches.
+        Each group is split across the workers.
+        '''
+        end_date = time.strftime("%Y-%m-%d")
+        results = []
+        last_dates = {}
+        groups = collections.OrderedDict()
+        for symbol in symbols:
+            file_name = self.get_file_name_by_symbol(symbol)
+            if skip_existing and self.is_fetched(symbol):
+                results.append(QuoteFeeder.FetchResult(symbol, file_name, None))
+                continue
+            last_dates[symbol] = self.get_saved_last_date(symbol)
+            start_date = self.get_start_date(last_dates[symbol])
+            if start_date > end_date:
+                results.append(QuoteFeeder.FetchResult(symbol, file_name, None))
+                continue
+            groups.setdefault(start_date, []).append(symbol)
+        
+        shards = [(start_date, group[x::workers]) for start_date, group in groups.items() for x in range(min(workers, len(group)))]
+        results.extend(self._run_all(shards, lambda shard: self._fetch_batches(shard[1], shard[0], end_date, last_dates), workers))
+        order = dict((symbol, index) for index, symbol in enumerate(symbols))
+        results.sort(key = lambda result: order.get(result.symbol, len(order)))
+        return results
+
+    def fetch_all(self, workers = 1):
+        '''
+        Downloads quotes of all symbols, appending only the quotes after the last date already saved for each symbol
+        '''
+        symbols = [ctx_stock.symbol for ctx_stock in Symbols.fetch_all_ctx_stocks()]
+        return self.fetch_symbols(symbols, workers, skip_existing = False)
 
 
 class YahooQuoteFeederTests(unittest.TestCase):
@@ -158,6 +366,37 @@ class CtxQuoteFeederTests(unittest.TestCase):
         assert os.path.exists(file_name)
         os.remove(file_name)
 
+    def test_fetch_symbols(self):
+        symbols = ["sh600399", "sh600375", "sz000807"]
+        fetcher = CtxQuoteFeeder(tempfile.gettempdir() + os.path.sep + "eod_quotes")
+        results = fetcher.fetch_symbols(symbols, workers = 3, skip_existing = False)
+        assert [result.symbol for result in results] == symbols
+        for result in results:
+            assert result.error == None
+            assert os.path.exists(result.file_name)
+            os.remove(result.file_name)
+
+    def test_fetch_incremental(self):
+        symbol = "sh600399"
+        fetcher = CtxQuoteFeeder(tempfile.gettempdir() + os.path.sep + "eod_quotes")
+        file_name = fetcher.fetch(symbol, skip_existing = False)
+        last_date = fetcher.get_last_date(file_name)
+        size = os.path.getsize(file_name)
+        assert last_date != None
+        fetcher.fetch(symbol, skip_existing = False)
+        assert fetcher.get_last_date(file_name) >= last_date
+        assert os.path.getsize(file_name) >= size
+        os.remove(file_name)
+
+    def test_get_last_date_of_corrupt_file(self):
+        fetcher = CtxQuoteFeeder(tempfile.gettempdir() + os.path.sep + "eod_quotes")
+        file_name = fetcher.get_file_name_by_symbol("corrupt")
+        with open(file_name, "w") as text_file:
+            text_file.write('{"corrupt": {"dates": ["2015-05-2')
+        assert fetcher.get_last_date(file_name) == None
+        assert fetcher.get_last_date(fetcher.get_file_name_by_symbol("missing")) == None
+        os.remove(file_name)
+
     @unittest.skip
     def test_fetch_all(self):
         fetcher = CtxQuoteFeeder(tempfile.gettempdir() + os.path.sep + "eod_quotes")
@@ -0,0 +1,140 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+from common.logging import Logger
+from common.files import AtomicFileWriter
+from quotes.eod_quote import EodQuoteBatch
+
+class QuoteFingerprintIndex(object):
+    '''
+    Local index of a 64-bit fingerprint of each quote written to eod_quotes, by symbol and date, so that only new or changed quotes are written again.
+    The fingerprints of a symbol are kept in a .npy file of (date, fingerprint) sorted by date in the index folder,
+    and are read when the symbol is written rather than kept in memory. A symbol must not be written by two threads at a time.
+    The index only reflects what this machine wrote, and can be rebuilt from Cassandra, e.g. after the table was changed by other means.
+    '''
+    logger = Logger.get_logger(__name__)
+    default_folder = os.path.join(os.path.expanduser("~"), ".stocks", "fingerprints")
+    dtype = np.dtype([("dates", "<i4"), ("fingerprints", "<u8")])
+    fingerprint_columns = ["opens", "highs", "lows", "closes", "volumes", "amounts", "adj_closes"]
+    offset_basis = np.uint64(14695981039346656037)
+    prime = np.uint64(1099511628211)
+    nan_bits = np.array([np.nan], dtype = "<f8").view("<u8")[0]
+    select_cql = "select date, open, high, low, close, volume, amount, adj_close from eod_quotes where symbol = ?"
+
+    def __init__(self, folder = None):
+        self.folder = folder if folder != None else QuoteFingerprintIndex.default_folder
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    @staticmethod
+    def get_fingerprints(batch):
+        '''
+        Returns the FNV-1a style fingerprint of the values of each quote of a batch, with all NaN adjusted closes treated as equal
+        '''
+        fingerprints = np.full(len(batch), QuoteFingerprintIndex.offset_basis, dtype = "<u8")
+        for name in QuoteFingerprintIndex.fingerprint_columns:
+            values = np.ascontiguousarray(getattr(batch, name))
+            bits = values.view("<u8")
+            if values.dtype.kind == "f":
+                bits = np.where(np.isnan(values), QuoteFingerprintIndex.nan_bits, bits)
+            fingerprints = (fingerprints ^ bits) * QuoteFingerprintIndex.prime
+        return fingerprints
+
+    def get_file_name(self, symbol):
+        return os.path.join(self.folder, symbol + ".npy")
+
+    def get(self, symbol):
+        '''
+        Returns the structured array of (date, fingerprint) of a symbol, sorted by date
+        '''
+        file_name = self.get_file_name(symbol)
+        entry = np.empty(0, dtype = QuoteFingerprintIndex.dtype)
+        if os.path.exists(file_name):
+            try:
+                entry = np.load(file_name)
+            except (ValueError, OSError) as e:
+                QuoteFingerprintIndex.logger.warning("Ignoring corrupt fingerprints %s: %s" % (file_name, e))
+        return entry
+
+    def select_changed(self, batch):
+        '''
+        Returns the quotes of a batch which are not in the index with the same values
+        '''
+        entry = self.get(batch.symbol)
+        if len(entry) == 0 or len(batch) == 0:
+            return batch
+        positions = np.minimum(np.searchsorted(entry["dates"], batch.dates), len(entry) - 1)
+        unchanged = (entry["dates"][positions] == batch.dates) & (entry["fingerprints"][positions] == QuoteFingerprintIndex.get_fingerprints(batch))
+        if not unchanged.any():
+            return batch
+        return batch[~unchanged]
+
+    def update(self, batch, replace = False):
+        '''
+        Records the quotes of a batch as written, replacing all quotes of the symbol if replace is True, and saves the symbol's file
+        '''
+        updates = np.empty(len(batch), dtype = QuoteFingerprintIndex.dtype)
+        updates["dates"] = batch.dates
+        updates["fingerprints"] = QuoteFingerprintIndex.get_fingerprints(batch)
+        if not replace:
+            entry = self.get(batch.symbol)
+            updates = np.concatenate([updates, entry[~np.isin(entry["dates"], updates["dates"])]])
+        updates = updates[np.argsort(updates["dates"], kind = "mergesort")]
+
+        content = io.BytesIO()
+        np.save(content, updates)
+        with AtomicFileWriter(self.get_file_name(batch.symbol)) as binary_file:
+            binary_file.write(content.getvalue())
+
+    def rebuild(self, session, symbols):
+        '''
+        Replaces the fingerprints of the symbols with the ones of the quotes stored in Cassandra
+        '''
+        statement = session.prepare(QuoteFingerprintIndex.select_cql)
+        for symbol in symbols:
+            rows = list(session.execute(statement, (symbol,)))
+            dates = [row.date.date() if hasattr(row.date, "date") else row.date for row in rows]
+            batch = EodQuoteBatch(symbol, np.array([date.toordinal() - EodQuoteBatch.epoch_ordinal for date in dates], dtype = "<i4"),
+                                  [row.open for row in rows], [row.high for row in rows], [row.low for row in rows], [row.close for row in rows],
+                                  [row.volume for row in rows], amounts = [row.amount if row.amount != None else np.nan for row in rows],
+                                  adj_closes = [row.adj_close if row.adj_close != None else np.nan for row in rows])
+            self.update(batch, replace = True)
+            QuoteFingerprintIndex.logger.debug("Rebuilt fingerprints of %d quote(s) for %s" % (len(batch), symbol))
+
+
+class QuoteFingerprintIndexTests(unittest.TestCase):
+
+    arrays = {
+        "dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00", "2015-05-25T00:00:00"],
+        "opens": [8.1, 8.2, 8.4], "highs": [8.5, 8.6, 8.9], "lows": [8.0, 8.1, 8.3], "closes": [8.3, 8.4, 8.8], "volumes": [1000, 2000, 3000], "amounts": [8300.0, 16800.0, 26400.0]
+        }
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for file_name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file_name))
+        os.rmdir(self.folder)
+
+    def test_select_changed(self):
+        batch = EodQuoteBatch.from_ctx_json("sh600399", QuoteFingerprintIndexTests.arrays)
+        index = QuoteFingerprintIndex(self.folder)
+        assert len(index.select_changed(batch)) == 3
+        index.update(batch[:2])
+
+        index = QuoteFingerprintIndex(self.folder)
+        assert list(index.select_changed(batch).dates) == [batch.dates[2]]
+        batch.closes[1] = 8.45
+        assert list(index.select_changed(batch).dates) == list(batch.dates[1:])
+        index.update(batch)
+        assert len(index.select_changed(batch)) == 0
+        assert len(index.get("sh600399")) == 3
@@ -0,0 +1,142 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import json
+import threading
+import collections
+import tempfile
+import unittest
+from common.logging import Logger
+from common.files import AtomicFileWriter
+
+class LoadJournal(object):
+    '''
+    Records the quote files whose quotes were all written to Cassandra, so that an interrupted bulk load can be resumed.
+    Each file is recorded with its size and modification time when it was loaded, and is done as long as both are unchanged.
+    Records are appended as JSON lines and flushed to disk one by one, so a crash loses at most the record being written,
+    which is then ignored.
+    '''
+    logger = Logger.get_logger(__name__)
+    file_name = ".load_journal"
+    Record = collections.namedtuple("Record", ["file_name", "size", "mtime", "rows"])
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self._records = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def get_default_file(folder):
+        return os.path.join(folder, LoadJournal.file_name)
+
+    @staticmethod
+    def describe(file_name, rows = None):
+        stat = os.stat(file_name)
+        return LoadJournal.Record(os.path.realpath(file_name), stat.st_size, stat.st_mtime, rows)
+
+    def load(self):
+        if not os.path.exists(self.journal_file):
+            return
+        lines = 0
+        line = "\n"
+        with open(self.journal_file, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    record = LoadJournal.Record(*json.loads(line))
+                except (ValueError, TypeError):
+                    LoadJournal.logger.warning("Ignoring corrupt record in load journal %s" % self.journal_file)
+                    continue
+                self._records[record.file_name] = record
+                lines = lines + 1
+        if not line.endswith("\n"):
+            with open(self.journal_file, "a") as journal_file:
+                journal_file.write("\n")
+        if lines > 2 * len(self._records):
+            self.compact()
+
+    def compact(self):
+        '''
+        Rewrites the journal with only the latest record of each file
+        '''
+        with self._lock:
+            content = "".join(json.dumps(list(record)) + "\n" for record in self._records.values())
+            with AtomicFileWriter(self.journal_file) as binary_file:
+                binary_file.write(content.encode("utf-8"))
+
+    def record(self, record):
+        '''
+        Appends the record of a file whose quotes were all written. record should be described before the file was read.
+        '''
+        with self._lock:
+            self._records[record.file_name] = record
+            with open(self.journal_file, "a") as journal_file:
+                journal_file.write(json.dumps(list(record)) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def get(self, file_name):
+        with self._lock:
+            return self._records.get(os.path.realpath(file_name))
+
+    def is_done(self, file_name):
+        '''
+        Whether a file was loaded and has not changed since
+        '''
+        record = self.get(file_name)
+        if record == None or not os.path.exists(file_name):
+            return False
+        stat = os.stat(file_name)
+        return stat.st_size == record.size and stat.st_mtime == record.mtime
+
+    def clear(self):
+        with self._lock:
+            self._records = {}
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+
+
+class LoadJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, "sh600399")
+        with open(self.file_name, "w") as text_file:
+            text_file.write("quotes")
+        self.journal_file = LoadJournal.get_default_file(self.folder)
+
+    def tearDown(self):
+        for file_name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file_name))
+        os.rmdir(self.folder)
+
+    def test_record_and_reload(self):
+        journal = LoadJournal(self.journal_file)
+        assert not journal.is_done(self.file_name)
+        journal.record(LoadJournal.describe(self.file_name, 2))
+        with open(self.journal_file, "a") as journal_file:
+            journal_file.write('["/interrupted", 1')
+        journal = LoadJournal(self.journal_file)
+        assert journal.is_done(self.file_name)
+        assert journal.get(self.file_name).rows == 2
+        journal.record(LoadJournal.describe(self.file_name, 3))
+        assert LoadJournal(self.journal_file).get(self.file_name).rows == 3
+
+        with open(self.file_name, "a") as text_file:
+            text_file.write(" and more")
+        assert not journal.is_done(self.file_name)
+
+    def test_compact_and_clear(self):
+        journal = LoadJournal(self.journal_file)
+        for rows in range(5):
+            journal.record(LoadJournal.describe(self.file_name, rows))
+        journal = LoadJournal(self.journal_file)
+        with open(self.journal_file, "r") as journal_file:
+            assert len(journal_file.readlines()) == 1
+        assert journal.get(self.file_name).rows == 4
+        journal.clear()
+        assert not LoadJournal(self.journal_file).is_done(self.file_name)
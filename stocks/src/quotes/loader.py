@@ -5,56 +5,350 @@ Created on 23 May 2015
 '''
 
 import os
+import json
+import threading
+import tempfile
 import unittest
-from quotes.eod_quote import CtxEodQuote, YahooEodQuote
+import numpy as np
+from datetime import date as date_type
+from quotes.eod_quote import CtxEodQuote, YahooEodQuote, EodQuoteBatch
 from cassandra.cluster import Cluster
+from cassandra.query import UNSET_VALUE, BatchStatement, BatchType
 from common.logging import Logger
+from common.cassandra import CassandraAsyncWriter
+from common.files import open_text
+from quotes.store import QuoteStore
+from quotes.fingerprints import QuoteFingerprintIndex
+from quotes.watermarks import QuoteWatermarks
 
 class QuoteLoader(object):
 
     host = "server.jingyusoft.com"
     keyspace = "stocks"
     logger = Logger.get_logger(__name__)
+    insert_eod_quote_cql = "insert into eod_quotes (symbol, date, open, high, low, close, volume, amount, adj_close) values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def __init__(self, max_in_flight = 128, max_retries = 3, batch_rows = None, fingerprints = None, watermarks = None):
+        '''
+        Quotes are written asynchronously with up to max_in_flight writes outstanding, each retried up to max_retries times.
+        If batch_rows is set, quotes are grouped by partition and sent as UNLOGGED batches of up to batch_rows quotes,
+        so that each request goes to the replicas of a single partition.
+        If a QuoteFingerprintIndex is given, quotes of an EodQuoteBatch already written with the same values are skipped.
+        If QuoteWatermarks are given, the watermark of a symbol is advanced once all quotes of an EodQuoteBatch are written.
+        '''
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.batch_rows = batch_rows
+        self.fingerprints = fingerprints
+        self.watermarks = watermarks
+        self.cluster = None
+        self.session = None
+        self.insert_statement = None
+        self._local = threading.local()
+        self._writers = []
+        self._lock = threading.Lock()
 
     def connect(self):
         self.cluster = Cluster(contact_points = [QuoteLoader.host])
         self.session = self.cluster.connect(QuoteLoader.keyspace)
+        self.insert_statement = None
     
     def disconnect(self):
+        with self._lock:
+            writers = self._writers
+            self._writers = []
+            self._local = threading.local()
+        for writer in writers:
+            writer.flush()
+        if len(writers) > 0:
+            stats = self.get_writer_stats(writers)
+            QuoteLoader.logger.info("%d quote(s) written in %d request(s) by %d writer(s), %d retries, %d quote(s) failed" \
+                                    % (stats["written"], stats["requests"], len(writers), stats["retries"], stats["failed"]))
+        if self.watermarks != None:
+            self.watermarks.save()
         if self.cluster != None:
             self.cluster.shutdown()
 
+    def get_insert_statement(self):
+        '''
+        Returns the insert statement prepared on the current session, preparing it on first use
+        '''
+        if self.insert_statement == None:
+            self.insert_statement = self.session.prepare(QuoteLoader.insert_eod_quote_cql)
+        return self.insert_statement
+
+    @staticmethod
+    def get_insert_parameters(eod_quote):
+        '''
+        Returns the values bound to the insert statement for a quote, which may be an EodQuote or an EodQuoteBatch.Row.
+        Prices are bound as doubles without rounding. A missing amount or adjusted close is left unset rather than written as null.
+        '''
+        amount = getattr(eod_quote, "amount", None)
+        adj_close = getattr(eod_quote, "adj_close", None)
+        return (eod_quote.symbol, eod_quote.date, float(eod_quote.open), float(eod_quote.high), float(eod_quote.low), float(eod_quote.close), int(eod_quote.volume),
+                float(amount) if amount != None and amount == amount else UNSET_VALUE, float(adj_close) if adj_close != None and adj_close == adj_close else UNSET_VALUE)
+
     def insert_eod_quote(self, eod_quote):
-        cql = "insert into eod_quotes (symbol, date, open, high, low, close, volume) values ('%s', '%s', %.2f, %.2f, %.2f, %.2f, %d)" \
-            % (eod_quote.symbol, eod_quote.date.strftime("%Y-%m-%d"), eod_quote.open, eod_quote.high, eod_quote.low, eod_quote.close, eod_quote.volume)
-        self.session.execute(cql)
+        self.session.execute(self.get_insert_statement(), QuoteLoader.get_insert_parameters(eod_quote))
+
+    def get_writer(self):
+        '''
+        Returns the asynchronous writer of the current thread, so that threads sharing the session wait only for their own writes
+        '''
+        writer = getattr(self._local, "writer", None)
+        if writer == None:
+            writer = CassandraAsyncWriter(self.session, self.max_in_flight, self.max_retries)
+            self._local.writer = writer
+            with self._lock:
+                self._writers.append(writer)
+        return writer
+
+    def get_writer_stats(self, writers = None):
+        '''
+        Returns the sum of the stats of the writers of all threads
+        '''
+        if writers == None:
+            with self._lock:
+                writers = list(self._writers)
+        stats = { "requests": 0, "written": 0, "retries": 0, "failed": 0 }
+        for writer in writers:
+            writer_stats = writer.get_stats()
+            for counter in stats:
+                stats[counter] = stats[counter] + writer_stats[counter]
+        return stats
+
+    @staticmethod
+    def get_partition_key(eod_quote):
+        return eod_quote.symbol
+
+    @staticmethod
+    def create_batch():
+        return BatchStatement(batch_type = BatchType.UNLOGGED)
+
+    def insert_eod_quotes(self, eod_quotes, writer = None):
+        '''
+        Inserts an EodQuoteBatch, or any iterable of EodQuote, through the asynchronous writer, one quote per request
+        or in batches of one partition if batch_rows is set.
+        Returns once every insert is acknowledged or has failed, with the number of quotes inserted or skipped as unchanged.
+        Failed quotes are logged.
+
+        Parameters
+        ----------
+        writer : CassandraAsyncWriter, default None
+            The writer to send the inserts with, which must not be shared with other threads. Defaults to the writer of the current thread.
+        '''
+        writer = writer if writer != None else self.get_writer()
+        statement = self.get_insert_statement()
+        failed = writer.get_stats()["failed"]
+        count = 0
+        unchanged = 0
+        last_date = None
+        if self.watermarks != None and isinstance(eod_quotes, EodQuoteBatch) and len(eod_quotes) > 0:
+            last_date = EodQuoteBatch.to_date(int(eod_quotes.dates.max())).strftime("%Y-%m-%d")
+        fingerprinted = self.fingerprints != None and isinstance(eod_quotes, EodQuoteBatch)
+        if fingerprinted:
+            changed = self.fingerprints.select_changed(eod_quotes)
+            unchanged = len(eod_quotes) - len(changed)
+            eod_quotes = changed
+        if self.batch_rows == None:
+            for eod_quote in eod_quotes:
+                writer.write(statement, QuoteLoader.get_insert_parameters(eod_quote))
+                count = count + 1
+        else:
+            groups = {}
+            for eod_quote in eod_quotes:
+                key = self.get_partition_key(eod_quote)
+                group = groups.get(key)
+                if group == None:
+                    group = groups[key] = []
+                group.append(QuoteLoader.get_insert_parameters(eod_quote))
+                if len(group) >= self.batch_rows:
+                    self.write_batch(writer, statement, groups.pop(key))
+                count = count + 1
+            for group in groups.values():
+                self.write_batch(writer, statement, group)
+        failed = writer.flush()["failed"] - failed
+        if failed > 0:
+            QuoteLoader.logger.error("Failed to insert %d of %d quote(s)" % (failed, count))
+        else:
+            if fingerprinted and count > 0:
+                self.fingerprints.update(eod_quotes)
+            if last_date != None:
+                self.watermarks.advance(eod_quotes.symbol, last_date)
+        if unchanged > 0:
+            QuoteLoader.logger.debug("Skipped %d unchanged quote(s) of %s" % (unchanged, eod_quotes.symbol))
+        return count - failed + unchanged
+
+    def write_batch(self, writer, statement, rows):
+        if len(rows) == 1:
+            writer.write(statement, rows[0])
+            return
+        batch = self.create_batch()
+        for parameters in rows:
+            batch.add(statement, parameters)
+        writer.write(batch, rows = len(rows))
+
+    @staticmethod
+    def load_columns(file_name):
+        '''
+        Reads the quotes saved by a feeder in the binary columnar format as memory-mapped numpy arrays
+        '''
+        return QuoteStore.read(file_name)
+
+    @staticmethod
+    def get_symbol(file_name):
+        return file_name[file_name.rfind(os.path.sep) + 1:]
 
 
 class YahooQuoteLoader(QuoteLoader):
     
+    @staticmethod
+    def load_batch(file_name):
+        '''
+        Yahoo quotes have no amount, so the amounts of the batch are NaN and are not written
+        '''
+        symbol = QuoteLoader.get_symbol(file_name)
+        if QuoteStore.is_store_file(file_name):
+            batch = EodQuoteBatch.from_columns(symbol, QuoteStore.read(file_name))
+            batch.amounts = np.full(len(batch), np.nan)
+            return batch
+        with open_text(file_name) as quote_file:
+            return YahooEodQuote.parse_csv(symbol, quote_file.read())
+
     @staticmethod
     def load_from_file(file_name):
-        quote_file = open(file_name, "r")
-        symbol = file_name[file_name.rfind(os.path.sep) + 1:]
-        eod_quotes = []
-        for line in quote_file:
-            if not line.startswith("Date"):
-                quote = YahooEodQuote.from_line(symbol, line)
-                eod_quotes.append(quote)
-        return eod_quotes
+        batch = YahooQuoteLoader.load_batch(file_name)
+        to_date = EodQuoteBatch.to_date
+        return [YahooEodQuote(batch.symbol, to_date(date), open_, high, low, close, volume, adj_close) \
+                for date, open_, high, low, close, volume, adj_close in zip(batch.dates.tolist(), batch.opens.tolist(), batch.highs.tolist(),
+                                                                            batch.lows.tolist(), batch.closes.tolist(), batch.volumes.tolist(), batch.adj_closes.tolist())]
 
 
 class CtxQuoteLoader(QuoteLoader):
 
+    @staticmethod
+    def load_batch(file_name):
+        symbol = QuoteLoader.get_symbol(file_name)
+        if QuoteStore.is_store_file(file_name):
+            return EodQuoteBatch.from_columns(symbol, QuoteStore.read(file_name))
+        
+        with open_text(file_name) as quote_file:
+            batches = list(EodQuoteBatch.iter_ctx_json(iter(lambda: quote_file.read(64 * 1024), "")))
+        if len(batches) == 0:
+            return EodQuoteBatch(symbol, [], [], [], [], [], [])
+        return EodQuoteBatch.concatenate(batches)
+
     @staticmethod
     def load_from_file(file_name):
-        with open(file_name, "r") as quote_file:
-            file_content = quote_file.read().replace(os.linesep, "")
-            return CtxEodQuote.from_json(file_content)
+        batch = CtxQuoteLoader.load_batch(file_name)
+        to_date = EodQuoteBatch.to_date
+        return [CtxEodQuote(batch.symbol, to_date(date), open_, high, low, close, volume, amount) \
+                for date, open_, high, low, close, volume, amount in zip(batch.dates.tolist(), batch.opens.tolist(), batch.highs.tolist(),
+                                                                         batch.lows.tolist(), batch.closes.tolist(), batch.volumes.tolist(), batch.amounts.tolist())]
 
 
 class QuoteLoaderTests(unittest.TestCase):
-    
+
+    class FakeSession(object):
+
+        def __init__(self):
+            self.prepared = []
+            self.executed = []
+
+        def prepare(self, cql):
+            self.prepared.append(cql)
+            return cql
+
+        def execute(self, statement, parameters = None):
+            self.executed.append((statement, parameters))
+
+        def execute_async(self, statement, parameters = None):
+            self.execute(statement, parameters)
+            return self
+
+        def add_callbacks(self, callback, errback, callback_args = (), errback_args = ()):
+            callback(None, *callback_args)
+
+    class FakeBatch(list):
+
+        def add(self, statement, parameters):
+            self.append(parameters)
+
+    class FakeBatchLoader(QuoteLoader):
+
+        @staticmethod
+        def create_batch():
+            return QuoteLoaderTests.FakeBatch()
+
+    def test_insert_in_partition_batches(self):
+        quote_loader = QuoteLoaderTests.FakeBatchLoader(batch_rows = 2)
+        quote_loader.session = QuoteLoaderTests.FakeSession()
+        eod_quotes = [CtxEodQuote(symbol, "2015-05-%02dT00:00:00" % day, 8.1, 8.5, 8.0, 8.3, 1000, 8300.0) for symbol in ["sh600399", "sz000807"] for day in [21, 22, 25]]
+        eod_quotes = eod_quotes[::2] + eod_quotes[1::2]
+        assert quote_loader.insert_eod_quotes(eod_quotes) == 6
+        batches = [statement for statement, _ in quote_loader.session.executed]
+        assert len(batches) == 4
+        for batch in batches:
+            if isinstance(batch, QuoteLoaderTests.FakeBatch):
+                assert len(batch) == 2
+                assert len(set(parameters[0] for parameters in batch)) == 1
+        assert quote_loader.get_writer().get_stats()["written"] == 6
+
+    def test_skip_unchanged_quotes(self):
+        folder = tempfile.mkdtemp()
+        try:
+            quote_loader = QuoteLoader(fingerprints = QuoteFingerprintIndex(folder))
+            quote_loader.session = QuoteLoaderTests.FakeSession()
+            arrays = { "dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00"], "opens": [8.1, 8.2], "highs": [8.5, 8.6], "lows": [8.0, 8.1],
+                       "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0] }
+            assert quote_loader.insert_eod_quotes(EodQuoteBatch.from_ctx_json("sh600399", arrays)) == 2
+            arrays["closes"][1] = 8.45
+            assert quote_loader.insert_eod_quotes(EodQuoteBatch.from_ctx_json("sh600399", arrays)) == 2
+            assert [parameters[5] for _, parameters in quote_loader.session.executed] == [8.3, 8.4, 8.45]
+        finally:
+            for file_name in os.listdir(folder):
+                os.remove(os.path.join(folder, file_name))
+            os.rmdir(folder)
+
+    def test_advance_watermark(self):
+        folder = tempfile.mkdtemp()
+        try:
+            watermarks = QuoteWatermarks(os.path.join(folder, "watermarks.json"))
+            quote_loader = QuoteLoader(watermarks = watermarks)
+            quote_loader.session = QuoteLoaderTests.FakeSession()
+            arrays = { "dates": ["2015-05-22T00:00:00", "2015-05-21T00:00:00"], "opens": [8.1, 8.2], "highs": [8.5, 8.6], "lows": [8.0, 8.1],
+                       "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0] }
+            quote_loader.insert_eod_quotes(EodQuoteBatch.from_ctx_json("sh600399", arrays))
+            assert watermarks.get("sh600399") == "2015-05-22"
+        finally:
+            for file_name in os.listdir(folder):
+                os.remove(os.path.join(folder, file_name))
+            os.rmdir(folder)
+
+    def test_insert_with_prepared_statement(self):
+        quote_loader = QuoteLoader()
+        quote_loader.session = QuoteLoaderTests.FakeSession()
+        eod_quotes = [CtxEodQuote("sh600399", "2015-05-21T00:00:00", 8.125, 8.5, 8.0, 8.3333, 1000, 8300.5),
+                      YahooEodQuote("600399.SS", "2015-05-22", 8.2, 8.6, 8.1, 8.4, 2000, 8.4)]
+        assert quote_loader.insert_eod_quotes(eod_quotes) == 2
+        assert quote_loader.session.prepared == [QuoteLoader.insert_eod_quote_cql]
+        statement, parameters = quote_loader.session.executed[0]
+        assert statement == QuoteLoader.insert_eod_quote_cql
+        assert parameters[1] == date_type(2015, 5, 21)
+        assert parameters[2:8] == (8.125, 8.5, 8.0, 8.3333, 1000, 8300.5)
+        assert parameters[8] is UNSET_VALUE
+        assert quote_loader.session.executed[1][1][7] is UNSET_VALUE
+        assert quote_loader.session.executed[1][1][8] == 8.4
+
+    def test_insert_yahoo_batch_without_amount(self):
+        quote_loader = QuoteLoader()
+        quote_loader.session = QuoteLoaderTests.FakeSession()
+        batch = YahooEodQuote.parse_csv("600399.SS", "Date,Open,High,Low,Close,Volume,Adj Close\n2015-05-22,8.2,8.6,8.1,8.4,2000,8.4\n")
+        assert quote_loader.insert_eod_quotes(batch) == 1
+        parameters = quote_loader.session.executed[0][1]
+        assert parameters[7] is UNSET_VALUE
+        assert parameters[8] == 8.4
+
     def test_connect(self):
         quote_loader = QuoteLoader()
         
@@ -89,6 +383,24 @@ class YahooQuoteLoaderTests(unittest.TestCase):
 
 class CtxQuoteLoaderTests(unittest.TestCase):
 
+    def test_load_batch(self):
+        folder = tempfile.mkdtemp()
+        file_name = os.path.join(folder, "sh600399")
+        try:
+            arrays = { "dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00"], "opens": [8.1, 8.2], "highs": [8.5, 8.6], "lows": [8.0, 8.1],
+                       "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0] }
+            with open(file_name, "w") as text_file:
+                text_file.write(json.dumps({ "sh600399": arrays }))
+            raw_batch = CtxQuoteLoader.load_batch(file_name)
+            QuoteStore.write(file_name, QuoteStore.from_ctx_json(arrays))
+            store_batch = CtxQuoteLoader.load_batch(file_name)
+            assert store_batch.symbol == "sh600399"
+            assert list(store_batch) == list(raw_batch)
+            assert [quote.close for quote in CtxQuoteLoader.load_from_file(file_name)] == [8.3, 8.4]
+        finally:
+            os.remove(file_name)
+            os.rmdir(folder)
+
     @unittest.skip    
     def test_load_from(self):
         file_name = "H:\\Temp\\eod_quotes\\ctx\\sh600375"
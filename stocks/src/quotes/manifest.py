@@ -0,0 +1,185 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import json
+import time
+import zlib
+import threading
+import collections
+import tempfile
+import unittest
+from common.logging import Logger
+from common.files import AtomicFileWriter
+from quotes.store import QuoteStore
+
+class QuoteManifest(object):
+    '''
+    Index of the quote files in a feeder folder, kept in manifest.json next to them.
+    Each entry records what a file holds, so that work can be planned without opening the files.
+    '''
+    logger = Logger.get_logger(__name__)
+    file_name = "manifest.json"
+    Entry = collections.namedtuple("Entry", ["symbol", "first_date", "last_date", "rows", "size", "checksum", "source", "fetched"])
+
+    def __init__(self, folder, save_interval = 5.0):
+        self.folder = folder
+        self.manifest_file = os.path.join(folder, QuoteManifest.file_name)
+        self.save_interval = save_interval
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._saved = 0
+        self.load()
+
+    @staticmethod
+    def is_quote_file(file_name):
+        '''
+        Whether a file name in a feeder folder is a symbol's quote file, rather than the manifest or a temporary file
+        '''
+        base_name = os.path.basename(file_name)
+        return base_name != QuoteManifest.file_name and not base_name.startswith(".")
+
+    @staticmethod
+    def get_checksum(file_name, chunk_size = 1024 * 1024):
+        checksum = 0
+        with open(file_name, "rb") as binary_file:
+            while True:
+                chunk = binary_file.read(chunk_size)
+                if not chunk:
+                    return checksum
+                checksum = zlib.crc32(chunk, checksum)
+
+    @staticmethod
+    def describe(symbol, file_name, source, first_date = None, last_date = None, rows = None):
+        '''
+        Creates the entry of a quote file. Dates and row count are read from QuoteStore files,
+        and must be given for raw files if they are to be recorded.
+        '''
+        if QuoteStore.is_store_file(file_name):
+            columns = QuoteStore.read(file_name)
+            rows = len(columns["dates"])
+            if rows > 0:
+                first_date = QuoteStore.from_day_number(columns["dates"][0]).strftime("%Y-%m-%d")
+                last_date = QuoteStore.from_day_number(columns["dates"].max()).strftime("%Y-%m-%d")
+        return QuoteManifest.Entry(symbol, first_date, last_date, rows, os.path.getsize(file_name), QuoteManifest.get_checksum(file_name), source, time.time())
+
+    def load(self):
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "r") as manifest_file:
+                loaded_json = json.load(manifest_file)
+            with self._lock:
+                self._entries = dict((values[0], QuoteManifest.Entry(*values)) for values in loaded_json["entries"])
+        except (ValueError, TypeError, KeyError) as e:
+            QuoteManifest.logger.warning("Ignoring corrupt manifest %s: %s" % (self.manifest_file, e))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            content = json.dumps({ "entries": sorted(list(entry) for entry in self._entries.values()) })
+            with AtomicFileWriter(self.manifest_file) as binary_file:
+                binary_file.write(content.encode("utf-8"))
+            self._dirty = False
+            self._saved = time.time()
+
+    def update(self, symbol, file_name, source, first_date = None, last_date = None, rows = None):
+        '''
+        Records the current content of a quote file, saving the manifest if it was not saved within the save interval
+        '''
+        entry = QuoteManifest.describe(symbol, file_name, source, first_date, last_date, rows)
+        with self._lock:
+            self._entries[symbol] = entry
+            self._dirty = True
+            if time.time() - self._saved >= self.save_interval:
+                self.save()
+        return entry
+
+    def remove(self, symbol):
+        with self._lock:
+            if self._entries.pop(symbol, None) != None:
+                self._dirty = True
+
+    def get(self, symbol):
+        with self._lock:
+            return self._entries.get(symbol)
+
+    def get_entries(self):
+        with self._lock:
+            return sorted(self._entries.values())
+
+    def is_valid(self, entry, verify_checksum = False):
+        '''
+        Whether the file of an entry still exists with the recorded size (and checksum, if verify_checksum is True)
+        '''
+        file_name = os.path.join(self.folder, entry.symbol)
+        if not os.path.exists(file_name) or os.path.getsize(file_name) != entry.size:
+            return False
+        return not verify_checksum or QuoteManifest.get_checksum(file_name) == entry.checksum
+
+    def get_valid(self, symbol):
+        '''
+        Returns the entry of a symbol if its file is unchanged since it was recorded, otherwise None
+        '''
+        entry = self.get(symbol)
+        if entry != None and self.is_valid(entry):
+            return entry
+        return None
+
+    def find_truncated(self, verify_checksum = False):
+        return [entry.symbol for entry in self.get_entries() if not self.is_valid(entry, verify_checksum)]
+
+    def find_stale(self, as_of_date):
+        '''
+        Returns the symbols whose last date is before as_of_date ("%Y-%m-%d") or unknown
+        '''
+        return [entry.symbol for entry in self.get_entries() if entry.last_date == None or entry.last_date < as_of_date]
+
+    def find_unrecorded(self):
+        return sorted(file_name for file_name in os.listdir(self.folder) if QuoteManifest.is_quote_file(file_name) and self.get(file_name) == None)
+
+
+class QuoteManifestTests(unittest.TestCase):
+
+    arrays = {
+        "dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00"],
+        "opens": [8.1, 8.2], "highs": [8.5, 8.6], "lows": [8.0, 8.1], "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0]
+        }
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.folder, "sh600399")
+        QuoteStore.write(self.file_name, QuoteStore.from_ctx_json(QuoteManifestTests.arrays))
+
+    def tearDown(self):
+        for file_name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file_name))
+        os.rmdir(self.folder)
+
+    def test_update_and_reload(self):
+        manifest = QuoteManifest(self.folder)
+        manifest.update("sh600399", self.file_name, "ctx")
+        manifest.save()
+        entry = QuoteManifest(self.folder).get("sh600399")
+        assert entry.first_date == "2015-05-21"
+        assert entry.last_date == "2015-05-22"
+        assert entry.rows == 2
+        assert entry.size == os.path.getsize(self.file_name)
+        assert entry.source == "ctx"
+        assert QuoteManifest(self.folder).find_unrecorded() == []
+
+    def test_find_truncated_and_stale(self):
+        manifest = QuoteManifest(self.folder)
+        manifest.update("sh600399", self.file_name, "ctx")
+        assert manifest.find_truncated() == []
+        assert manifest.find_stale("2015-05-22") == []
+        assert manifest.find_stale("2015-05-25") == ["sh600399"]
+        with open(self.file_name, "ab") as binary_file:
+            binary_file.write(b"\0")
+        assert manifest.find_truncated() == ["sh600399"]
+        assert manifest.get_valid("sh600399") == None
@@ -0,0 +1,288 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import struct
+import collections
+import tempfile
+import unittest
+from datetime import date as date_type, datetime
+import numpy as np
+from common.files import AtomicFileWriter
+from quotes.eod_quote import YahooEodQuote, EodQuoteBatch
+
+class QuoteStore(object):
+    '''
+    Binary columnar file holding the EOD quotes of one symbol.
+
+    A file is a sequence of segments, so that new quotes can be appended without rewriting the file.
+    Each segment is a 16 byte header (magic, version, column count, row count) followed by one
+    little-endian array per column, 8 byte columns first so that every column stays aligned,
+    padded to a multiple of 8 bytes. Dates are stored as int32 days since 1970-01-01,
+    which is also the representation of numpy datetime64[D].
+    Amounts are stored as float64 since version 2. Version 1 files, which stored them as rounded int64, can still be read.
+    '''
+    magic = b"EODQ"
+    version = 2
+    versions = { 1: { "amounts": np.dtype("<i8") }, 2: {} }
+    header = struct.Struct("<4sHHII")
+    columns = [
+        ("opens", np.dtype("<f8")),
+        ("highs", np.dtype("<f8")),
+        ("lows", np.dtype("<f8")),
+        ("closes", np.dtype("<f8")),
+        ("adj_closes", np.dtype("<f8")),
+        ("volumes", np.dtype("<i8")),
+        ("amounts", np.dtype("<f8")),
+        ("dates", np.dtype("<i4"))
+        ]
+    row_size = sum(dtype.itemsize for _, dtype in columns)
+    epoch = date_type(1970, 1, 1)
+
+    @staticmethod
+    def is_store_file(file_name):
+        with open(file_name, "rb") as binary_file:
+            return binary_file.read(len(QuoteStore.magic)) == QuoteStore.magic
+
+    @staticmethod
+    def to_day_numbers(dates):
+        '''
+        Converts "%Y-%m-%d" strings (anything after the first 10 characters is ignored) to day numbers
+        '''
+        return EodQuoteBatch.to_day_numbers(dates)
+
+    @staticmethod
+    def from_day_number(day_number):
+        return date_type.fromordinal(QuoteStore.epoch.toordinal() + int(day_number))
+
+    @staticmethod
+    def make_columns(dates, opens, highs, lows, closes, volumes, amounts = None, adj_closes = None):
+        '''
+        Builds the columns of a segment sorted by date. dates are day numbers.
+        Missing (None or NaN) amounts and adjusted closes are stored as NaN.
+        '''
+        rows = len(dates)
+        values = {
+            "dates": dates,
+            "opens": opens,
+            "highs": highs,
+            "lows": lows,
+            "closes": closes,
+            "volumes": volumes,
+            "amounts": np.asarray(amounts, dtype = "f8") if amounts is not None else np.full(rows, np.nan),
+            "adj_closes": adj_closes if adj_closes is not None else np.full(rows, np.nan)
+            }
+        columns = collections.OrderedDict((name, np.asarray(values[name]).astype(dtype)) for name, dtype in QuoteStore.columns)
+        order = np.argsort(columns["dates"], kind = "mergesort")
+        if np.any(order != np.arange(rows)):
+            for name in columns:
+                columns[name] = columns[name][order]
+        return columns
+
+    @staticmethod
+    def from_ctx_json(arrays):
+        return QuoteStore.make_columns(QuoteStore.to_day_numbers(arrays["dates"]), arrays["opens"], arrays["highs"], arrays["lows"], arrays["closes"],
+                                       arrays["volumes"], amounts = arrays["amounts"])
+
+    @staticmethod
+    def from_batch(batch):
+        return QuoteStore.make_columns(batch.dates, batch.opens, batch.highs, batch.lows, batch.closes, batch.volumes, amounts = batch.amounts, adj_closes = batch.adj_closes)
+
+    @staticmethod
+    def from_yahoo_csv(text):
+        return QuoteStore.from_batch(YahooEodQuote.parse_csv(None, text))
+
+    @staticmethod
+    def encode_segment(columns):
+        rows = len(columns["dates"])
+        parts = [QuoteStore.header.pack(QuoteStore.magic, QuoteStore.version, len(QuoteStore.columns), rows, 0)]
+        for name, dtype in QuoteStore.columns:
+            parts.append(np.ascontiguousarray(columns[name], dtype = dtype).tobytes())
+        size = QuoteStore.header.size + rows * QuoteStore.row_size
+        parts.append(b"\0" * (-size % 8))
+        return b"".join(parts)
+
+    @staticmethod
+    def write(file_name, columns):
+        '''
+        Writes the columns as a new file, replacing any existing file atomically
+        '''
+        with AtomicFileWriter(file_name) as binary_file:
+            binary_file.write(QuoteStore.encode_segment(columns))
+
+    @staticmethod
+    def append(file_name, columns):
+        '''
+        Appends the columns as a new segment. A segment cut short by a crash is detected as corrupt when the file is read.
+        '''
+        with open(file_name, "ab") as binary_file:
+            binary_file.write(QuoteStore.encode_segment(columns))
+            binary_file.flush()
+            os.fsync(binary_file.fileno())
+
+    @staticmethod
+    def read_segments(file_name):
+        '''
+        Returns (offset of the first column, row count, version) of each segment
+
+        Raises
+        ------
+        QuoteStoreError : The file is not a quote store file or is truncated
+        '''
+        segments = []
+        file_size = os.path.getsize(file_name)
+        with open(file_name, "rb") as binary_file:
+            offset = 0
+            while offset < file_size:
+                binary_file.seek(offset)
+                header = binary_file.read(QuoteStore.header.size)
+                if len(header) < QuoteStore.header.size:
+                    raise QuoteStoreError("Truncated segment header at offset %d in %s" % (offset, file_name))
+                magic, version, column_count, rows, _ = QuoteStore.header.unpack(header)
+                if magic != QuoteStore.magic or version not in QuoteStore.versions or column_count != len(QuoteStore.columns):
+                    raise QuoteStoreError("Invalid segment header at offset %d in %s" % (offset, file_name))
+                size = QuoteStore.header.size + rows * QuoteStore.row_size
+                size = size + (-size % 8)
+                if offset + size > file_size:
+                    raise QuoteStoreError("Truncated segment at offset %d in %s" % (offset, file_name))
+                segments.append((offset + QuoteStore.header.size, rows, version))
+                offset = offset + size
+        return segments
+
+    @staticmethod
+    def read(file_name):
+        '''
+        Reads all columns of the file. The arrays are read-only views of a memory map of the file,
+        copied into one array per column only if the file has more than one segment.
+        The amounts of version 1 segments are converted to float64.
+
+        Returns
+        -------
+        columns : OrderedDict of str : numpy.ndarray
+        '''
+        segments = QuoteStore.read_segments(file_name)
+        if sum(rows for _, rows, _ in segments) == 0:
+            return collections.OrderedDict((name, np.empty(0, dtype = dtype)) for name, dtype in QuoteStore.columns)
+
+        mapped = np.memmap(file_name, dtype = "u1", mode = "r")
+        segment_columns = []
+        for offset, rows, version in segments:
+            columns = collections.OrderedDict()
+            for name, dtype in QuoteStore.columns:
+                size = rows * dtype.itemsize
+                stored_dtype = QuoteStore.versions[version].get(name, dtype)
+                columns[name] = mapped[offset:offset + size].view(stored_dtype)
+                if stored_dtype != dtype:
+                    columns[name] = columns[name].astype(dtype)
+                offset = offset + size
+            segment_columns.append(columns)
+
+        if len(segment_columns) == 1:
+            return segment_columns[0]
+        return collections.OrderedDict((name, np.concatenate([columns[name] for columns in segment_columns])) for name, _ in QuoteStore.columns)
+
+    @staticmethod
+    def get_last_date(file_name):
+        '''
+        Returns the last date in the file as "%Y-%m-%d", or None if the file holds no quotes
+        '''
+        last_date = None
+        for offset, rows, _ in QuoteStore.read_segments(file_name):
+            if rows > 0:
+                with open(file_name, "rb") as binary_file:
+                    binary_file.seek(offset + rows * (QuoteStore.row_size - 4) + (rows - 1) * 4)
+                    day_number = np.frombuffer(binary_file.read(4), dtype = "<i4")[0]
+                if last_date == None or day_number > last_date:
+                    last_date = day_number
+        if last_date == None:
+            return None
+        return QuoteStore.from_day_number(last_date).strftime("%Y-%m-%d")
+
+
+class QuoteStoreError(Exception):
+    pass
+
+
+class QuoteStoreTests(unittest.TestCase):
+
+    arrays = {
+        "dates": ["2015-05-22T00:00:00", "2015-05-21T00:00:00", "2015-05-25T00:00:00"],
+        "opens": [8.2, 8.1, 8.4],
+        "highs": [8.6, 8.5, 8.9],
+        "lows": [8.1, 8.0, 8.3],
+        "closes": [8.4, 8.3, 8.8],
+        "volumes": [2000, 1000, 3000],
+        "amounts": [16800.0, 8300.0, 26400.0]
+        }
+
+    def setUp(self):
+        self.file_name = os.path.join(tempfile.mkdtemp(), "sh600399")
+
+    def tearDown(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        os.rmdir(os.path.dirname(self.file_name))
+
+    def test_day_numbers(self):
+        day_numbers = QuoteStore.to_day_numbers(["1970-01-02", "2015-05-22T00:00:00"])
+        assert list(day_numbers) == [1, (datetime(2015, 5, 22) - datetime(1970, 1, 1)).days]
+        assert QuoteStore.from_day_number(day_numbers[1]) == date_type(2015, 5, 22)
+
+    def test_write_and_read(self):
+        QuoteStore.write(self.file_name, QuoteStore.from_ctx_json(QuoteStoreTests.arrays))
+        assert QuoteStore.is_store_file(self.file_name)
+        columns = QuoteStore.read(self.file_name)
+        assert isinstance(columns["dates"].base, np.memmap)
+        assert [QuoteStore.from_day_number(x).strftime("%Y-%m-%d") for x in columns["dates"]] == ["2015-05-21", "2015-05-22", "2015-05-25"]
+        assert list(columns["closes"]) == [8.3, 8.4, 8.8]
+        assert list(columns["amounts"]) == [8300.0, 16800.0, 26400.0]
+        assert np.isnan(columns["adj_closes"]).all()
+        assert QuoteStore.get_last_date(self.file_name) == "2015-05-25"
+
+    def test_append(self):
+        first = dict((name, values[:2]) for name, values in QuoteStoreTests.arrays.items())
+        second = dict((name, values[2:]) for name, values in QuoteStoreTests.arrays.items())
+        QuoteStore.write(self.file_name, QuoteStore.from_ctx_json(first))
+        QuoteStore.append(self.file_name, QuoteStore.from_ctx_json(second))
+        assert len(QuoteStore.read_segments(self.file_name)) == 2
+        assert list(QuoteStore.read(self.file_name)["volumes"]) == [1000, 2000, 3000]
+        assert QuoteStore.get_last_date(self.file_name) == "2015-05-25"
+
+    def test_truncated_file(self):
+        QuoteStore.write(self.file_name, QuoteStore.from_ctx_json(QuoteStoreTests.arrays))
+        with open(self.file_name, "ab") as binary_file:
+            binary_file.write(QuoteStore.encode_segment(QuoteStore.from_ctx_json(QuoteStoreTests.arrays))[:40])
+        try:
+            QuoteStore.read(self.file_name)
+            assert False
+        except QuoteStoreError:
+            pass
+
+    def test_fractional_amounts(self):
+        arrays = dict(QuoteStoreTests.arrays, amounts = [16800.25, 8300.5, None])
+        QuoteStore.write(self.file_name, QuoteStore.from_ctx_json(arrays))
+        amounts = QuoteStore.read(self.file_name)["amounts"]
+        assert list(amounts[:2]) == [8300.5, 16800.25]
+        assert np.isnan(amounts[2])
+
+    def test_read_version_1(self):
+        columns = QuoteStore.from_ctx_json(QuoteStoreTests.arrays)
+        segment = bytearray(QuoteStore.encode_segment(columns))
+        segment[4:6] = struct.pack("<H", 1)
+        amounts_offset = QuoteStore.header.size + len(columns["dates"]) * 8 * 6
+        segment[amounts_offset:amounts_offset + 24] = np.array([8300, 16800, 26400], dtype = "<i8").tobytes()
+        with open(self.file_name, "wb") as binary_file:
+            binary_file.write(bytes(segment))
+        QuoteStore.append(self.file_name, columns)
+        amounts = QuoteStore.read(self.file_name)["amounts"]
+        assert amounts.dtype == np.dtype("<f8")
+        assert list(amounts) == [8300.0, 16800.0, 26400.0] * 2
+
+    def test_from_yahoo_csv(self):
+        columns = QuoteStore.from_yahoo_csv("Date,Open,High,Low,Close,Volume,Adj Close\n2015-05-22,88.80,96.57,86.10,96.57,22140100,96.57\n2015-05-21,80.00,88.00,79.00,87.79,1000,87.79\n")
+        assert list(columns["opens"]) == [80.0, 88.8]
+        assert list(columns["volumes"]) == [1000, 22140100]
+        assert list(columns["adj_closes"]) == [87.79, 96.57]
@@ -4,69 +4,202 @@ Created on 24 May 2015
 @author: Univer
 '''
 
-import http.client
-import time
+import os
 import json
+import time
+import threading
+import tempfile
 import unittest
-from quotes.eod_quote import CtxEodQuote
+from quotes.batching import OhlcBatcher, BatchRequestError
 from quotes.loader import QuoteLoader
+from quotes.fingerprints import QuoteFingerprintIndex
+from quotes.watermarks import QuoteWatermarks
 from symbols.symbols import Symbols
 from common.logging import Logger
+from common.pipeline import Pipeline
 
 class QuoteUpdater(object):
-
+    '''
+    Updates eod_quotes from ctxalgo.com through a pipeline of three stages connected by bounded queues:
+    fetch downloads multi-symbol responses, decode splits them into one EodQuoteBatch per symbol and write inserts the batches.
+    Each stage has its own threads, so that the stages overlap and an update takes about the time of its slowest stage.
+    '''
     logger = Logger.get_logger(__name__)
+    full_history_start_date = "1900-01-01"
 
-    def __init__(self):
+    def __init__(self, fingerprints = None, watermarks = None, fetch_workers = 4, decode_workers = 2, write_workers = 4):
         '''
-        Constructor
+        Only quotes which are new or changed since they were last written are inserted, according to
+        the given QuoteFingerprintIndex or the one in its default folder.
+        Each symbol is fetched from the day after its watermark in the given QuoteWatermarks or the ones in their default file.
         '''
-        self.quote_loader = QuoteLoader() 
+        self.watermarks = watermarks if watermarks != None else QuoteWatermarks()
+        self.quote_loader = QuoteLoader(batch_rows = 50, fingerprints = fingerprints if fingerprints != None else QuoteFingerprintIndex(), watermarks = self.watermarks)
+        self.batcher = OhlcBatcher()
+        self.fetch_workers = fetch_workers
+        self.decode_workers = decode_workers
+        self.write_workers = write_workers
+        self.failed_symbols = []
         
     def connect(self):
         self.quote_loader.connect()
                 
     def disconnect(self):
         self.quote_loader.disconnect()
+
+    def iter_symbol_groups(self, groups, end_date):
+        '''
+        Yields (start date, symbols) requests for each group of symbols sharing a start date, sized by the batcher.
+        Each request is sized when the fetch stage takes it, so that later requests are sized with the responses seen so far.
+        '''
+        for start_date in sorted(groups):
+            remaining = list(groups[start_date])
+            while len(remaining) > 0:
+                size = self.batcher.get_batch_size(start_date, end_date)
+                yield start_date, remaining[:size]
+                remaining = remaining[size:]
     
     def update_quotes(self, symbols, start_date):
-        conn = http.client.HTTPConnection("ctxalgo.com")
-        url = "/api/ohlc/%s?start-date=%s&end-date=%s" % (",".join(symbols), start_date, time.strftime("%Y-%m-%d"))
-        print(url)
-        conn.request("GET", url)
-        response_body = conn.getresponse().read().decode("utf-8")
-        loaded_json = json.loads(response_body)
-        
-        eod_quotes = []
-        
-        symbol_count = 0
-        for symbol in loaded_json:
-            symbol_count = symbol_count + 1
-            arrays = loaded_json[symbol]
-            for index, value in enumerate(arrays["dates"]):
-                date = arrays["dates"][index]
-                open_ = arrays["opens"][index]
-                high = arrays["highs"][index]
-                low = arrays["lows"][index]
-                close = arrays["closes"][index]
-                volume = arrays["volumes"][index]
-                amount = arrays["amounts"][index]
-                
-                eod_quote = CtxEodQuote(symbol, date, open_, high, low, close, volume, amount)
-                eod_quotes.append(eod_quote)
-                self.quote_loader.insert_eod_quote(eod_quote)
+        '''
+        Fetches all symbols from start_date, and returns the number of quotes inserted or unchanged
+        '''
+        return self.update_groups({ start_date: list(symbols) })
+
+    def update_groups(self, groups):
+        '''
+        Fetches the symbols of each group from the start date of the group, skipping groups starting after today
+
+        Parameters
+        ----------
+        groups : dict of str : list of str
+            Symbols by the date ("%Y-%m-%d") to fetch them from
+
+        Returns
+        -------
+        count : int
+            The number of quotes inserted or unchanged. The symbols which failed to be fetched or decoded are left in failed_symbols.
+        '''
+        end_date = time.strftime("%Y-%m-%d")
+        groups = dict((start_date, symbols) for start_date, symbols in groups.items() if start_date <= end_date and len(symbols) > 0)
+        lock = threading.Lock()
+        counts = { "quotes": 0, "symbols": 0 }
+        failed = set()
+
+        def fetch(request):
+            start_date, symbol_group = request
+            for batch_result in self.batcher.fetch(symbol_group, start_date, end_date, self.batcher.download):
+                if batch_result.error == None:
+                    yield batch_result.symbols, batch_result.batches
+                else:
+                    with lock:
+                        failed.update(batch_result.symbols)
 
-        QuoteUpdater.logger.info("Updated %d quotes for %d symbols between %s and today" % (len(eod_quotes), symbol_count, start_date))
+        def decode(response):
+            symbols, response_body = response
+            decoded = set()
+            try:
+                for batch in OhlcBatcher.decode(response_body):
+                    decoded.add(batch.symbol)
+                    yield batch
+            except Exception as e:
+                undecoded = [symbol for symbol in symbols if symbol not in decoded]
+                QuoteUpdater.logger.error("Failed to decode quotes for %s: %s" % (", ".join(undecoded), e))
+                with lock:
+                    failed.update(undecoded)
 
-    def update_all_quotes(self, start_date):
-        stocks = Symbols.fetch_all_ctx_stocks()
-        chunks = [stocks[x: x + 50] for x in range(0, len(stocks), 50)]
-        for chunk in chunks:
-            symbols = map(lambda stock : stock.symbol, chunk)
-            self.update_quotes(symbols, start_date)
+        def write(batch):
+            eod_quote_count = self.quote_loader.insert_eod_quotes(batch)
+            with lock:
+                counts["quotes"] = counts["quotes"] + eod_quote_count
+                counts["symbols"] = counts["symbols"] + 1
+            return []
+
+        pipeline = Pipeline("update")
+        pipeline.add_stage("fetch", fetch, self.fetch_workers)
+        pipeline.add_stage("decode", decode, self.decode_workers)
+        pipeline.add_stage("write", write, self.write_workers, queue_size = 4 * self.write_workers)
+        pipeline.run(self.iter_symbol_groups(groups, end_date))
+        pipeline.log_stats()
+        self.watermarks.save()
+        self.failed_symbols = sorted(failed)
+
+        QuoteUpdater.logger.info("Updated %d quotes for %d symbols from %d start date(s) in %.1fs, %d symbol(s) failed" \
+                                 % (counts["quotes"], counts["symbols"], len(groups), pipeline.elapsed, len(self.failed_symbols)))
+        return counts["quotes"]
+
+    def update_all_quotes(self, start_date = None):
+        '''
+        Updates all symbols from start_date if given, otherwise each symbol from the day after its watermark,
+        or its full history if it has none
+        '''
+        symbols = [stock.symbol for stock in Symbols.fetch_all_ctx_stocks()]
+        if start_date != None:
+            return self.update_quotes(symbols, start_date)
+        return self.update_groups(self.watermarks.group_by_start_date(symbols, QuoteUpdater.full_history_start_date))
 
 
 class QuoteUpdaterTests(unittest.TestCase):
+
+    class FakeBatcher(OhlcBatcher):
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.requests = []
+
+        def download(self, symbols, start_date, end_date):
+            self.requests.append((start_date, list(symbols)))
+            if "sz999999" in symbols:
+                raise BatchRequestError("failed")
+            if "sz888888" in symbols:
+                return b'{"sz888888": {"dates": ["2015-05-21T00:00:00"], "opens": [8.1'
+            return json.dumps(dict((symbol, { "dates": ["2015-05-21T00:00:00", "2015-05-22T00:00:00"], "opens": [8.1, 8.2], "highs": [8.5, 8.6],
+                                              "lows": [8.0, 8.1], "closes": [8.3, 8.4], "volumes": [1000, 2000], "amounts": [8300.0, 16800.0] })
+                                   for symbol in symbols)).encode("utf-8")
+
+    class FakeSession(object):
+
+        def __init__(self):
+            self.rows = []
+            self._lock = threading.Lock()
+
+        def prepare(self, cql):
+            return cql
+
+        def execute_async(self, statement, parameters = None):
+            with self._lock:
+                self.rows.append(parameters)
+            return self
+
+        def add_callbacks(self, callback, errback, callback_args = (), errback_args = ()):
+            callback(None, *callback_args)
+
+    def test_update_quotes_offline(self):
+        folder = tempfile.mkdtemp()
+        try:
+            watermarks = QuoteWatermarks(os.path.join(folder, "watermarks.json"))
+            quote_updater = QuoteUpdater(QuoteFingerprintIndex(folder), watermarks)
+            quote_updater.quote_loader.session = QuoteUpdaterTests.FakeSession()
+            quote_updater.quote_loader.batch_rows = None
+            quote_updater.batcher = QuoteUpdaterTests.FakeBatcher(max_symbols = 3)
+            symbols = ["sh6000%02d" % x for x in range(10)] + ["sz999999"]
+            assert quote_updater.update_quotes(symbols, "2015-05-20") == 20
+            assert len(quote_updater.quote_loader.session.rows) == 20
+            assert quote_updater.update_quotes(symbols, "2015-05-20") == 20
+            assert len(quote_updater.quote_loader.session.rows) == 20
+            assert watermarks.get("sh600000") == "2015-05-22"
+            assert watermarks.get("sz999999") == None
+            assert quote_updater.failed_symbols == ["sz999999"]
+            quote_updater.batcher.requests = []
+            assert quote_updater.update_groups(watermarks.group_by_start_date(symbols, "1900-01-01")) == 20
+            assert sorted(set(start_date for start_date, _ in quote_updater.batcher.requests)) == ["1900-01-01", "2015-05-23"]
+
+            quote_updater.batcher = QuoteUpdaterTests.FakeBatcher(max_symbols = 1)
+            assert quote_updater.update_quotes(["sz888888", "sh600000"], "2015-05-20") == 2
+            assert quote_updater.failed_symbols == ["sz888888"]
+        finally:
+            for file_name in os.listdir(folder):
+                os.remove(os.path.join(folder, file_name))
+            os.rmdir(folder)
     
     def test_update_quotes(self):
         quote_updater = QuoteUpdater()
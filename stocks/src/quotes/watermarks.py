@@ -0,0 +1,134 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import json
+import time
+import threading
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from common.logging import Logger
+from common.files import AtomicFileWriter
+
+class QuoteWatermarks(object):
+    '''
+    Last date of the quotes stored in eod_quotes for each symbol, kept in a local JSON file,
+    so that updates fetch each symbol from the day after its own watermark.
+    Watermarks only move forward, and can be rebuilt from Cassandra.
+    '''
+    logger = Logger.get_logger(__name__)
+    default_file = os.path.join(os.path.expanduser("~"), ".stocks", "watermarks.json")
+    select_cql = "select max(date) as last_date from eod_quotes where symbol = ?"
+
+    def __init__(self, watermark_file = None, save_interval = 5.0):
+        self.watermark_file = watermark_file if watermark_file != None else QuoteWatermarks.default_file
+        self.save_interval = save_interval
+        self._watermarks = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._saved = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.watermark_file):
+            return
+        try:
+            with open(self.watermark_file, "r") as watermark_file:
+                watermarks = json.load(watermark_file)
+            with self._lock:
+                self._watermarks = dict((symbol, str(last_date)) for symbol, last_date in watermarks.items())
+        except (ValueError, TypeError, AttributeError) as e:
+            QuoteWatermarks.logger.warning("Ignoring corrupt watermarks %s: %s" % (self.watermark_file, e))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            folder = os.path.dirname(os.path.abspath(self.watermark_file))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            content = json.dumps(self._watermarks, sort_keys = True)
+            with AtomicFileWriter(self.watermark_file) as binary_file:
+                binary_file.write(content.encode("utf-8"))
+            self._dirty = False
+            self._saved = time.time()
+
+    def get(self, symbol):
+        with self._lock:
+            return self._watermarks.get(symbol)
+
+    def advance(self, symbol, last_date):
+        '''
+        Moves the watermark of a symbol to last_date ("%Y-%m-%d") if it is later, saving the watermarks if they were not saved within the save interval
+        '''
+        with self._lock:
+            current = self._watermarks.get(symbol)
+            if current != None and current >= last_date:
+                return
+            self._watermarks[symbol] = last_date
+            self._dirty = True
+            if time.time() - self._saved >= self.save_interval:
+                self.save()
+
+    def get_start_date(self, symbol, default_start_date):
+        '''
+        Returns the day after the watermark of a symbol, or default_start_date if it has none
+        '''
+        last_date = self.get(symbol)
+        if last_date == None:
+            return default_start_date
+        return (datetime.strptime(last_date, "%Y-%m-%d") + timedelta(days = 1)).strftime("%Y-%m-%d")
+
+    def group_by_start_date(self, symbols, default_start_date):
+        '''
+        Returns the symbols grouped by the date their update starts from, as a dict of start date to symbols
+        '''
+        groups = {}
+        for symbol in symbols:
+            groups.setdefault(self.get_start_date(symbol, default_start_date), []).append(symbol)
+        return groups
+
+    def rebuild(self, session, symbols):
+        '''
+        Replaces the watermarks of the symbols with the last date stored in Cassandra
+        '''
+        statement = session.prepare(QuoteWatermarks.select_cql)
+        with self._lock:
+            for symbol in symbols:
+                row = session.execute(statement, (symbol,)).one()
+                last_date = row.last_date if row != None else None
+                if last_date == None:
+                    self._watermarks.pop(symbol, None)
+                else:
+                    last_date = last_date.date() if hasattr(last_date, "date") else last_date
+                    self._watermarks[symbol] = last_date.strftime("%Y-%m-%d")
+            self._dirty = True
+            self.save()
+
+
+class QuoteWatermarksTests(unittest.TestCase):
+
+    def setUp(self):
+        self.watermark_file = os.path.join(tempfile.mkdtemp(), "watermarks.json")
+
+    def tearDown(self):
+        if os.path.exists(self.watermark_file):
+            os.remove(self.watermark_file)
+        os.rmdir(os.path.dirname(self.watermark_file))
+
+    def test_advance_and_group(self):
+        watermarks = QuoteWatermarks(self.watermark_file)
+        watermarks.advance("sh600399", "2015-05-22")
+        watermarks.advance("sh600399", "2015-05-21")
+        watermarks.advance("sz000807", "2015-05-22")
+        watermarks.advance("sh600000", "2015-05-25")
+        watermarks.save()
+
+        watermarks = QuoteWatermarks(self.watermark_file)
+        assert watermarks.get("sh600399") == "2015-05-22"
+        groups = watermarks.group_by_start_date(["sh600399", "sz000807", "sh600000", "sh600001"], "1900-01-01")
+        assert groups == { "2015-05-23": ["sh600399", "sz000807"], "2015-05-26": ["sh600000"], "1900-01-01": ["sh600001"] }
@@ -0,0 +1,152 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import bisect
+import threading
+import unicodedata
+import collections
+import unittest
+from common.logging import Logger
+
+try:
+    import pypinyin
+except ImportError:
+    pypinyin = None
+
+class SymbolIndex(object):
+    '''
+    In-memory index of the stock universe for offline symbol search.
+    Symbols (e.g. 600399, sh600399 or 600399.SS) are looked up by prefix in a sorted key list,
+    and names by substring of the name, of its pinyin or of its pinyin initials (e.g. "fstg" for 抚顺特钢).
+    Pinyin is only indexed if pypinyin is installed.
+    Results of lookups, and of the network searches made for patterns the index does not know, are memoized.
+    '''
+    logger = Logger.get_logger(__name__)
+    Entry = collections.namedtuple("Entry", ["ctx_symbol", "short_symbol", "name", "yahoo_symbol"])
+
+    def __init__(self, stocks = (), yahoo_symbols = None, max_memoized = 4096):
+        '''
+        Parameters
+        ----------
+        stocks : list of Symbols.CtxStock
+            The stocks to index
+
+        yahoo_symbols : dict of str : str, default None
+            The Yahoo symbol of each ctxalgo symbol known, e.g. from the symbols table
+        '''
+        yahoo_symbols = yahoo_symbols if yahoo_symbols != None else {}
+        self.max_memoized = max_memoized
+        self.entries = tuple(SymbolIndex.Entry(stock.symbol, stock.short_symbol, stock.name, yahoo_symbols.get(stock.symbol)) for stock in stocks)
+        keys = []
+        self._names = []
+        for position, entry in enumerate(self.entries):
+            for key in set([entry.short_symbol, entry.ctx_symbol, entry.yahoo_symbol]):
+                if key != None:
+                    keys.append((SymbolIndex.normalize(key), position))
+            if entry.name != None:
+                self._names.append((position,) + SymbolIndex.get_name_keys(entry.name))
+        keys.sort()
+        self._keys = [key for key, _ in keys]
+        self._key_positions = [position for _, position in keys]
+        self._lock = threading.Lock()
+        self._memoized = collections.OrderedDict()
+        self._remembered = {}
+
+    @staticmethod
+    def normalize(text):
+        '''
+        Folds full-width characters and case, and removes spaces
+        '''
+        return unicodedata.normalize("NFKC", text).lower().replace(" ", "")
+
+    @staticmethod
+    def get_name_keys(name):
+        '''
+        Returns the normalized name, its pinyin and its pinyin initials, the last two empty without pypinyin
+        '''
+        name = SymbolIndex.normalize(name)
+        if pypinyin == None:
+            return name, "", ""
+        syllables = pypinyin.lazy_pinyin(name)
+        return name, "".join(syllables), "".join(syllable[:1] for syllable in syllables)
+
+    def _memoize(self, key, found):
+        with self._lock:
+            self._memoized[key] = found
+            self._memoized.move_to_end(key)
+            while len(self._memoized) > self.max_memoized:
+                self._memoized.popitem(last = False)
+
+    def find(self, pattern, limit = 20):
+        '''
+        Returns the entries matching a pattern: symbols starting with it first, then names containing it
+        '''
+        key = SymbolIndex.normalize(pattern)
+        if len(key) == 0:
+            return []
+        with self._lock:
+            found = self._memoized.get((key, limit))
+        if found != None:
+            return list(found)
+
+        positions = []
+        index = bisect.bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index].startswith(key) and len(positions) < limit:
+            if self._key_positions[index] not in positions:
+                positions.append(self._key_positions[index])
+            index = index + 1
+        for position, name, pinyin, initials in self._names:
+            if len(positions) >= limit:
+                break
+            if position not in positions and (key in name or (len(pinyin) > 0 and (key in pinyin or key in initials))):
+                positions.append(position)
+
+        found = tuple(self.entries[position] for position in positions)
+        self._memoize((key, limit), found)
+        return list(found)
+
+    def remember(self, pattern, yahoo_symbols):
+        '''
+        Memoizes the Yahoo symbols found on the network for a pattern the index has no match for
+        '''
+        with self._lock:
+            self._remembered[SymbolIndex.normalize(pattern)] = tuple(yahoo_symbols)
+
+    def get_remembered(self, pattern):
+        '''
+        Returns the Yahoo symbols remembered for a pattern, or None if it was not searched on the network
+        '''
+        with self._lock:
+            remembered = self._remembered.get(SymbolIndex.normalize(pattern))
+        return list(remembered) if remembered != None else None
+
+
+class SymbolIndexTests(unittest.TestCase):
+
+    CtxStock = collections.namedtuple("CtxStock", ["symbol", "name", "short_symbol"])
+    stocks = [CtxStock("sh600399", "抚顺特钢", "600399"), CtxStock("sz000807", "云铝股份", "000807"), CtxStock("sh600339", "*ST油工", "600339"),
+              CtxStock("sh600000", "浦发银行", "600000")]
+
+    def test_find(self):
+        index = SymbolIndex(SymbolIndexTests.stocks, { "sh600399": "600399.SS", "sz000807": "000807.SZ" })
+        assert [entry.ctx_symbol for entry in index.find("6003")] == ["sh600339", "sh600399"]
+        assert [entry.yahoo_symbol for entry in index.find("600399")] == ["600399.SS"]
+        assert [entry.ctx_symbol for entry in index.find("SZ000807")] == ["sz000807"]
+        assert [entry.ctx_symbol for entry in index.find("000807.sz")] == ["sz000807"]
+        assert [entry.ctx_symbol for entry in index.find("*st")] == ["sh600339"]
+        assert [entry.ctx_symbol for entry in index.find("特钢")] == ["sh600399"]
+        assert [entry.ctx_symbol for entry in index.find("６００３９９")] == ["sh600399"]
+        assert len(index.find("6", limit = 2)) == 2
+        assert index.find("999999") == []
+        if pypinyin != None:
+            assert [entry.ctx_symbol for entry in index.find("fstg")] == ["sh600399"]
+            assert [entry.ctx_symbol for entry in index.find("pufa")] == ["sh600000"]
+
+    def test_remember(self):
+        index = SymbolIndex(SymbolIndexTests.stocks)
+        assert index.get_remembered("中国平安") == None
+        index.remember("中国平安", ["601318.SS"])
+        assert index.get_remembered("中国平安") == ["601318.SS"]
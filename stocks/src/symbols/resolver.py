@@ -0,0 +1,246 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import json
+import time
+import calendar
+import threading
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from common.logging import Logger
+from common.files import AtomicFileWriter
+from common.scheduler import RequestScheduler
+
+class YahooSymbolResolver(object):
+    '''
+    Resolves ctxalgo symbols (e.g. sh600399) to Yahoo symbols (e.g. 600399.SS).
+    Resolutions are cached in a local JSON file with a time to live, and can be seeded from the Cassandra symbols table.
+    On a cache miss all candidate suffixes are probed in parallel, and the remaining probes are cancelled once one succeeds.
+    generation is incremented whenever a Yahoo symbol is learned, so that views of the cache such as the symbol index know when to rebuild.
+    '''
+    logger = Logger.get_logger(__name__)
+    host = "ichart.finance.yahoo.com"
+    default_cache_file = os.path.join(os.path.expanduser("~"), ".stocks", "yahoo_symbols.json")
+
+    def __init__(self, cache_file = None, ttl = 30 * 24 * 3600, not_found_ttl = 24 * 3600, workers = 8, scheduler = None):
+        self.cache_file = cache_file if cache_file != None else YahooSymbolResolver.default_cache_file
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.scheduler = scheduler if scheduler != None else RequestScheduler.get_default()
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self.generation = 0
+        self.load()
+
+    @staticmethod
+    def get_candidates(ctx_symbol):
+        test_yahoo_symbols = []
+        if ctx_symbol.startswith("sh"):
+            test_yahoo_symbols.append(ctx_symbol[2:] + ".SH")
+        elif ctx_symbol.startswith("sz"):
+            test_yahoo_symbols.append(ctx_symbol[2:] + ".SZ")
+
+        test_yahoo_symbols.append(ctx_symbol[2:] + ".SS")
+        return test_yahoo_symbols
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as cache_file:
+                cache = json.load(cache_file)
+            with self._lock:
+                for ctx_symbol, (yahoo_symbol, resolved_time) in cache.items():
+                    self._cache[ctx_symbol] = (yahoo_symbol, resolved_time)
+                self.generation = self.generation + 1
+        except (ValueError, TypeError) as e:
+            YahooSymbolResolver.logger.warning("Ignoring corrupt symbol cache %s: %s" % (self.cache_file, e))
+
+    def save(self):
+        folder = os.path.dirname(os.path.abspath(self.cache_file))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with self._lock:
+            content = json.dumps(self._cache, sort_keys = True)
+        with AtomicFileWriter(self.cache_file) as binary_file:
+            binary_file.write(content.encode("utf-8"))
+
+    def seed_from_cassandra(self, cassandra_session):
+        '''
+        Adds the mappings stored in the symbols table which are newer than the cached ones
+        '''
+        count = 0
+        for row in cassandra_session.execute("select ctx_symbol, yahoo_symbol, update_timestamp from symbols"):
+            if row.update_timestamp == None:
+                continue
+            resolved_time = calendar.timegm(row.update_timestamp.utctimetuple())
+            with self._lock:
+                cached = self._cache.get(row.ctx_symbol)
+                if cached == None or cached[1] < resolved_time:
+                    self._cache[row.ctx_symbol] = (row.yahoo_symbol, resolved_time)
+                    self.generation = self.generation + 1
+                    count = count + 1
+        YahooSymbolResolver.logger.info("Seeded %d symbol mapping(s) from Cassandra" % count)
+
+    def get_cached(self, ctx_symbol):
+        '''
+        Returns the cached (yahoo_symbol, resolved_time) of a symbol, or None if it is not cached or has expired
+        '''
+        with self._lock:
+            cached = self._cache.get(ctx_symbol)
+        if cached == None:
+            return None
+        ttl = self.ttl if cached[0] != None else self.not_found_ttl
+        if cached[1] + ttl < time.time():
+            return None
+        return cached
+
+    def is_cached(self, ctx_symbol):
+        return self.get_cached(ctx_symbol) != None
+
+    def probe(self, yahoo_symbol, cancelled):
+        '''
+        Checks whether Yahoo has quotes for the symbol by reading only the response headers and the first bytes of the body
+        '''
+        if cancelled.is_set():
+            return False
+        return self.scheduler.request(YahooSymbolResolver.host, "/table.csv?s=%s" % yahoo_symbol,
+                                      lambda response: response.status == 200 and not cancelled.is_set() and response.read(4) == b"Date",
+                                      keep_alive = False)
+
+    def probe_all(self, ctx_symbol):
+        '''
+        Probes all candidate Yahoo symbols in parallel, and returns the first candidate in the order of get_candidates which was found, or None.
+        Lower priority probes are cancelled once a candidate is found.
+        Raises the error of a probe which failed before the candidate returned, or of any probe if none was found,
+        so that a network failure is not cached as not found, and a symbol always resolves to the same candidate.
+        '''
+        cancelled = threading.Event()
+        candidates = YahooSymbolResolver.get_candidates(ctx_symbol)
+        futures = [self.executor.submit(self.probe, candidate, cancelled) for candidate in candidates]
+        errors = []
+        try:
+            for candidate, future in zip(candidates, futures):
+                try:
+                    found = future.result()
+                except Exception as e:
+                    YahooSymbolResolver.logger.debug("Failed to probe %s: %s" % (candidate, e))
+                    errors.append(e)
+                    continue
+                if found:
+                    if len(errors) > 0:
+                        raise errors[-1]
+                    return candidate
+            if len(errors) > 0:
+                raise errors[-1]
+            return None
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+    def resolve(self, ctx_symbol, save = True):
+        cached = self.get_cached(ctx_symbol)
+        if cached != None:
+            return cached[0]
+
+        yahoo_symbol = self.probe_all(ctx_symbol)
+        with self._lock:
+            self._cache[ctx_symbol] = (yahoo_symbol, time.time())
+            if yahoo_symbol != None:
+                self.generation = self.generation + 1
+        if save:
+            self.save()
+        return yahoo_symbol
+
+    def resolve_all(self, ctx_symbols, workers = 8):
+        '''
+        Resolves many symbols, probing the ones not cached with the given number of symbols in flight, and saves the cache once at the end
+
+        Returns
+        -------
+        yahoo_symbols : dict of str : str
+            The Yahoo symbol of each ctxalgo symbol, None if not found or if probing failed
+        '''
+        def resolve(ctx_symbol):
+            try:
+                return self.resolve(ctx_symbol, save = False)
+            except Exception as e:
+                YahooSymbolResolver.logger.warning("Failed to resolve %s: %s" % (ctx_symbol, e))
+                return None
+
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            yahoo_symbols = dict(zip(ctx_symbols, executor.map(resolve, ctx_symbols)))
+        self.save()
+        return yahoo_symbols
+
+    def close(self):
+        self.executor.shutdown(wait = False)
+
+
+class YahooSymbolResolverTests(unittest.TestCase):
+
+    class FakeResolver(YahooSymbolResolver):
+
+        def __init__(self, existing, failing = [], slow = [], **kwargs):
+            super().__init__(**kwargs)
+            self.existing = existing
+            self.failing = failing
+            self.slow = slow
+            self.probed = []
+
+        def probe(self, yahoo_symbol, cancelled):
+            if yahoo_symbol in self.slow:
+                cancelled.wait(5)
+            if cancelled.is_set():
+                return False
+            self.probed.append(yahoo_symbol)
+            if yahoo_symbol in self.failing:
+                raise OSError("connection reset")
+            return yahoo_symbol in self.existing
+
+    def setUp(self):
+        self.cache_file = os.path.join(tempfile.mkdtemp(), "yahoo_symbols.json")
+
+    def tearDown(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rmdir(os.path.dirname(self.cache_file))
+
+    def test_resolve_cancels_other_probes(self):
+        resolver = YahooSymbolResolverTests.FakeResolver(["600399.SH", "600399.SS"], slow = ["600399.SS"], cache_file = self.cache_file)
+        started = time.time()
+        assert resolver.resolve("sh600399") == "600399.SH"
+        assert time.time() - started < 5
+        assert resolver.probed == ["600399.SH"]
+        resolver.close()
+
+    def test_resolve_in_priority_order(self):
+        resolver = YahooSymbolResolverTests.FakeResolver(["600399.SS"], cache_file = self.cache_file)
+        assert resolver.probe_all("sh600399") == "600399.SS"
+        resolver.close()
+
+        resolver = YahooSymbolResolverTests.FakeResolver(["600399.SS"], failing = ["600399.SH"], cache_file = self.cache_file)
+        with self.assertRaises(OSError):
+            resolver.resolve("sh600399")
+        assert not resolver.is_cached("sh600399")
+        resolver.close()
+
+    def test_cache_with_ttl(self):
+        resolver = YahooSymbolResolverTests.FakeResolver(["000807.SZ"], cache_file = self.cache_file)
+        assert resolver.resolve_all(["sz000807", "sz999999"]) == { "sz000807": "000807.SZ", "sz999999": None }
+        resolver.close()
+
+        resolver = YahooSymbolResolverTests.FakeResolver([], cache_file = self.cache_file)
+        assert resolver.resolve("sz000807") == "000807.SZ"
+        assert resolver.probed == []
+        resolver.ttl = -1
+        assert not resolver.is_cached("sz000807")
+        assert resolver.is_cached("sz999999")
+        resolver.close()
@@ -4,13 +4,16 @@ Created on 23 May 2015
 @author: Univer
 '''
 
-import http.client
+import os
 import unittest
-import json
 import re
-import collections
+import tempfile
 from common.logging import Logger
 from common.cassandra import CassandraSession
+from common.scheduler import RequestScheduler
+from symbols.resolver import YahooSymbolResolver
+from symbols.universe import SymbolUniverse
+from symbols.index import SymbolIndex
 
 class Symbols(object):
     
@@ -18,7 +21,11 @@ class Symbols(object):
     classdocs
     '''
     logger = Logger.get_logger(__name__)
-    CtxStock = collections.namedtuple("CtxStock", ["symbol", "name", "short_symbol"], verbose = False)
+    CtxStock = SymbolUniverse.CtxStock
+    yahoo_symbol_resolver = None
+    symbol_universe = None
+    symbol_index = None
+    symbol_index_generation = None
 
     def __init__(self):
         '''
@@ -26,38 +33,70 @@ class Symbols(object):
         '''
     
     @staticmethod
-    def fetch_all_ctx_stocks():
-        try:
-            Symbols.logger.info("Creating connection to ctxalgo.com ...")
-            conn = http.client.HTTPConnection("ctxalgo.com", timeout = 5000)
-            Symbols.logger.info("Fetching stock list from /api/stocks ...")
-            conn.request("GET", "/api/stocks")
-            response = conn.getresponse().read().decode("utf-8")
-            Symbols.logger.debug("Response size is %d bytes" % len(response))
-            
-            stocks = []
-            loaded_json = json.loads(response)
-            for symbol in loaded_json:
-                name = loaded_json[symbol]
-                stocks.append(Symbols.CtxStock(symbol, name, symbol[2:]))
-            return stocks
-        except:
-            return []
+    def get_symbol_universe():
+        if Symbols.symbol_universe == None:
+            Symbols.symbol_universe = SymbolUniverse()
+        return Symbols.symbol_universe
+
+    @staticmethod
+    def fetch_all_ctx_stocks(force = False):
+        '''
+        Returns the stocks of the cached symbol universe, refreshed if it expired or force is True
+        '''
+        return Symbols.get_symbol_universe().get_stocks(force)
+
+    @staticmethod
+    def get_symbol_index(cassandra_session = None, rebuild = False):
+        '''
+        Returns the index of the cached symbol universe and the Yahoo symbols already resolved,
+        after seeding them from the symbols table if a Cassandra session is given.
+        The index is rebuilt once the resolver learned new Yahoo symbols.
+        '''
+        resolver = Symbols.get_yahoo_symbol_resolver()
+        if Symbols.symbol_index == None or rebuild or cassandra_session != None or Symbols.symbol_index_generation != resolver.generation:
+            if cassandra_session != None:
+                resolver.seed_from_cassandra(cassandra_session)
+            generation = resolver.generation
+            stocks = Symbols.fetch_all_ctx_stocks()
+            yahoo_symbols = {}
+            for stock in stocks:
+                cached = resolver.get_cached(stock.symbol)
+                if cached != None and cached[0] != None:
+                    yahoo_symbols[stock.symbol] = cached[0]
+            Symbols.symbol_index = SymbolIndex(stocks, yahoo_symbols)
+            Symbols.symbol_index_generation = generation
+        return Symbols.symbol_index
 
     @staticmethod
     def search(pattern):
-        symbol = Symbols.search_from_yahoo(pattern)
-        if symbol != None:
-            return [symbol]
-        else:
-            return Symbols.search_from_sina(pattern)
+        '''
+        Returns the Yahoo symbols of the stocks matching a pattern in the symbol index, without any request if any of them is resolved.
+        Otherwise the stocks matched are resolved, and Yahoo and Sina are searched if none was found, once per pattern.
+        '''
+        index = Symbols.get_symbol_index()
+        entries = index.find(pattern)
+        yahoo_symbols = [entry.yahoo_symbol for entry in entries if entry.yahoo_symbol != None]
+        if len(yahoo_symbols) > 0:
+            return yahoo_symbols
+
+        symbols = index.get_remembered(pattern)
+        if symbols == None:
+            symbols = []
+            if len(entries) > 0:
+                resolved = Symbols.get_yahoo_symbol_resolver().resolve_all([entry.ctx_symbol for entry in entries])
+                symbols = [resolved[entry.ctx_symbol] for entry in entries if resolved[entry.ctx_symbol] != None]
+            if len(symbols) == 0:
+                symbol = Symbols.search_from_yahoo(pattern)
+                symbols = [symbol] if symbol != None else Symbols.search_from_sina(pattern)
+            if len(symbols) > 0:
+                index.remember(pattern, symbols)
+        return symbols
 
     @staticmethod
     def search_from_yahoo(pattern):
         try:
-            conn = http.client.HTTPConnection("d.yimg.com", timeout = 5000)
-            conn.request("GET", "/aq/autoc?query=%s&region=US&lang=en-US&callback=YAHOO.util.ScriptNodeDataSource.callbacks" % pattern)
-            response = conn.getresponse().read().decode("utf-8")
+            url = "/aq/autoc?query=%s&region=US&lang=en-US&callback=YAHOO.util.ScriptNodeDataSource.callbacks" % pattern
+            response = RequestScheduler.get_default().request("d.yimg.com", url, lambda response: response.read().decode("utf-8"))
             matched = re.search('(?<="symbol":")[0-9]{6}.[A-Z]{2}', response)
             
             if matched != None:
@@ -68,41 +107,29 @@ class Symbols(object):
             return None
 
     @staticmethod
-    def get_yahoo_symbol_from_ctx_symbol(ctx_symbol):
-        test_yahoo_symbols = []
-        if ctx_symbol.startswith("sh"):
-            test_yahoo_symbols.append(ctx_symbol[2:] + ".SH")
-        elif ctx_symbol.startswith("sz"):
-            test_yahoo_symbols.append(ctx_symbol[2:] + ".SZ")
+    def get_yahoo_symbol_resolver():
+        if Symbols.yahoo_symbol_resolver == None:
+            Symbols.yahoo_symbol_resolver = YahooSymbolResolver()
+        return Symbols.yahoo_symbol_resolver
 
-        test_yahoo_symbols.append(ctx_symbol[2:] + ".SS")
-        
-        for test_yahoo_symbol in test_yahoo_symbols:
-            try:
-                conn = http.client.HTTPConnection("ichart.finance.yahoo.com")
-                conn.request("GET", "/table.csv?s=%s" % test_yahoo_symbol)
-                
-                if conn.getresponse().read(4).decode("utf-8") == "Date":
-                    return test_yahoo_symbol
-            except:
-                return None
-            
-        return None
+    @staticmethod
+    def get_yahoo_symbol_from_ctx_symbol(ctx_symbol):
+        try:
+            return Symbols.get_yahoo_symbol_resolver().resolve(ctx_symbol)
+        except:
+            return None
 
     @staticmethod
     def search_from_sina(pattern):
         symbols = []
         try:
-            conn = http.client.HTTPConnection("suggest3.sinajs.cn", timeout = 10000)
-            conn.request("GET", "/suggest/type=11,12,13,14,15&key=%s" % pattern)
-            response = conn.getresponse().read().decode("gbk")
+            scheduler = RequestScheduler.get_default()
+            response = scheduler.request("suggest3.sinajs.cn", "/suggest/type=11,12,13,14,15&key=%s" % pattern, lambda response: response.read().decode("gbk"))
             matched = re.search("\"(.*)\"", response)
             if matched != None:
                 for item in matched.group(1).split(";"):
                     code = item.split(",")[3]
-                    conn = http.client.HTTPConnection("finance.sina.com.cn")
-                    conn.request("GET", "/realstock/company/%s/nc.shtml" % code)
-                    response = conn.getresponse().read().decode("gbk")
+                    response = scheduler.request("finance.sina.com.cn", "/realstock/company/%s/nc.shtml" % code, lambda response: response.read().decode("gbk"))
                     search_pattern = "<span>(" + pattern + "."
                     start_index = response.index(search_pattern) + len("<span>(")
                     symbol = response[start_index:start_index + len(pattern) + 3]
@@ -132,6 +159,50 @@ class SymbolsTests(unittest.TestCase):
         result_600399 = Symbols.search("600399")[0]
         assert result_600399 == "600399.SS"
     
+    class FakeUniverse(object):
+
+        def __init__(self, stocks):
+            self.stocks = stocks
+
+        def get_stocks(self, force = False):
+            return list(self.stocks)
+
+    class FakeResolver(YahooSymbolResolver):
+
+        def __init__(self, existing, **kwargs):
+            super().__init__(**kwargs)
+            self.existing = existing
+            self.probed = []
+
+        def probe(self, yahoo_symbol, cancelled):
+            self.probed.append(yahoo_symbol)
+            return yahoo_symbol in self.existing
+
+    def test_search_from_index(self):
+        saved = (Symbols.symbol_universe, Symbols.yahoo_symbol_resolver, Symbols.symbol_index, Symbols.symbol_index_generation)
+        cache_file = os.path.join(tempfile.mkdtemp(), "yahoo_symbols.json")
+        resolver = SymbolsTests.FakeResolver(["600399.SS", "600339.SS"], cache_file = cache_file)
+        try:
+            Symbols.symbol_universe = SymbolsTests.FakeUniverse([Symbols.CtxStock("sh600339", "*ST油工", "600339"), Symbols.CtxStock("sh600399", "抚顺特钢", "600399")])
+            Symbols.yahoo_symbol_resolver = resolver
+            Symbols.symbol_index = None
+            resolver.resolve("sh600399")
+            resolver.probed = []
+            assert Symbols.search("6003") == ["600399.SS"]
+            assert resolver.probed == []
+
+            assert Symbols.search("600339") == ["600339.SS"]
+            assert Symbols.get_symbol_index().find("600339")[0].yahoo_symbol == "600339.SS"
+            resolver.probed = []
+            assert Symbols.search("6003") == ["600339.SS", "600399.SS"]
+            assert resolver.probed == []
+        finally:
+            Symbols.symbol_universe, Symbols.yahoo_symbol_resolver, Symbols.symbol_index, Symbols.symbol_index_generation = saved
+            resolver.close()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            os.rmdir(os.path.dirname(cache_file))
+
     def test_search_from_sina(self):
         pattern = "000807"
         result = Symbols.search_from_sina(pattern);
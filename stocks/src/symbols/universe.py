@@ -0,0 +1,185 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import os
+import json
+import time
+import zlib
+import threading
+import collections
+import tempfile
+import unittest
+from common.logging import Logger
+from common.files import AtomicFileWriter
+from common.scheduler import RequestScheduler, RequestError
+
+class SymbolUniverse(object):
+    '''
+    The list of all stocks from ctxalgo.com/api/stocks, cached in a local JSON file with a time to live.
+    Once the cache expired the list is requested again with the ETag and Last-Modified of the cached copy,
+    and is only parsed again if the server sent a list which differs from it.
+    If the request fails or returns no stocks, the last good copy is used however old it is.
+    '''
+    logger = Logger.get_logger(__name__)
+    host = "ctxalgo.com"
+    url = "/api/stocks"
+    default_cache_file = os.path.join(os.path.expanduser("~"), ".stocks", "ctx_stocks.json")
+    CtxStock = collections.namedtuple("CtxStock", ["symbol", "name", "short_symbol"])
+    Response = collections.namedtuple("Response", ["status", "etag", "last_modified", "body"])
+
+    def __init__(self, cache_file = None, ttl = 12 * 3600, scheduler = None):
+        self.cache_file = cache_file if cache_file != None else SymbolUniverse.default_cache_file
+        self.ttl = ttl
+        self.scheduler = scheduler if scheduler != None else RequestScheduler.get_default()
+        self._lock = threading.Lock()
+        self._stocks = ()
+        self._fetched = 0
+        self._etag = None
+        self._last_modified = None
+        self._checksum = None
+        self.load()
+
+    @staticmethod
+    def to_stocks(pairs):
+        return tuple(SymbolUniverse.CtxStock(symbol, name, symbol[2:]) for symbol, name in sorted(pairs))
+
+    @staticmethod
+    def read_response(response):
+        body = response.read()
+        return SymbolUniverse.Response(response.status, response.getheader("ETag"), response.getheader("Last-Modified"), body)
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as cache_file:
+                cache = json.load(cache_file)
+            self._stocks = SymbolUniverse.to_stocks(cache["stocks"])
+            self._fetched = cache["fetched"]
+            self._etag = cache.get("etag")
+            self._last_modified = cache.get("last_modified")
+            self._checksum = cache.get("checksum")
+        except (ValueError, TypeError, KeyError) as e:
+            SymbolUniverse.logger.warning("Ignoring corrupt stock list cache %s: %s" % (self.cache_file, e))
+
+    def save(self):
+        folder = os.path.dirname(os.path.abspath(self.cache_file))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        content = json.dumps({ "fetched": self._fetched, "etag": self._etag, "last_modified": self._last_modified, "checksum": self._checksum,
+                               "stocks": [[stock.symbol, stock.name] for stock in self._stocks] })
+        with AtomicFileWriter(self.cache_file) as binary_file:
+            binary_file.write(content.encode("utf-8"))
+
+    def is_expired(self):
+        return time.time() - self._fetched >= self.ttl
+
+    def refresh(self):
+        '''
+        Requests the stock list unless the server reports it unchanged, and caches it if it holds any stock
+
+        Raises
+        ------
+        RequestError : The request failed, or the response held no stock
+        '''
+        headers = {}
+        if len(self._stocks) > 0:
+            if self._etag != None:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified != None:
+                headers["If-Modified-Since"] = self._last_modified
+        SymbolUniverse.logger.info("Fetching stock list from %s%s ..." % (SymbolUniverse.host, SymbolUniverse.url))
+        response = self.scheduler.request(SymbolUniverse.host, SymbolUniverse.url, SymbolUniverse.read_response, headers)
+        if response.status == 304:
+            SymbolUniverse.logger.debug("Stock list not modified")
+        elif response.status != 200:
+            raise RequestError("HTTP %d from %s%s" % (response.status, SymbolUniverse.host, SymbolUniverse.url))
+        else:
+            SymbolUniverse.logger.debug("Response size is %d bytes" % len(response.body))
+            checksum = zlib.crc32(response.body)
+            if checksum != self._checksum or len(self._stocks) == 0:
+                try:
+                    stocks = SymbolUniverse.to_stocks(json.loads(response.body.decode("utf-8")).items())
+                except (ValueError, AttributeError) as e:
+                    raise RequestError("Invalid stock list from %s%s: %s" % (SymbolUniverse.host, SymbolUniverse.url, e))
+                if len(stocks) == 0:
+                    raise RequestError("Empty stock list from %s%s" % (SymbolUniverse.host, SymbolUniverse.url))
+                self._stocks = stocks
+                self._checksum = checksum
+            self._etag = response.etag
+            self._last_modified = response.last_modified
+        self._fetched = time.time()
+        self.save()
+
+    def get_stocks(self, force = False):
+        '''
+        Returns the CtxStock of every stock, refreshing the cached list first if it expired or force is True.
+        Returns the last good list if the refresh fails, or an empty list if there is none.
+        '''
+        with self._lock:
+            if force or self.is_expired():
+                try:
+                    self.refresh()
+                except (RequestError, OSError) as e:
+                    if len(self._stocks) > 0:
+                        SymbolUniverse.logger.warning("Using the stock list cached %.1f hour(s) ago as fetching it failed: %s" % ((time.time() - self._fetched) / 3600, e))
+                    else:
+                        SymbolUniverse.logger.error("Failed to fetch the stock list: %s" % e)
+            return list(self._stocks)
+
+
+class SymbolUniverseTests(unittest.TestCase):
+
+    class FakeResponse(object):
+
+        def __init__(self, status, body = b"", etag = None):
+            self.status = status
+            self.body = body
+            self.etag = etag
+
+        def read(self):
+            return self.body
+
+        def getheader(self, name):
+            return self.etag if name == "ETag" else None
+
+    class FakeScheduler(object):
+
+        def __init__(self, responses):
+            self.responses = list(responses)
+            self.headers = []
+
+        def request(self, host, url, handler, headers = {}):
+            self.headers.append(dict(headers))
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return handler(response)
+
+    def setUp(self):
+        self.cache_file = os.path.join(tempfile.mkdtemp(), "ctx_stocks.json")
+
+    def tearDown(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rmdir(os.path.dirname(self.cache_file))
+
+    def test_cache_and_fallback(self):
+        body = json.dumps({ "sz000807": "云铝股份", "sh600399": "抚顺特钢" }).encode("utf-8")
+        scheduler = SymbolUniverseTests.FakeScheduler([SymbolUniverseTests.FakeResponse(200, body, '"v1"'), SymbolUniverseTests.FakeResponse(304),
+                                                       RequestError("down"), SymbolUniverseTests.FakeResponse(200, b"{}", '"v2"')])
+        universe = SymbolUniverse(self.cache_file, scheduler = scheduler)
+        stocks = universe.get_stocks()
+        assert stocks == [SymbolUniverse.CtxStock("sh600399", "抚顺特钢", "600399"), SymbolUniverse.CtxStock("sz000807", "云铝股份", "000807")]
+        assert universe.get_stocks() == stocks
+        assert len(scheduler.headers) == 1
+
+        universe = SymbolUniverse(self.cache_file, ttl = 0, scheduler = scheduler)
+        assert universe.get_stocks() == stocks
+        assert scheduler.headers[1] == { "If-None-Match": '"v1"' }
+        assert universe.get_stocks() == stocks
+        assert universe.get_stocks() == stocks
+        assert len(scheduler.responses) == 0
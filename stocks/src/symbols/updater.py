@@ -0,0 +1,161 @@
+'''
+Created on 18 Oct 2026
+
+@author: Univer
+'''
+
+import collections
+import unittest
+from cassandra.query import SimpleStatement
+from cassandra.concurrent import execute_concurrent_with_args
+from common.logging import Logger
+from symbols.symbols import Symbols
+
+class SymbolUpdater(object):
+    '''
+    Brings the symbols table in line with the stock universe.
+    The table is read once and diffed against the stocks, and only new stocks, the ones whose name changed
+    and the ones left without a Yahoo symbol once the resolver's cache of them expired are resolved and written, concurrently,
+    so that a run without changes writes nothing.
+
+    Usage:
+        diff = SymbolUpdater().update(cassandra_session.session, Symbols.fetch_all_ctx_stocks())
+    '''
+    logger = Logger.get_logger(__name__)
+    select_cql = "select ctx_symbol, yahoo_symbol, name, short_symbol from symbols"
+    insert_cql = "insert into symbols (ctx_symbol, yahoo_symbol, name, short_symbol, update_timestamp) values (?, ?, ?, ?, dateof(now()))"
+    delete_cql = "delete from symbols where ctx_symbol = ?"
+    Diff = collections.namedtuple("Diff", ["added", "removed", "changed"])
+
+    def __init__(self, resolver = None, fetch_size = 5000, concurrency = 64):
+        self.resolver = resolver if resolver != None else Symbols.get_yahoo_symbol_resolver()
+        self.fetch_size = fetch_size
+        self.concurrency = concurrency
+
+    def read_stored(self, session):
+        '''
+        Returns the rows of the symbols table by ctx_symbol, read in pages of fetch_size rows
+        '''
+        rows = session.execute(SimpleStatement(SymbolUpdater.select_cql, fetch_size = self.fetch_size))
+        return dict((row.ctx_symbol, row) for row in rows)
+
+    @staticmethod
+    def diff(stocks, stored):
+        '''
+        Returns the stocks not stored, the stored symbols which are no longer stocks, and the stocks stored with another name or short symbol
+        '''
+        added = []
+        changed = []
+        for stock in stocks:
+            row = stored.get(stock.symbol)
+            if row == None:
+                added.append(stock)
+            elif row.name != stock.name or row.short_symbol != stock.short_symbol:
+                changed.append(stock)
+        symbols = set(stock.symbol for stock in stocks)
+        removed = sorted(ctx_symbol for ctx_symbol in stored if ctx_symbol not in symbols)
+        return SymbolUpdater.Diff(added, removed, changed)
+
+    def execute_all(self, session, cql, parameters):
+        '''
+        Executes a statement for each set of parameters concurrently, and returns the number of failed executions
+        '''
+        if len(parameters) == 0:
+            return 0
+        results = execute_concurrent_with_args(session, session.prepare(cql), parameters, concurrency = self.concurrency, raise_on_first_error = False)
+        failed = 0
+        for success, result in results:
+            if not success:
+                SymbolUpdater.logger.error("Failed to update symbols: %s" % result)
+                failed = failed + 1
+        return failed
+
+    def update(self, session, stocks, delete_removed = False):
+        '''
+        Writes the new and changed stocks to the symbols table, and deletes the removed ones if delete_removed is True.
+        The Yahoo symbol of a changed stock is kept if it was resolved, new stocks are resolved.
+        Unchanged stocks stored without a Yahoo symbol are resolved and written again once the resolver no longer caches them.
+
+        Returns
+        -------
+        diff : SymbolUpdater.Diff
+        '''
+        stored = self.read_stored(session)
+        diff = SymbolUpdater.diff(stocks, stored)
+        yahoo_symbols = dict((stock.symbol, stored[stock.symbol].yahoo_symbol) for stock in diff.changed)
+        written = set(stock.symbol for stock in diff.added + diff.changed)
+        expired = [stock for stock in stocks if stock.symbol not in written and stored[stock.symbol].yahoo_symbol == None
+                   and not self.resolver.is_cached(stock.symbol)]
+        unresolved = [stock.symbol for stock in diff.added + expired] + [ctx_symbol for ctx_symbol, yahoo_symbol in yahoo_symbols.items() if yahoo_symbol == None]
+        if len(unresolved) > 0:
+            yahoo_symbols.update(self.resolver.resolve_all(unresolved))
+
+        parameters = [(stock.symbol, yahoo_symbols[stock.symbol], stock.name, stock.short_symbol) for stock in diff.added + diff.changed + expired]
+        failed = self.execute_all(session, SymbolUpdater.insert_cql, parameters)
+        if delete_removed:
+            failed = failed + self.execute_all(session, SymbolUpdater.delete_cql, [(ctx_symbol,) for ctx_symbol in diff.removed])
+
+        SymbolUpdater.logger.info("%d stock(s): %d added, %d removed%s, %d changed, %d resolved again, %d write(s) failed" \
+                                  % (len(stocks), len(diff.added), len(diff.removed), " and deleted" if delete_removed else "", len(diff.changed), len(expired), failed))
+        return diff
+
+
+class SymbolUpdaterTests(unittest.TestCase):
+
+    Row = collections.namedtuple("Row", ["ctx_symbol", "yahoo_symbol", "name", "short_symbol"])
+
+    class FakeResolver(object):
+
+        def __init__(self, cached = ()):
+            self.resolved = []
+            self.cached = set(cached)
+
+        def is_cached(self, ctx_symbol):
+            return ctx_symbol in self.cached
+
+        def resolve_all(self, ctx_symbols):
+            self.resolved.extend(ctx_symbols)
+            return dict((ctx_symbol, ctx_symbol[2:] + ".SS") for ctx_symbol in ctx_symbols)
+
+    class FakeUpdater(SymbolUpdater):
+
+        def __init__(self, rows, resolver):
+            super().__init__(resolver)
+            self.rows = rows
+            self.executed = []
+
+        def read_stored(self, session):
+            return dict((row.ctx_symbol, row) for row in self.rows)
+
+        def execute_all(self, session, cql, parameters):
+            self.executed.append((cql, parameters))
+            return 0
+
+    def test_update(self):
+        Row = SymbolUpdaterTests.Row
+        rows = [Row("sh600399", "600399.SS", "抚顺特钢", "600399"), Row("sz000807", None, "云铝", "000807"), Row("sh600001", "600001.SS", "邯郸钢铁", "600001")]
+        stocks = [Symbols.CtxStock("sh600399", "抚顺特钢", "600399"), Symbols.CtxStock("sz000807", "云铝股份", "000807"), Symbols.CtxStock("sh600000", "浦发银行", "600000")]
+        resolver = SymbolUpdaterTests.FakeResolver()
+        updater = SymbolUpdaterTests.FakeUpdater(rows, resolver)
+        diff = updater.update(None, stocks, delete_removed = True)
+        assert [stock.symbol for stock in diff.added] == ["sh600000"]
+        assert diff.removed == ["sh600001"]
+        assert [stock.symbol for stock in diff.changed] == ["sz000807"]
+        assert sorted(resolver.resolved) == ["sh600000", "sz000807"]
+        assert updater.executed == [(SymbolUpdater.insert_cql, [("sh600000", "600000.SS", "浦发银行", "600000"), ("sz000807", "000807.SS", "云铝股份", "000807")]),
+                                    (SymbolUpdater.delete_cql, [("sh600001",)])]
+
+        updater.rows = [Row(stock.symbol, stock.short_symbol + ".SS", stock.name, stock.short_symbol) for stock in stocks]
+        updater.executed = []
+        diff = updater.update(None, stocks)
+        assert len(diff.added) + len(diff.removed) + len(diff.changed) == 0
+        assert updater.executed == [(SymbolUpdater.insert_cql, [])]
+
+        updater.rows = [Row(stock.symbol, None, stock.name, stock.short_symbol) for stock in stocks]
+        updater.executed = []
+        resolver.resolved = []
+        resolver.cached = set(["sh600399"])
+        diff = updater.update(None, stocks)
+        assert len(diff.added) + len(diff.removed) + len(diff.changed) == 0
+        assert resolver.resolved == ["sz000807", "sh600000"]
+        assert updater.executed == [(SymbolUpdater.insert_cql, [("sz000807", "000807.SS", "云铝股份", "000807"), ("sh600000", "600000.SS", "浦发银行", "600000")])]